@@ -0,0 +1,68 @@
+"""Compare the size and load time of parsed users written as JSON, JSON
+Lines and Parquet, loading everything and just the columns and rows an
+analysis would need.
+
+    python -m benchmarks.bench_columnar --events 200000
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import make_lines
+from innovation_networks.data_gathering.github import columnar, parse_users
+from innovation_networks.data_gathering.github.json_stream import write_jsonl
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark columnar output")
+    parser.add_argument('--events', type=int, default=200000)
+    args = parser.parse_args()
+
+    users = parse_users.parse_lines(make_lines(args.events))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, 'users.json')
+        jsonl_path = os.path.join(tmp, 'users.jsonl')
+        parquet_path = os.path.join(tmp, 'users.parquet')
+        with open(json_path, 'w') as fp:
+            json.dump(users, fp)
+        with open(jsonl_path, 'w') as fp:
+            write_jsonl(users, fp)
+        columnar.write_users(users, parquet_path)
+
+        def load_json():
+            with open(json_path) as fp:
+                json.load(fp)
+
+        def london_json():
+            with open(json_path) as fp:
+                [x['user'] for x in json.load(fp) if isinstance(x, dict)
+                 and x['attributes'].get('location') == 'London']
+
+        runs = [('json', json_path, load_json, london_json),
+                ('parquet', parquet_path,
+                 lambda: columnar.read_table(parquet_path),
+                 lambda: columnar.read_table(
+                     parquet_path, columns=['user'],
+                     filters=[('location', '=', 'London')]))]
+
+        print('{} users, jsonl {:.1f} MB'.format(
+            len(users), os.path.getsize(jsonl_path) / 1e6))
+        print('{:<8} {:>9} {:>10} {:>16}'.format('format', 'MB', 'load s',
+                                                'London users s'))
+        for name, path, load, query in runs:
+            print('{:<8} {:>9.1f} {:>10.3f} {:>16.3f}'.format(
+                name, os.path.getsize(path) / 1e6, timed(load), timed(query)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Compare fetching the events of some users from an event index with
+scanning the whole archive for them, and measure building the index.
+
+    python -m benchmarks.bench_event_index --hours 8 --events 20000 --lookups 500
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.synthetic import write_hours
+from innovation_networks.data_gathering.github.archive_io import open_events
+from innovation_networks.data_gathering.github.event_index import EventIndex, build_index
+from innovation_networks.data_gathering.github.events import EventFilter, event_login
+from innovation_networks.data_gathering.github.json_backend import get_loads
+
+
+def scan(datafiles, logins, loads):
+    """Events by logins, found by decoding every event"""
+    found = 0
+    for datafile in datafiles:
+        with open_events(datafile) as fp:
+            for event in EventFilter().decode(fp, loads):
+                if event_login(event) in logins:
+                    found += 1
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the event index")
+    parser.add_argument('--hours', type=int, default=8,
+                        help='hourly archives to generate')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='events per archive')
+    parser.add_argument('--users', type=int, default=10000,
+                        help='distinct logins in the events')
+    parser.add_argument('--lookups', type=int, default=500,
+                        help='users whose events to fetch')
+    parser.add_argument('--no-compress', action='store_true',
+                        help='store blocks uncompressed')
+    args = parser.parse_args()
+
+    loads = get_loads('auto')
+    rng = random.Random(1)
+    logins = {'user{}'.format(x)
+              for x in rng.sample(range(args.users), args.lookups)}
+    with tempfile.TemporaryDirectory() as tmp:
+        names, size = write_hours(tmp, args.hours, args.events,
+                                  n_users=args.users)
+        datafiles = [os.path.join(tmp, x) for x in names]
+        compressed = sum(os.path.getsize(x) for x in datafiles)
+        path = os.path.join(tmp, 'index')
+
+        start = time.perf_counter()
+        meta = build_index(datafiles, path, compress=not args.no_compress)
+        build_seconds = time.perf_counter() - start
+        index_bytes = sum(os.path.getsize(os.path.join(path, x))
+                          for x in os.listdir(path))
+        print('Built index of {:,} events in {:.2f}s, {:.1f} MB/s '
+              'uncompressed; {:.1f} MB on disk against {:.1f} MB of '
+              'archive'.format(meta['events'], build_seconds,
+                               size / 1e6 / build_seconds, index_bytes / 1e6,
+                               compressed / 1e6))
+
+        start = time.perf_counter()
+        found = scan(datafiles, logins, loads)
+        scan_seconds = time.perf_counter() - start
+        print('Scan: {:,} events of {} users in {:.3f}s'.format(
+            found, len(logins), scan_seconds))
+
+        start = time.perf_counter()
+        with EventIndex(path) as index:
+            looked_up = sum(1 for _ in index.events_of(logins))
+            blocks = index.summary()
+        lookup_seconds = time.perf_counter() - start
+        print('Index: {:,} events of {} users in {:.3f}s, reading {} of {} '
+              'blocks, {:.0f}x faster'.format(
+                  looked_up, len(logins), lookup_seconds,
+                  blocks['blocks_read'], blocks['blocks'],
+                  scan_seconds / max(lookup_seconds, 1e-9)))
+        assert looked_up == found
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Compare events/second for picking out event types by decoding every
+line against screening lines with an EventFilter first.
+
+    python -m benchmarks.bench_events --events 200000
+"""
+
+import argparse
+import time
+
+from benchmarks.synthetic import make_lines
+from innovation_networks.data_gathering.github import json_backend
+from innovation_networks.data_gathering.github.events import EventFilter, NETWORK_TYPES
+
+
+def decode_all(lines, types, loads):
+    """Decode every line and check its type afterwards"""
+    return [x for x in map(loads, lines) if x.get('type') in types]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event filtering")
+    parser.add_argument('--events', type=int, default=200000)
+    args = parser.parse_args()
+
+    lines = make_lines(args.events)
+    backends = ['json'] + (['orjson'] if json_backend.orjson else [])
+    cases = [('network types', NETWORK_TYPES), ('ForkEvent', ['ForkEvent'])]
+    for backend in backends:
+        loads = json_backend.get_loads(backend)
+        for name, types in cases:
+            start = time.perf_counter()
+            n = len(decode_all(lines, set(types), loads))
+            full = time.perf_counter() - start
+            event_filter = EventFilter(types, ['login', 'repo'])
+            start = time.perf_counter()
+            assert len(list(event_filter(lines, loads))) == n
+            screened = time.perf_counter() - start
+            print('{:<7} {:<14} {:>6.1%} match  decode all {:>10,.0f}/s  '
+                  'screened {:>10,.0f}/s  x{:.1f}'.format(
+                      backend, name, n / args.events, args.events / full,
+                      args.events / screened, full / screened))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""Compare MB/s of parsing a concatenated multi-member .json.gz directly
+against decompressing it to disk first and parsing the plain file.
+
+    python -m benchmarks.bench_gzip_read --members 24 --events 20000
+"""
+
+import argparse
+import contextlib
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from benchmarks.synthetic import make_lines
+from innovation_networks.data_gathering.github import parse_users
+
+
+def decompress_then_parse(path, tmp):
+    """The old workflow: gunzip to disk, then parse the text file"""
+    plain = os.path.join(tmp, 'plain.json')
+    with gzip.open(path, 'rb') as src, open(plain, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    parse_users.make_user_list(plain)
+    os.remove(plain)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark gzip reading")
+    parser.add_argument('--members', type=int, default=24,
+                        help='number of hourly archives concatenated')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='events per archive')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.json.gz')
+        size = 0
+        with open(path, 'wb') as fp:
+            for member in range(args.members):
+                lines = make_lines(args.events, seed=member)
+                size += sum(len(x) for x in lines)
+                fp.write(gzip.compress(b''.join(lines)))
+
+        runs = [('decompress then parse',
+                 lambda: decompress_then_parse(path, tmp)),
+                ('direct gzip read',
+                 lambda: parse_users.make_user_list(path)),
+                ('parallel members x{}'.format(args.processes),
+                 lambda: parse_users.make_user_list_parallel(
+                     [path], args.processes, 'json'))]
+
+        print('{:.1f} MB uncompressed, {:.1f} MB compressed'.format(
+            size / 1e6, os.path.getsize(path) / 1e6))
+        for name, func in runs:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                func()
+            seconds = time.perf_counter() - start
+            print('{:<28} {:>8.1f} MB/s'.format(name, size / 1e6 / seconds))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Compare events/second for the original single loop parser against
+parse_users.make_user_list and the parallel parser with each JSON backend.
+
+    python -m benchmarks.bench_parse_users --events 200000 --processes 4
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.synthetic import write_archive
+from innovation_networks.data_gathering.github import json_backend, parse_users
+
+
+def legacy_make_user_list(datafile):
+    """make_user_list as it was before the parallel parser, printing
+    progress for every event"""
+    users = []
+    with open(datafile, 'r') as fp:
+        x = 1
+        for line in fp:
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError:
+                data = {}
+            if 'actor' in data:
+                if "actor_attributes" in data:
+                    out_data = {'user': data['actor'],
+                                'attributes': data['actor_attributes']}
+                else:
+                    out_data = {'user': data['actor']['login'],
+                                'attributes': data['actor']}
+                users.append(out_data)
+            elif "login" in data.get("sender", {}):
+                users.append(data["sender"]["login"])
+            print('Parsed {} GitHub Events'.format(x), end='\r')
+            x += 1
+            sys.stdout.flush()
+    return users
+
+
+def timed(func, *args, **kwargs):
+    """Run func with its progress output hidden, returning seconds taken"""
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark parse_users")
+    parser.add_argument('--events', type=int, default=100000)
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    backends = ['json'] + (['orjson'] if json_backend.orjson else [])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'events.json')
+        write_archive(path, args.events)
+
+        results = [('original', timed(legacy_make_user_list, path))]
+        for backend in backends:
+            results.append(('make_user_list ({})'.format(backend),
+                            timed(parse_users.make_user_list, path, backend)))
+            results.append(('parallel x{} ({})'.format(args.processes, backend),
+                            timed(parse_users.make_user_list_parallel, [path],
+                                  args.processes, backend)))
+
+    for name, seconds in results:
+        print('{:<30} {:>12,.0f} events/s'.format(name, args.events / seconds))
+
+
+if __name__ == "__main__":
+    main()
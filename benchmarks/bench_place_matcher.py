@@ -0,0 +1,55 @@
+"""Compare location strings/second for the original list scan in
+users_at_location against PlaceMatcher.
+
+    python -m benchmarks.bench_place_matcher --locations 1000000
+"""
+
+import argparse
+import re
+import time
+
+from benchmarks.synthetic import make_locations
+from innovation_networks.data_gathering.github.pipeline import ERROR_NAMES, PLACE_NAMES
+from innovation_networks.data_gathering.github.place_matcher import PlaceMatcher, read_names
+
+
+def list_scan(locations, towns_and_cities, error_names):
+    """users_at_location before PlaceMatcher: a list membership test for
+    every word, then the exclusions"""
+    new_york = re.compile(r'new york')
+    matched = []
+    for location in locations:
+        for word in location.lower().split():
+            if word in towns_and_cities:
+                matched.append(location)
+    matched = [x for x in matched if not new_york.findall(x.lower())]
+    return [x for x in matched if x.lower() not in error_names]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark PlaceMatcher")
+    parser.add_argument('--locations', type=int, default=1000000)
+    args = parser.parse_args()
+
+    locations = make_locations(args.locations)
+    towns_and_cities = read_names(PLACE_NAMES)
+    error_names = read_names(ERROR_NAMES)
+
+    start = time.perf_counter()
+    list_scan(locations, towns_and_cities, error_names)
+    original = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = PlaceMatcher(towns_and_cities, error_names)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    [x for x in locations if matcher.matches(x)]
+    compiled = time.perf_counter() - start
+
+    print('{:,} locations, matcher built in {:.4f}s'.format(len(locations), build))
+    print('{:<12} {:>12,.0f} locations/s'.format('list scan', len(locations) / original))
+    print('{:<12} {:>12,.0f} locations/s'.format('PlaceMatcher', len(locations) / compiled))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Measure how filtering users by location scales from 1 to N processes,
+matching place names and, with --resolve, resolving against the
+gazetteer. --save keeps the numbers, with the number of CPUs they were
+measured on, as JSON.
+
+    python -m benchmarks.bench_users_at_location --users 1000000 --processes 8
+"""
+
+import argparse
+import json
+import os
+import platform
+import time
+
+from benchmarks.synthetic import make_locations
+from innovation_networks.data_gathering.github.locations import LocationResolver
+from innovation_networks.data_gathering.github.pipeline import ERROR_NAMES, PLACE_NAMES
+from innovation_networks.data_gathering.github.place_matcher import PlaceMatcher
+from innovation_networks.data_gathering.github.users_at_location import CHUNK_SIZE, filter_parallel, filter_users, resolve_users
+
+
+def make_users(n, unique_locations):
+    """n parsed users with locations drawn from unique_locations strings,
+    varied so most of them are distinct"""
+    locations = make_locations(unique_locations)
+    return [{'user': 'user{}'.format(i),
+             'attributes': {'location': locations[i % len(locations)]}}
+            for i in range(n)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=("Benchmark parallel " +
+                                                  "location filtering"))
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--locations', type=int, default=50000,
+                        help='distinct location strings')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='most processes to try')
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--resolve', action='store_true',
+                        help='resolve against the gazetteer instead')
+    parser.add_argument('--save', default=None,
+                        help='file to save the results to as JSON')
+    args = parser.parse_args()
+
+    users = make_users(args.users, args.locations)
+    matcher = PlaceMatcher.from_files(PLACE_NAMES, ERROR_NAMES)
+
+    def run(processes):
+        resolver = LocationResolver.from_files(
+            error_names_path=ERROR_NAMES) if args.resolve else None
+        start = time.perf_counter()
+        if processes == 0 and resolver is not None:
+            kept = sum(1 for _ in resolve_users(iter(users), resolver))
+        elif processes == 0:
+            kept = sum(1 for _ in filter_users(iter(users), matcher))
+        else:
+            kept = sum(1 for _ in filter_parallel(
+                iter(users), matcher, resolver, processes, args.chunk_size))
+        return time.perf_counter() - start, kept
+
+    serial, kept = run(0)
+    print('{:,} users, {:,} kept on {} CPUs'.format(len(users), kept,
+                                                   os.cpu_count()))
+    print('{:<12} {:>14} {:>8}'.format('processes', 'users/s', 'speedup'))
+    print('{:<12} {:>14,.0f} {:>8.2f}'.format('serial', len(users) / serial,
+                                              1.0))
+    rows = [{'processes': 0, 'seconds': serial, 'speedup': 1.0}]
+    processes = 1
+    while True:
+        seconds, n = run(processes)
+        assert n == kept
+        print('{:<12} {:>14,.0f} {:>8.2f}'.format(
+            processes, len(users) / seconds, serial / seconds))
+        rows.append({'processes': processes, 'seconds': seconds,
+                     'speedup': serial / seconds})
+        if processes >= args.processes:
+            break
+        processes = min(processes * 2, args.processes)
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump({'cpus': os.cpu_count(),
+                       'platform': platform.platform(),
+                       'parameters': vars(args),
+                       'kept': kept,
+                       'results': rows}, fp, indent=1, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""Measure the throughput of verifying shards, in one process and across
+several. Raise --shards and --events to verify a few GB.
+
+    python -m benchmarks.bench_verify --shards 24 --events 20000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.synthetic import write_archive
+from innovation_networks.data_gathering.github.shards import ShardStore, verify_summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shard verification")
+    parser.add_argument('--shards', type=int, default=24,
+                        help='number of hourly shards')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='events per shard')
+    parser.add_argument('--processes', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ShardStore(tmp)
+        keys = ['2016-06-22-{:02d}'.format(x) for x in range(args.shards)]
+        for seed, key in enumerate(keys):
+            os.makedirs(os.path.dirname(store.path(key)), exist_ok=True)
+            write_archive(store.path(key), args.events, seed=seed)
+        store.add(keys, workers=args.processes)
+
+        for workers in sorted({1, args.processes}):
+            start = time.perf_counter()
+            healths = store.verify(keys, workers=workers)
+            summary = verify_summary(list(healths.values()),
+                                     time.perf_counter() - start)
+            print('{} process(es): {:.1f} MB in {:.2f}s, {:.1f} MB/s '
+                  'compressed, {:.1f} MB/s uncompressed, {} damaged'.format(
+                      workers, summary['bytes'] / 1e6, summary['seconds'],
+                      summary['mb_per_second'],
+                      summary['uncompressed_mb_per_second'],
+                      summary['damaged']))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""A local stand-in for the GitHub REST API, for the tests and benchmarks.
+
+Serves /users/{login}/repos and /repos/{owner}/{name} for generated users,
+sends rate limit headers and refuses requests with a 403 once the limit
+for the current window is used up, like GitHub does. Each Authorization
+header gets its own limit. Lists are paginated with Link headers, and
+responses carry an ETag; a matching If-None-Match gets a 304 that doesn't
+count against the limit."""
+
+import hashlib
+import json
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+
+def make_repos(login, n):
+    return [{'id': i, 'name': 'repo{}'.format(i), 'owner': {'login': login},
+             'full_name': '{}/repo{}'.format(login, i)} for i in range(n)]
+
+
+class GitHubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        self.credential = self.headers.get('Authorization')
+        with server.lock:
+            # Failures are keyed by the path, or the path and query
+            key = (self.path if self.path in server.failures
+                   else self.path.split('?')[0])
+            failing = server.failures.get(key, 0)
+            if failing:
+                server.failures[key] = failing - 1
+        status, body, headers = self.route()
+        if failing:
+            status, body = 502, {'message': 'Server Error'}
+        etag = '"{}"'.format(hashlib.md5(json.dumps(body).encode()).hexdigest())
+        with server.lock:
+            server.requests.append(self.path)
+            server.credentials.append(self.credential)
+            now = time.time()
+            if now >= server.reset.get(self.credential, 0):
+                server.remaining[self.credential] = server.limit
+                server.reset[self.credential] = int(now) + server.window
+            if status == 200 and self.headers.get('If-None-Match') == etag:
+                server.not_modified += 1
+                return self.respond(304, None, {'ETag': etag})
+            if server.remaining[self.credential] <= 0:
+                server.refused += 1
+                return self.respond(403, {'message': 'API rate limit exceeded'})
+            server.remaining[self.credential] -= 1
+        headers['ETag'] = etag
+        return self.respond(status, body, headers)
+
+    def route(self):
+        """(status, body, headers) for the requested path"""
+        server = self.server
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        if parts[0] == 'users' and len(parts) == 3 and parts[2] == 'repos':
+            if parts[1] not in server.users:
+                return 404, {'message': 'Not Found'}, {}
+            per_page = int(query.get('per_page', ['30'])[0])
+            page = int(query.get('page', ['1'])[0])
+            repos = make_repos(parts[1], server.users[parts[1]])
+            headers = {}
+            if page * per_page < len(repos):
+                next_url = 'http://{}:{}{}?{}'.format(
+                    *server.server_address, url.path,
+                    urlencode({'per_page': per_page, 'page': page + 1}))
+                headers['Link'] = '<{}>; rel="next"'.format(next_url)
+            return 200, repos[(page - 1) * per_page:page * per_page], headers
+        if parts[0] == 'repos' and len(parts) == 3:
+            if parts[1] not in server.users:
+                return 404, {'message': 'Not Found'}, {}
+            return 200, {'name': parts[2], 'full_name': '/'.join(parts[1:]),
+                         'stargazers_count': 1}, {}
+        return 404, {'message': 'Not Found'}, {}
+
+    def respond(self, status, body, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-RateLimit-Limit', str(self.server.limit))
+        self.send_header('X-RateLimit-Remaining',
+                         str(self.server.remaining[self.credential]))
+        self.send_header('X-RateLimit-Reset',
+                         str(self.server.reset[self.credential]))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    # Clients make many connections at once, and the default backlog of 5
+    # leaves the rest waiting a second for SYN retransmits
+    request_queue_size = 128
+
+
+class MockGitHub(object):
+    """Run the mock API on a free local port. users maps each login to its
+    number of repos. limit requests per credential are allowed every
+    window seconds. failures maps paths, with or without their query
+    string, to the number of times they should fail with a 502 before
+    succeeding."""
+
+    def __init__(self, users, limit=5000, window=3600, latency=0,
+                 failures=None):
+        self.server = MockServer(('127.0.0.1', 0), GitHubHandler)
+        self.server.users = users
+        self.server.limit = limit
+        self.server.remaining = {}
+        self.server.window = window
+        self.server.reset = {}
+        self.server.latency = latency
+        self.server.requests = []
+        self.server.credentials = []
+        self.server.refused = 0
+        self.server.not_modified = 0
+        self.server.failures = dict(failures or {})
+        self.server.lock = threading.Lock()
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_address[1])
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    @property
+    def credentials(self):
+        return self.server.credentials
+
+    @property
+    def refused(self):
+        return self.server.refused
+
+    @property
+    def not_modified(self):
+        return self.server.not_modified
+
+    def reset(self):
+        """Forget the requests made and the rate limits used, as if the
+        server had just started"""
+        with self.server.lock:
+            self.server.remaining.clear()
+            self.server.reset.clear()
+            self.server.requests.clear()
+            self.server.credentials.clear()
+            self.server.refused = 0
+            self.server.not_modified = 0
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,323 @@
+"""Measure each stage of the pipeline end to end against local fixtures,
+and compare with an earlier run.
+
+Synthetic hourly archives, half in the pre 2015 schema and half in the
+new one, are served over HTTP and downloaded by get_data. parse_users,
+users_at_location, get_user_details and repo_details then run on each
+other's output in turn, the last two against the mock GitHub API, with
+its latency and rate limit set from the command line. Each stage runs
+--repeat times, each time in a forked process so its peak memory is its
+own, and the run with the median throughput is kept.
+
+    python -m benchmarks.suite --hours 4 --events 20000 --save results.json
+    python -m benchmarks.suite --baseline results.json
+
+With --baseline, stages whose throughput has fallen by more than
+--tolerance are reported and the exit status is 1. A baseline run with
+different parameters isn't compared against."""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.mock_github import MockGitHub
+from benchmarks.synthetic import write_hours
+from innovation_networks.data_gathering.github.api_client import GitHubClient
+from innovation_networks.data_gathering.github.columnar import read_user_records, write_user_records
+from innovation_networks.data_gathering.github.get_data import sync
+from innovation_networks.data_gathering.github.get_user_details import details
+from innovation_networks.data_gathering.github.metrics import METRICS, peak_rss
+from innovation_networks.data_gathering.github.parse_users import make_unique_users
+from innovation_networks.data_gathering.github.pipeline import ERROR_NAMES, PLACE_NAMES
+from innovation_networks.data_gathering.github.place_matcher import PlaceMatcher
+from innovation_networks.data_gathering.github.repo_details import repo_crawl
+from innovation_networks.data_gathering.github.shards import ShardStore, datafiles_for
+from innovation_networks.data_gathering.github.users_at_location import filter_users
+
+# Parameters that don't change the work each stage does
+RUN_OPTIONS = ('save', 'baseline', 'tolerance')
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve(directory):
+    """Serve the files in directory over HTTP, yielding the base URL"""
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(
+        QuietHandler, directory=directory))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield 'http://127.0.0.1:{}'.format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def measure(func, *args):
+    """Run func(*args), which returns (amount, unit) of work done, in a
+    forked process. Returns its seconds, rate, peak memory above the
+    memory it started with and the shared metrics' counters."""
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+
+    def target():
+        METRICS.reset()
+        baseline = peak_rss()['self']
+        try:
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                amount, unit = func(*args)
+            seconds = time.perf_counter() - start
+            queue.put({'amount': amount,
+                       'unit': unit,
+                       'seconds': seconds,
+                       'rate': amount / max(seconds, 1e-9),
+                       'peak_rss_bytes': peak_rss()['self'],
+                       'extra_rss_bytes': peak_rss()['self'] - baseline,
+                       'counters': METRICS.report()['counters']})
+        except Exception as e:
+            queue.put({'error': repr(e)})
+
+    process = context.Process(target=target)
+    process.start()
+    result = queue.get()
+    process.join()
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+def repeated(repeat, setup, func, *args):
+    """measure func(*args) repeat times, calling setup first each time,
+    and return the result with the median rate. The rates of every run
+    are kept as 'runs'."""
+    results = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        results.append(measure(func, *args))
+    results.sort(key=lambda x: x['rate'])
+    return dict(results[len(results) // 2],
+                runs=[x['rate'] for x in results])
+
+
+def remover(path):
+    """A setup function that removes the directory path, if it's there"""
+    return functools.partial(shutil.rmtree, path, ignore_errors=True)
+
+
+def bench_get_data(base_url, names, store_dir, workers):
+    entries = sync(ShardStore(store_dir),
+                   ['{}/{}'.format(base_url, x) for x in names], workers)
+    return sum(x.get('bytes', 0) for x in entries) / 1e6, 'MB'
+
+
+def bench_parse_users(store_dir, users_path, processes, n_events):
+    # Only the old schema has locations, so they'd be lost if the latest
+    # attributes replaced them
+    unique = make_unique_users(datafiles_for(store_dir), processes,
+                               merge=True)
+    write_user_records(unique.items(), users_path)
+    unique.close()
+    return n_events, 'events'
+
+
+def bench_users_at_location(users_path, located_path):
+    matcher = PlaceMatcher.from_files(PLACE_NAMES, ERROR_NAMES)
+    count = [0]
+
+    def counted(users):
+        for user in users:
+            count[0] += 1
+            yield user
+    write_user_records(filter_users(counted(read_user_records(users_path)),
+                                    matcher), located_path)
+    return count[0], 'users'
+
+
+def client_for(mock_url, concurrency):
+    return GitHubClient(base_url=mock_url, concurrency=concurrency,
+                        credentials=['bench'])
+
+
+def bench_get_user_details(located_path, mock_url, out_path, concurrency):
+    data = list(read_user_records(located_path))
+    result = details(data, 'repos', client=client_for(mock_url, concurrency))
+    with open(out_path, 'w') as fp:
+        json.dump(result, fp)
+    return len(data), 'users'
+
+
+def bench_repo_details(user_repos_path, mock_url, out_path, concurrency):
+    with open(user_repos_path, 'r') as fp:
+        data = json.load(fp)
+    result = repo_crawl(data, client=client_for(mock_url, concurrency),
+                        concurrency=concurrency)
+    with open(out_path, 'w') as fp:
+        json.dump(result, fp)
+    return sum(len(x) for x in data.values()), 'repos'
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    """Run every stage, returning the results document"""
+    results = {}
+    # Every generated login is known to the mock API, with a few repos
+    rng = random.Random(0)
+    users = {'user{}'.format(i): rng.randrange(6) for i in range(args.users)}
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'source')
+        os.mkdir(source)
+        names, size = write_hours(source, args.hours, args.events,
+                                  n_users=args.users)
+        store_dir = os.path.join(tmp, 'github_archive')
+        path = functools.partial(os.path.join, tmp)
+
+        # Each download starts from an empty store, and each crawl with
+        # the mock's rate limits reset
+        with serve(source) as base_url:
+            results['get_data'] = repeated(
+                args.repeat, remover(store_dir), bench_get_data, base_url,
+                names, store_dir, args.workers)
+        results['parse_users'] = repeated(
+            args.repeat, None, bench_parse_users, store_dir,
+            path('users.jsonl'), args.processes, args.hours * args.events)
+        results['users_at_location'] = repeated(
+            args.repeat, None, bench_users_at_location, path('users.jsonl'),
+            path('located.jsonl'))
+        with MockGitHub(users, limit=args.rate_limit, window=args.window,
+                        latency=args.latency) as mock:
+            results['get_user_details'] = repeated(
+                args.repeat, mock.reset, bench_get_user_details,
+                path('located.jsonl'), mock.url, path('user_repos.json'),
+                args.concurrency)
+            results['repo_details'] = repeated(
+                args.repeat, mock.reset, bench_repo_details,
+                path('user_repos.json'), mock.url, path('repo_details.json'),
+                args.concurrency)
+
+    return {'created_at': datetime.utcnow().isoformat(),
+            'commit': git_commit(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'parameters': parameters(args),
+            'uncompressed_mb': size / 1e6,
+            'results': results}
+
+
+def parameters(args):
+    """The parameters of a run, which must match for runs to be compared"""
+    return {k: v for k, v in vars(args).items() if k not in RUN_OPTIONS}
+
+
+def compare(current, baseline, tolerance):
+    """(stage, baseline rate, current rate, change) for stages in both,
+    and the stages whose rate fell by more than tolerance"""
+    rows, regressions = [], []
+    for stage, result in current['results'].items():
+        if stage not in baseline['results']:
+            continue
+        old = baseline['results'][stage]['rate']
+        change = result['rate'] / old - 1 if old else 0
+        rows.append((stage, old, result['rate'], change))
+        if change < -tolerance:
+            regressions.append(stage)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark every stage")
+    parser.add_argument('--hours', type=int, default=4,
+                        help='hourly archives to generate')
+    parser.add_argument('--events', type=int, default=20000,
+                        help='events per archive')
+    parser.add_argument('--users', type=int, default=2000,
+                        help='distinct logins in the events')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='concurrent downloads')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='parse_users processes')
+    parser.add_argument('--concurrency', type=int, default=16,
+                        help='concurrent API requests')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds the mock API takes to answer')
+    parser.add_argument('--rate-limit', type=int, default=5000,
+                        help='mock API requests allowed each window')
+    parser.add_argument('--window', type=int, default=3600,
+                        help='seconds in each mock rate limit window')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='runs of each stage, the median is kept')
+    parser.add_argument('--save', default=None,
+                        help='file to save the results to as JSON')
+    parser.add_argument('--baseline', default=None,
+                        help='results saved by an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='fall in throughput reported as a regression')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as fp:
+            baseline = json.load(fp)
+        old, new = baseline.get('parameters', {}), parameters(args)
+        changed = sorted(k for k in set(old) | set(new)
+                         if old.get(k) != new.get(k))
+        if changed:
+            # Throughput on different work isn't comparable
+            parser.error('{} was run with different parameters: {}'.format(
+                args.baseline, ', '.join('{} {} not {}'.format(
+                    k, old.get(k), new.get(k)) for k in changed)))
+
+    current = run(args)
+    print('{:<20} {:>22} {:>10} {:>10}'.format('stage', 'rate', 'seconds',
+                                               'extra MB'))
+    for stage, result in current['results'].items():
+        print('{:<20} {:>12,.1f} {:<9} {:>10.2f} {:>10.1f}'.format(
+            stage, result['rate'], result['unit'] + '/s', result['seconds'],
+            result['extra_rss_bytes'] / 1e6))
+
+    if args.save:
+        with open(args.save, 'w') as fp:
+            json.dump(current, fp, indent=1, sort_keys=True)
+
+    if baseline is not None:
+        rows, regressions = compare(current, baseline, args.tolerance)
+        print('\nAgainst {} ({})'.format(args.baseline, baseline.get('commit')))
+        for stage, old, new, change in rows:
+            print('{:<20} {:>10,.1f} -> {:>10,.1f} {:>+7.1%}{}'.format(
+                stage, old, new, change,
+                '  REGRESSION' if stage in regressions else ''))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Synthetic GitHub Archive events for benchmarking.
+
+Events are shaped like the real archive: before 2015 the actor is a login
+string with an actor_attributes object, from 2015 the actor is an object.
+Payloads are padded so lines are roughly the size of real events."""
+
+import gzip
+import json
+import os
+import random
+
+from datetime import datetime, timedelta
+
+EVENT_TYPES = ['PushEvent', 'CreateEvent', 'WatchEvent', 'IssueCommentEvent',
+               'PullRequestEvent', 'ForkEvent', 'IssuesEvent', 'DeleteEvent']
+
+LOCATIONS = ['London', 'London, UK', 'Manchester', 'Milton Keynes',
+             'New York, NY', 'Cambridge, MA', 'San Francisco', 'Berlin',
+             'Edinburgh, Scotland', 'York', '']
+
+
+def make_event(rng, n_users=10000, n_repos=20000, old_schema=None):
+    """A single random event as a dict"""
+    login = 'user{}'.format(rng.randrange(n_users))
+    owner = 'user{}'.format(rng.randrange(n_users))
+    repo = '{}/repo{}'.format(owner, rng.randrange(n_repos))
+    if old_schema is None:
+        old_schema = rng.random() < 0.5
+    event = {'type': rng.choice(EVENT_TYPES),
+             'public': True,
+             'created_at': '2014-06-14T12:05:27-07:00',
+             'payload': {'size': 1,
+                         'ref': 'refs/heads/master',
+                         'head': '{:040x}'.format(rng.getrandbits(160)),
+                         'shas': [['{:040x}'.format(rng.getrandbits(160)),
+                                   login + '@example.com',
+                                   'x' * rng.randrange(50, 400),
+                                   login, True]]}}
+    attributes = {'login': login,
+                  'type': 'User',
+                  'gravatar_id': '{:032x}'.format(rng.getrandbits(128)),
+                  'name': login.title(),
+                  'company': '',
+                  'blog': '',
+                  'location': rng.choice(LOCATIONS),
+                  'email': login + '@example.com'}
+    if old_schema:
+        event['actor'] = login
+        event['actor_attributes'] = attributes
+        event['repository'] = {'name': repo.split('/')[1], 'owner': owner,
+                               'url': 'https://github.com/' + repo}
+    else:
+        event['actor'] = {'id': int(login[4:]), 'login': login,
+                          'gravatar_id': attributes['gravatar_id'],
+                          'url': 'https://api.github.com/users/' + login}
+        event['repo'] = {'id': rng.randrange(10 ** 8), 'name': repo,
+                         'url': 'https://api.github.com/repos/' + repo}
+    return event
+
+
+def make_lines(n, seed=0, **kwargs):
+    """n encoded event lines"""
+    rng = random.Random(seed)
+    return [(json.dumps(make_event(rng, **kwargs)) + '\n').encode()
+            for _ in range(n)]
+
+
+def write_archive(path, n, seed=0, **kwargs):
+    """Write n events to path, gzipped if path ends in .gz. Returns the
+    number of uncompressed bytes written."""
+    lines = make_lines(n, seed, **kwargs)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wb') as fp:
+        fp.writelines(lines)
+    return sum(len(x) for x in lines)
+
+
+def write_hours(directory, hours, events, seed=0, **kwargs):
+    """Write hours hourly archives of events each to directory, named as
+    GitHub Archive names them. The first half are from 2014 in the old
+    schema, the rest from 2015 in the new one. Returns the file names and
+    the number of uncompressed bytes written."""
+    names = []
+    size = 0
+    for i in range(hours):
+        old_schema = i < hours / 2
+        hour = datetime(2014 if old_schema else 2015, 6, 1) + timedelta(hours=i)
+        names.append(hour.strftime('%Y-%m-%d-%H') + '.json.gz')
+        size += write_archive(os.path.join(directory, names[-1]), events,
+                              seed=seed + i, old_schema=old_schema, **kwargs)
+    return names, size
+
+
+def make_locations(n, seed=0):
+    """n free text location strings mixing real places, noise words and
+    punctuation in roughly the proportions seen in GitHub profiles"""
+    rng = random.Random(seed)
+    places = LOCATIONS + ['Newcastle upon Tyne', 'Stoke-on-Trent',
+                          'Paris, France', 'Tokyo', 'Remote', 'Earth',
+                          'Brighton and Hove', 'Bangalore, India']
+    noise = ['area', 'greater', 'uk', 'usa', 'based', 'near', 'city', 'the']
+    locations = []
+    for _ in range(n):
+        words = [rng.choice(places)]
+        for _ in range(rng.randrange(3)):
+            words.append(rng.choice(noise))
+        rng.shuffle(words)
+        locations.append(rng.choice([' ', ', ', ' / ']).join(words))
+    return locations
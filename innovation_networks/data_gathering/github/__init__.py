@@ -1,6 +1,26 @@
 __all__ = [
+    "github.api_client",
+    "github.archive_io",
+    "github.columnar",
+    "github.crawl_state",
+    "github.download",
+    "github.event_index",
+    "github.events",
     "github.get_data",
+    "github.graphql",
+    "github.http_cache",
+    "github.interning",
+    "github.json_backend",
+    "github.json_stream",
+    "github.locations",
+    "github.metrics",
+    "github.network",
     "github.parse_users",
+    "github.pipeline",
+    "github.place_matcher",
+    "github.repo_crawler",
+    "github.shards",
+    "github.unique_users",
     "github.get_user_details",
 ]
 
@@ -0,0 +1,287 @@
+"""A shared, rate limit aware client for the GitHub API.
+
+Requests go through one pooled session and run concurrently on a bounded
+pool of threads. Rather than a fixed calls-per-hour decorator, the client
+schedules requests from the X-RateLimit-Remaining and X-RateLimit-Reset
+headers GitHub returns: each credential has a bucket of tokens that is
+refilled when its rate limit window resets, and a request only goes out
+when it can take a token. That uses the whole quota without hitting 403s.
+
+With several credentials, each request is sent with whichever has the
+most budget left, and the client only sleeps once all are exhausted.
+
+Given an HTTPCache, requests for URLs seen before are made conditional, so
+unchanged resources come back as 304s that cost no quota. Paginated lists
+are fetched 100 items a page, following the Link headers."""
+
+import logging
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import requests
+
+from .download import make_session
+from .metrics import METRICS
+
+API_URL = 'https://api.github.com'
+
+
+class RateLimit(object):
+    """Token bucket for one credential, kept in step with GitHub's rate
+    limit headers"""
+
+    def __init__(self, remaining=None, reset=None, clock=time.time,
+                 sleep=time.sleep):
+        # None until the first response tells us
+        self.remaining = remaining
+        self.reset = reset
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    def wait_time(self, cost=1):
+        """Seconds until cost tokens are available, 0 if they are now"""
+        if self.remaining is None or self.remaining >= cost:
+            return 0
+        if self.reset is None:
+            return 60
+        if self.clock() >= self.reset:
+            return 0
+        return self.reset - self.clock() + 1
+
+    def try_acquire(self, cost=1):
+        """Take cost tokens if there are enough. Returns the seconds to
+        wait before trying again, or 0 if the tokens were taken."""
+        with self.lock:
+            if self.remaining is not None and self.remaining < cost:
+                if self.reset is not None and self.clock() >= self.reset:
+                    # The window has rolled over, the next response will
+                    # tell us the new limit
+                    self.remaining, self.reset = None, None
+                else:
+                    return self.wait_time(cost)
+            if self.remaining is not None:
+                self.remaining -= cost
+            return 0
+
+    def acquire(self, cost=1):
+        """Block until cost tokens are available and take them. Returns
+        the number of seconds spent waiting."""
+        waited = 0
+        delay = self.try_acquire(cost)
+        while delay:
+            logging.info('Rate limit reached, sleeping for %s seconds', delay)
+            METRICS.inc('rate_limit_sleeps')
+            METRICS.inc('rate_limit_sleep_seconds', delay)
+            self.sleep(delay)
+            waited += delay
+            delay = self.try_acquire(cost)
+        return waited
+
+    def update(self, headers):
+        """Update the bucket from a response's headers"""
+        try:
+            remaining = int(headers['X-RateLimit-Remaining'])
+            reset = int(headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            if self.reset is None or reset != self.reset:
+                # A new window
+                self.remaining, self.reset = remaining, reset
+            else:
+                # Other requests may already hold tokens the header
+                # doesn't know about yet
+                self.remaining = min(self.remaining, remaining)
+
+    def refund(self, cost=1):
+        """Give back tokens for a request GitHub didn't charge for"""
+        with self.lock:
+            if self.remaining is not None:
+                self.remaining += cost
+
+    def exhaust(self, reset=None):
+        """Mark the bucket empty after GitHub refused a request"""
+        with self.lock:
+            self.remaining = 0
+            if reset is not None:
+                self.reset = reset
+
+
+class CredentialPool(object):
+    """Credentials and their rate limits. A credential is a (username,
+    password) tuple, a token string, or None for unauthenticated requests."""
+
+    def __init__(self, credentials=None, clock=time.time, sleep=time.sleep):
+        self.credentials = list(credentials or [None])
+        self.limits = [RateLimit(clock=clock, sleep=sleep)
+                       for _ in self.credentials]
+        self.sleep = sleep
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.credentials)
+
+    @staticmethod
+    def budget(limit, cost=1):
+        """Tokens limit can spend now, unknown counting as plenty"""
+        if limit.wait_time(cost):
+            return -1
+        return float('inf') if limit.remaining is None else limit.remaining
+
+    def acquire(self, cost=1):
+        """Block until a credential has budget, take cost tokens from it
+        and return (credential, rate_limit)"""
+        while True:
+            with self.lock:
+                best = max(range(len(self.limits)),
+                           key=lambda i: self.budget(self.limits[i], cost))
+                delay = self.limits[best].try_acquire(cost)
+                if not delay:
+                    return self.credentials[best], self.limits[best]
+                # Every credential is exhausted, wait for the first reset
+                delay = min(x.wait_time(cost) for x in self.limits) or delay
+            logging.info('All credentials rate limited, sleeping for %s ' +
+                         'seconds', delay)
+            METRICS.inc('rate_limit_sleeps')
+            METRICS.inc('rate_limit_sleep_seconds', delay)
+            self.sleep(delay)
+
+
+def with_credential(credential, kwargs):
+    """A copy of the requests keyword arguments kwargs that authenticates
+    with credential"""
+    kwargs = dict(kwargs)
+    if isinstance(credential, str):
+        kwargs['headers'] = dict(kwargs.get('headers') or {},
+                                 Authorization='token ' + credential)
+    elif credential is not None:
+        kwargs['auth'] = tuple(credential)
+    return kwargs
+
+
+def with_params(url, **params):
+    """url with params added to its query string"""
+    parts = urlparse(url)
+    query = dict(parse_qsl(parts.query), **{k: str(v) for k, v in params.items()})
+    return urlunparse(parts._replace(query=urlencode(query)))
+
+
+def is_rate_limited(response):
+    """True if GitHub refused response because of a rate limit"""
+    if response.status_code == 429:
+        return True
+    return (response.status_code == 403 and
+            (response.headers.get('X-RateLimit-Remaining') == '0' or
+             'Retry-After' in response.headers))
+
+
+class GitHubClient(object):
+    """Requests to the GitHub API, up to concurrency at a time.
+
+    auth is an optional (username, password or token) tuple. To spread
+    requests over several accounts pass credentials, a list of tuples or
+    token strings, instead. cache is an optional HTTPCache."""
+
+    def __init__(self, auth=None, concurrency=8, base_url=API_URL,
+                 session=None, timeout=60, sleep=time.sleep,
+                 credentials=None, cache=None):
+        self.concurrency = concurrency
+        self.base_url = base_url.rstrip('/')
+        self.session = session or make_session(concurrency)
+        self.timeout = timeout
+        self.sleep = sleep
+        self.credentials = CredentialPool(credentials or [auth], sleep=sleep)
+        self.cache = cache
+
+    def url(self, path):
+        """Full URL for an API path such as /users/james/repos"""
+        return self.base_url + path
+
+    def request(self, method, url, retries=3, cost=1, **kwargs):
+        """Send a request, waiting until a credential has cost tokens of
+        rate limit and retrying requests that were refused because of it.
+        If a GET url is cached the request is conditional, and a 304 is
+        answered from the cache."""
+        cached = self.cache is not None and method == 'GET'
+        if cached:
+            unconditional = dict(kwargs)
+            kwargs['headers'] = dict(kwargs.get('headers') or {},
+                                     **self.cache.conditional_headers(url))
+        for attempt in range(retries + 1):
+            credential, rate_limit = self.credentials.acquire(cost)
+            response = self.session.request(
+                method, url, timeout=self.timeout,
+                **with_credential(credential, kwargs))
+            METRICS.inc('api_requests')
+            METRICS.inc('api_points', cost)
+            if cached and response.status_code == 304:
+                # Not modified responses don't count against the limit
+                rate_limit.refund(cost)
+                rate_limit.update(response.headers)
+                from_cache = self.cache.response(response)
+                if from_cache is None:
+                    # Evicted in the meantime, so there's nothing to
+                    # revalidate and the request is made afresh
+                    return self.request(method, url, retries, cost,
+                                        **unconditional)
+                METRICS.inc('cache_hits')
+                return from_cache
+            rate_limit.update(response.headers)
+            if not is_rate_limited(response) or attempt == retries:
+                if cached and response.status_code == 200:
+                    METRICS.inc('cache_misses')
+                    self.cache.put(response)
+                return response
+            METRICS.inc('api_rate_limited')
+            retry_after = response.headers.get('Retry-After')
+            if retry_after is not None:
+                # Secondary (abuse) rate limits say how long to back off
+                METRICS.inc('rate_limit_sleeps')
+                METRICS.inc('rate_limit_sleep_seconds', int(retry_after))
+                self.sleep(int(retry_after))
+            else:
+                # Another credential may still have budget
+                reset = response.headers.get('X-RateLimit-Reset')
+                rate_limit.exhaust(int(reset) if reset else None)
+        return response
+
+    def get(self, url, retries=3, **kwargs):
+        """GET url, see request"""
+        return self.request('GET', url, retries, **kwargs)
+
+    def post(self, url, retries=3, cost=1, **kwargs):
+        """POST to url, taking cost tokens of rate limit, see request"""
+        return self.request('POST', url, retries, cost, **kwargs)
+
+    def get_pages(self, url, per_page=100):
+        """GET every page of the list at url, following the Link headers,
+        and return all the items. Raises requests.HTTPError if any page's
+        response is an error or isn't a JSON list, so a failure part way
+        through isn't mistaken for a short list."""
+        url = with_params(url, per_page=per_page)
+        items = []
+        while url:
+            response = self.get(url)
+            if response.status_code != 200:
+                raise requests.HTTPError('Unexpected status {} for {}'.format(
+                    response.status_code, url), response=response)
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+            if not isinstance(data, list):
+                raise requests.HTTPError('Expected a list from {}'.format(url),
+                                         response=response)
+            items.extend(data)
+            url = response.links.get('next', {}).get('url')
+        return items
+
+    def map(self, func, items):
+        """Call func on each of items using concurrency threads, returning
+        the results in order. func will usually call self.get."""
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            return list(pool.map(func, items))
@@ -0,0 +1,125 @@
+"""Reading GitHub Archive files, compressed or not.
+
+Gzip files are read directly with large buffered reads, so there's no need
+to decompress them to disk first. A file made by concatenating hourly
+archives (as get_data --concatenate does) is a multi-member gzip file;
+its members are independent, so they can be found and decompressed in
+parallel."""
+
+import gzip
+import io
+import os
+import zlib
+
+GZIP_MAGIC = b'\x1f\x8b\x08'
+BUFFER_SIZE = 1024 * 1024
+
+
+def is_gzip(path):
+    """True if the file at path starts with the gzip magic number"""
+    with open(path, 'rb') as fp:
+        return fp.read(3) == GZIP_MAGIC
+
+
+def open_events(path, buffer_size=BUFFER_SIZE):
+    """Open path for reading lines of events as bytes, decompressing on the
+    fly if it's gzipped"""
+    if is_gzip(path):
+        raw = open(path, 'rb', buffering=buffer_size)
+        return io.BufferedReader(gzip.GzipFile(fileobj=raw, mode='rb'),
+                                 buffer_size=buffer_size)
+    return open(path, 'rb', buffering=buffer_size)
+
+
+def _plausible_header(header):
+    """Cheap checks on a 10 byte gzip header found mid file"""
+    flags, xfl, os_byte = header[3], header[8], header[9]
+    return (not flags & 0xe0 and xfl in (0, 2, 4) and
+            (os_byte <= 13 or os_byte == 255))
+
+
+def _starts_member(fp, offset, probe=16 * 1024):
+    """True if a gzip member holding JSON lines starts at offset. Only the
+    start of the member is decompressed."""
+    fp.seek(offset)
+    try:
+        head = zlib.decompressobj(31).decompress(fp.read(probe), 64)
+    except zlib.error:
+        return False
+    return head.lstrip()[:1] in (b'{', b'')
+
+
+def member_offsets(path, chunk_size=BUFFER_SIZE):
+    """Byte offsets at which the gzip members of path start.
+
+    Candidate offsets are found by scanning for the gzip magic number, then
+    checked by decompressing the start of each one, which rules out the
+    magic number turning up by chance inside compressed data."""
+    offsets = set()
+    with open(path, 'rb') as fp:
+        position = 0
+        tail = b''
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            # Keep the last few bytes so a header split between two chunks
+            # is found on the next pass
+            data = tail + chunk
+            base = position - len(tail)
+            i = data.find(GZIP_MAGIC)
+            while i != -1 and i + 10 <= len(data):
+                if _plausible_header(data[i:i + 10]):
+                    offsets.add(base + i)
+                i = data.find(GZIP_MAGIC, i + 1)
+            tail = data[-9:]
+            position += len(chunk)
+        return [x for x in sorted(offsets)
+                if x == 0 or _starts_member(fp, x)]
+
+
+def member_ranges(path, n):
+    """Group the members of path into about n (start, end) byte ranges of
+    roughly equal compressed size"""
+    size = os.path.getsize(path)
+    offsets = member_offsets(path)
+    if not offsets:
+        return [(0, size)]
+    target = size / n
+    ranges = []
+    start = 0
+    for offset in offsets[1:]:
+        if offset - start >= target:
+            ranges.append((start, offset))
+            start = offset
+    ranges.append((start, size))
+    return ranges
+
+
+def read_members(path, start, end, chunk_size=BUFFER_SIZE):
+    """Yield the decompressed lines of the gzip members starting in
+    [start, end). A member running past end is read to its finish."""
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        # Offset in the file of the next byte to be read
+        position = start
+        decompressor = zlib.decompressobj(31)
+        pending = b''
+        while True:
+            if decompressor.eof:
+                # Move on to the next member, if it starts in our range
+                data = decompressor.unused_data
+                if position - len(data) >= end:
+                    break
+                decompressor = zlib.decompressobj(31)
+            else:
+                data = b''
+            if not data:
+                data = fp.read(chunk_size)
+                if not data:
+                    break
+                position += len(data)
+            pending += decompressor.decompress(data)
+            lines = pending.split(b'\n')
+            pending = lines.pop()
+            for line in lines:
+                yield line + b'\n'
+        if pending:
+            yield pending
@@ -0,0 +1,304 @@
+"""Columnar (Parquet) output for parsed users and crawled details.
+
+JSON outputs have to be loaded whole, however little of them is needed.
+Parquet files are typed, compressed and split into row groups with min
+and max statistics, so an analysis can read just the columns it wants
+and skip row groups that can't match a filter. Rows are buffered and
+written a row group at a time, so writing takes constant memory.
+
+pyarrow is only needed for this format; install it with
+`pip install pyarrow`."""
+
+import json
+
+from datetime import datetime
+
+from .json_stream import iter_records, write_records
+
+try:
+    import pyarrow
+    import pyarrow.parquet as parquet
+except ImportError:
+    pyarrow = None
+    parquet = None
+
+FORMATS = ['json', 'parquet']
+
+ROW_GROUP_SIZE = 64 * 1024
+COMPRESSION = 'zstd'
+
+
+def require_pyarrow():
+    if pyarrow is None:
+        raise ImportError("pyarrow isn't installed. Install it with " +
+                          "`pip install pyarrow` or use the json format")
+
+
+def is_parquet(path):
+    return path.endswith('.parquet')
+
+
+def attribute(key):
+    """Getter for one of a parsed user's attributes"""
+    def get(record):
+        if isinstance(record, dict):
+            return (record.get('attributes') or {}).get(key)
+        return None
+    return get
+
+
+def field(key, subkey=None):
+    """Getter for a key of a record, or subkey of the object at key"""
+    def get(record):
+        value = record.get(key)
+        if subkey is not None:
+            value = value.get(subkey) if isinstance(value, dict) else None
+        return value
+    return get
+
+
+def user_login(record):
+    return record.get('user') if isinstance(record, dict) else record
+
+
+def user_attributes(record):
+    """The attributes of a parsed user, JSON encoded so none are lost"""
+    if isinstance(record, dict) and record.get('attributes'):
+        return json.dumps(record['attributes'])
+    return None
+
+
+def resolved(key):
+    """Getter for a field of a user's resolved location, see
+    users_at_location.resolved"""
+    def get(record):
+        if isinstance(record, dict):
+            return (record.get('location_resolved') or {}).get(key)
+        return None
+    return get
+
+
+# Column for each field of a resolved location
+RESOLVED_COLUMNS = [('resolution', 'resolution'),
+                    ('name', 'resolved_name'),
+                    ('country', 'country'),
+                    ('region', 'region'),
+                    ('latitude', 'latitude'),
+                    ('longitude', 'longitude')]
+
+# (name, type, getter) for each column. Users are parse_users records, in
+# both the old and new archive schemas
+USER_COLUMNS = [('user', 'string', user_login),
+                ('user_id', 'int64', lambda x: x.get('user_id')
+                 if isinstance(x, dict) else None),
+                ('id', 'int64', attribute('id')),
+                ('name', 'string', attribute('name')),
+                ('company', 'string', attribute('company')),
+                ('blog', 'string', attribute('blog')),
+                ('location', 'string', attribute('location')),
+                ('email', 'string', attribute('email')),
+                ('type', 'string', attribute('type')),
+                ('attributes', 'string', user_attributes)] + [
+    (column, 'double' if key in ('latitude', 'longitude') else 'string',
+     resolved(key)) for key, column in RESOLVED_COLUMNS]
+
+# A row per repo of each user, from get_user_details. Getters are given
+# (login, repo) pairs.
+USER_REPO_COLUMNS = [('user', 'string', lambda x: x[0]),
+                     ('id', 'int64', lambda x: x[1].get('id')),
+                     ('name', 'string', lambda x: x[1].get('name')),
+                     ('repo_id', 'int64', lambda x: x[1].get('repo_id'))]
+
+REPO_COLUMNS = [('user', 'string', lambda x: x[0])] + [
+    (name, type_name, lambda x, get=get: get(x[1]))
+    for name, type_name, get in [
+        ('id', 'int64', field('id')),
+        ('repo_id', 'int64', field('repo_id')),
+        ('name', 'string', field('name')),
+        ('full_name', 'string', field('full_name')),
+        ('owner', 'string', field('owner', 'login')),
+        ('description', 'string', field('description')),
+        ('homepage', 'string', field('homepage')),
+        ('fork', 'bool', field('fork')),
+        ('language', 'string', field('language')),
+        ('license', 'string', field('license', 'spdx_id')),
+        ('created_at', 'timestamp', field('created_at')),
+        ('updated_at', 'timestamp', field('updated_at')),
+        ('pushed_at', 'timestamp', field('pushed_at')),
+        ('size', 'int64', field('size')),
+        ('stargazers_count', 'int64', field('stargazers_count')),
+        ('watchers_count', 'int64', field('watchers_count')),
+        ('forks_count', 'int64', field('forks_count')),
+        ('open_issues_count', 'int64', field('open_issues_count'))]]
+
+
+def arrow_type(type_name):
+    require_pyarrow()
+    return {'string': pyarrow.string(),
+            'int64': pyarrow.int64(),
+            'double': pyarrow.float64(),
+            'bool': pyarrow.bool_(),
+            'timestamp': pyarrow.timestamp('s', tz='UTC')}[type_name]
+
+
+def schema(columns):
+    """The Arrow schema for columns"""
+    return pyarrow.schema([(name, arrow_type(type_name))
+                           for name, type_name, _ in columns])
+
+
+def coerce(value, type_name):
+    """value as type_name, or None if it isn't one. The API uses all
+    sorts for missing values, {} and '' included."""
+    if type_name == 'int64':
+        return value if isinstance(value, int) and \
+            not isinstance(value, bool) else None
+    if type_name == 'double':
+        return float(value) if isinstance(value, (int, float)) and \
+            not isinstance(value, bool) else None
+    if type_name == 'bool':
+        return value if isinstance(value, bool) else None
+    if type_name == 'timestamp':
+        if not isinstance(value, str) or not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, str):
+        return value
+    return None if value in (None, {}, []) else json.dumps(value)
+
+
+class ColumnarWriter(object):
+    """Write records to a Parquet file at path, extracting columns, a list
+    of (name, type, getter), from each. Rows are buffered and written
+    row_group_size at a time."""
+
+    def __init__(self, path, columns, row_group_size=ROW_GROUP_SIZE,
+                 compression=COMPRESSION):
+        require_pyarrow()
+        self.columns = columns
+        self.row_group_size = row_group_size
+        self.schema = schema(columns)
+        self.writer = parquet.ParquetWriter(path, self.schema,
+                                            compression=compression)
+        self.buffer = [[] for _ in columns]
+        self.rows = 0
+
+    def write(self, record):
+        for values, (_, type_name, get) in zip(self.buffer, self.columns):
+            values.append(coerce(get(record), type_name))
+        self.rows += 1
+        if len(self.buffer[0]) >= self.row_group_size:
+            self.flush()
+
+    def write_all(self, records):
+        """Write every one of records, returning the number of rows in
+        the file"""
+        for record in records:
+            self.write(record)
+        return self.rows
+
+    def flush(self):
+        """Write the buffered rows as a row group"""
+        if not self.buffer[0]:
+            return
+        table = pyarrow.Table.from_arrays(
+            [pyarrow.array(values, type=self.schema.field(i).type)
+             for i, values in enumerate(self.buffer)], schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+        self.buffer = [[] for _ in self.columns]
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_users(users, path, **kwargs):
+    """Write parsed users to a Parquet file. Returns the number of rows."""
+    with ColumnarWriter(path, USER_COLUMNS, **kwargs) as writer:
+        return writer.write_all(users)
+
+
+def user_repo_rows(data):
+    """(login, repo) for every repo in data, a dict of login to a list
+    of repos"""
+    return ((login, repo) for login, repos in data.items()
+            for repo in repos or [])
+
+
+def write_user_repos(data, path, **kwargs):
+    """Write get_user_details output, a row per repo of each user"""
+    with ColumnarWriter(path, USER_REPO_COLUMNS, **kwargs) as writer:
+        return writer.write_all(user_repo_rows(data))
+
+
+def write_repos(data, path, **kwargs):
+    """Write repo_details output, a row per repo"""
+    with ColumnarWriter(path, REPO_COLUMNS, **kwargs) as writer:
+        return writer.write_all(user_repo_rows(data))
+
+
+def read_table(path, columns=None, filters=None):
+    """Load columns of the Parquet file at path as an Arrow table, keeping
+    only rows matching filters, e.g. [('location', '=', 'London')]. Row
+    groups that can't match are skipped without being read."""
+    require_pyarrow()
+    return parquet.read_table(path, columns=columns, filters=filters)
+
+
+def iter_users(path, batch_size=ROW_GROUP_SIZE):
+    """Yield the parsed users in a Parquet file written by write_users,
+    in the form parse_users produces them, one row group at a time"""
+    require_pyarrow()
+    users = parquet.ParquetFile(path)
+    # Files written before locations were resolved don't have their columns
+    columns = ['user', 'user_id', 'attributes'] + [
+        column for _, column in RESOLVED_COLUMNS
+        if column in users.schema_arrow.names]
+    for batch in users.iter_batches(batch_size=batch_size, columns=columns):
+        for row in batch.to_pylist():
+            user = {'user': row['user']}
+            if row['attributes'] is not None:
+                user['attributes'] = json.loads(row['attributes'])
+            if row['user_id'] is not None:
+                user['user_id'] = row['user_id']
+            if row.get('resolution') is not None:
+                user['location_resolved'] = {
+                    key: row[column] for key, column in RESOLVED_COLUMNS}
+            yield row['user'] if len(user) == 1 else user
+
+
+def read_user_records(path):
+    """Yield the users in a JSON array, JSON Lines or Parquet file"""
+    if is_parquet(path):
+        yield from iter_users(path)
+        return
+    with open(path, 'r') as fp:
+        yield from iter_records(fp)
+
+
+def write_user_records(users, path):
+    """Write users to path as Parquet if it ends in .parquet, otherwise
+    as JSON, see json_stream.write_records. Returns the number written."""
+    if is_parquet(path):
+        return write_users(users, path)
+    with open(path, 'w') as fp:
+        return write_records(users, fp, path)
+
+
+def add_format_argument(parser):
+    """Command line option choosing the output format"""
+    parser.add_argument('--format',
+                        choices=FORMATS,
+                        default='json',
+                        help=('output format. parquet (needs pyarrow) is ' +
+                              'typed, compressed and can be read a column ' +
+                              'at a time'))
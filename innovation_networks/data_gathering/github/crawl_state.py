@@ -0,0 +1,85 @@
+"""Durable, incremental state for crawling the GitHub API.
+
+Each result is written to SQLite the moment it arrives, so a crash after
+hours of rate limited crawling loses at most the requests in flight. A
+restart skips everything already fetched, and entries older than a given
+age can be refreshed without redoing the rest."""
+
+import json
+import sqlite3
+import threading
+import time
+
+
+class CrawlState(object):
+    """Crawl results keyed on (kind, key), e.g. ('repos', login) or
+    ('repo', 'login/name')"""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        # Write ahead logging keeps per result commits cheap
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS items ('
+                        'kind TEXT, key TEXT, value TEXT, fetched_at REAL, '
+                        'PRIMARY KEY (kind, key))')
+        self.db.commit()
+
+    def record(self, kind, key, value):
+        """Store value as the result for key, committing immediately"""
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?)',
+                            (kind, key, json.dumps(value), self.clock()))
+            self.db.commit()
+
+    def delete(self, kind, key):
+        with self.lock:
+            self.db.execute('DELETE FROM items WHERE kind = ? AND key = ?',
+                            (kind, key))
+            self.db.commit()
+
+    def get(self, kind, key, default=None):
+        with self.lock:
+            row = self.db.execute('SELECT value FROM items WHERE kind = ? '
+                                  'AND key = ?', (kind, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def fetched(self, kind, max_age=None):
+        """Keys of kind fetched within the last max_age seconds, or ever if
+        max_age is None"""
+        since = self.clock() - max_age if max_age is not None else None
+        with self.lock:
+            if since is None:
+                rows = self.db.execute('SELECT key FROM items WHERE kind = ?',
+                                       (kind,))
+            else:
+                rows = self.db.execute('SELECT key FROM items WHERE kind = ? '
+                                       'AND fetched_at >= ?', (kind, since))
+            return set(x[0] for x in rows)
+
+    def pending(self, kind, keys, max_age=None):
+        """The keys, in order, that haven't been fetched or are stale"""
+        fetched = self.fetched(kind, max_age)
+        return [x for x in keys if x not in fetched]
+
+    def items(self, kind):
+        """(key, value) for every stored result of kind"""
+        with self.lock:
+            rows = self.db.execute('SELECT key, value FROM items WHERE '
+                                   'kind = ? ORDER BY key', (kind,)).fetchall()
+        return [(key, json.loads(value)) for key, value in rows]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM items').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
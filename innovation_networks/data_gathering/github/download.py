@@ -0,0 +1,183 @@
+"""Concurrent, resumable downloads of GitHub Archive files.
+
+Each URL is streamed to its own file by a bounded pool of worker threads
+sharing one pooled HTTP session. Progress is journalled to a manifest so an
+interrupted run picks up exactly where it stopped, including resuming
+partially written files with HTTP range requests."""
+
+import json
+import logging
+import os
+import requests
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from .metrics import METRICS
+
+# Stream in 1 MiB chunks rather than 1 KiB
+CHUNK_SIZE = 1024 * 1024
+
+COMPLETE = 'complete'
+PARTIAL = 'partial'
+FAILED = 'failed'
+# The server said there's no such file, so there's no use retrying
+MISSING = 'missing'
+
+
+class Manifest(object):
+    """Append-only journal of per-URL download state.
+
+    Every update is written as a JSON line, so a crash can never leave the
+    manifest half written. The most recent line for a URL wins when the
+    journal is read back."""
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            self._load()
+            self._compact()
+
+    def _load(self):
+        with open(self.path, 'r') as fp:
+            for line in fp:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash, ignore it
+                    continue
+                self.entries[entry['url']] = entry
+
+    def _compact(self):
+        """Rewrite the journal with one line per URL"""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            for entry in self.entries.values():
+                fp.write(json.dumps(entry) + '\n')
+        os.replace(tmp_path, self.path)
+
+    def get(self, url):
+        return self.entries.get(url, {})
+
+    def status(self, url):
+        return self.get(url).get('status')
+
+    def completed(self, url):
+        return self.status(url) == COMPLETE
+
+    def update(self, url, **fields):
+        """Record new state for url and append it to the journal"""
+        with self._lock:
+            entry = dict(self.entries.get(url, {}), url=url, **fields)
+            self.entries[url] = entry
+            with open(self.path, 'a') as fp:
+                fp.write(json.dumps(entry) + '\n')
+        return entry
+
+
+def make_session(pool_size=8):
+    """A requests session whose connection pool can serve pool_size
+    threads at once"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size,
+                                            pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def file_name(url):
+    """Local file name for a URL, e.g. 2016-06-22-0.json.gz"""
+    return os.path.basename(urlparse(url).path)
+
+
+def fetch(session, url, path, manifest, chunk_size=CHUNK_SIZE, timeout=60):
+    """Stream url to path, resuming from a previous partial download if
+    one exists. Data is written to path + '.part' and only moved into place
+    once the whole response has arrived."""
+    part_path = path + '.part'
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+
+    manifest.update(url, status=PARTIAL, path=path)
+    with session.get(url, stream=True, headers=headers,
+                     timeout=timeout) as req:
+        if offset and req.status_code == 416:
+            # Everything was already on disk before the crash
+            pass
+        else:
+            req.raise_for_status()
+            if req.status_code != 206:
+                # Server ignored the range, start again from scratch
+                offset = 0
+            with open(part_path, 'ab' if offset else 'wb') as fp:
+                for chunk in req.iter_content(chunk_size=chunk_size):
+                    if chunk:
+                        fp.write(chunk)
+                        METRICS.inc('download_bytes', len(chunk))
+    os.replace(part_path, path)
+    METRICS.inc('downloads_completed')
+    return manifest.update(url, status=COMPLETE, path=path,
+                           bytes=os.path.getsize(path))
+
+
+def is_missing(error):
+    """True if error is a 404, which won't go away by retrying"""
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code == 404
+
+
+def fetch_with_retry(session, url, path, manifest, retries=3, backoff=2,
+                     **kwargs):
+    """Call fetch, retrying with exponential backoff. Returns the manifest
+    entry for url, which has status MISSING if the server hasn't got it
+    and FAILED if every attempt errored."""
+    for attempt in range(retries + 1):
+        try:
+            return fetch(session, url, path, manifest, **kwargs)
+        except (requests.exceptions.RequestException, OSError) as e:
+            if is_missing(e):
+                logging.warning('%s is missing', url)
+                METRICS.inc('downloads_missing')
+                return manifest.update(url, status=MISSING, path=path)
+            logging.error('Downloading %s failed (attempt %s): %s',
+                          url, attempt + 1, e)
+            if attempt < retries:
+                METRICS.inc('download_retries')
+                time.sleep(backoff * 2 ** attempt)
+    METRICS.inc('downloads_failed')
+    return manifest.update(url, status=FAILED, path=path)
+
+
+def download(url_list, out_dir, manifest_path=None, workers=8, retries=3,
+             session=None, path_for=None, **kwargs):
+    """Download every URL in url_list into out_dir using a pool of workers
+    threads. URLs the manifest already records as complete are skipped.
+    path_for optionally maps a URL to the path it should be saved at.
+
+    Returns a list of manifest entries in the same order as url_list."""
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    if manifest_path is None:
+        manifest_path = os.path.join(out_dir, 'manifest.jsonl')
+    manifest = Manifest(manifest_path)
+    session = session or make_session(workers)
+
+    if path_for is None:
+        def path_for(url):
+            return os.path.join(out_dir, file_name(url))
+
+    def work(url):
+        path = path_for(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if manifest.completed(url) and os.path.exists(path):
+            return manifest.get(url)
+        return fetch_with_retry(session, url, path, manifest,
+                                retries=retries, **kwargs)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(work, url_list))
@@ -0,0 +1,432 @@
+"""Random access to the events of particular users and repos.
+
+Otherwise, finding every event by a few thousand users means reading and
+decoding the whole archive again. build_index reads the archive once.
+It copies each event's line into a store of independently compressed
+blocks, and lists each login's and each repo's events by number. An
+EventIndex memory maps the store and the lists, so opening one reads next
+to nothing. Fetching a user's events then decompresses just the blocks
+that hold them.
+
+Events are numbered in the order they're read. events.dat is cut into
+blocks of about block_size bytes of lines. Each block is zlib compressed
+on its own, or stored as is with compress=False. blocks.bin holds the
+offset of each block in events.dat and block_events.bin the number of
+its first event, so an event's block is found by bisection. Like the
+network's graphs, the event numbers of each login and repo are kept in
+compressed sparse row form: indptr[i]:indptr[i + 1] is the slice of
+postings listing the events of id i, in order. While events stream in,
+(id, event) pairs go to a scratch file. A counting sort then puts them
+in place in a memory mapped postings file. So building holds the string
+tables and counts in memory, not the postings. meta.json records which
+data file, usually an hourly shard, each run of event numbers came
+from."""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import sys
+import zlib
+
+from array import array
+from bisect import bisect_right
+
+from .archive_io import open_events
+from .columnar import read_user_records
+from .events import EventFilter, event_login, event_repo, parse_list
+from .get_user_details import user_login
+from .interning import LOGINS, REPOS, StringTable, add_strings_argument
+from .interning import close_tables, open_tables
+from .json_backend import BACKENDS, get_loads
+from .metrics import METRICS, add_metrics_argument, write_report
+from .place_matcher import read_names
+from .shards import datafiles_for
+
+BLOCK_SIZE = 32 * 1024
+COMPRESS_LEVEL = 6
+# (id, event) pairs held before writing them to the scratch file
+BUFFER_SIZE = 1 << 20
+META_NAME = 'meta.json'
+EVENTS_NAME = 'events.dat'
+
+# Event numbers are unsigned 64 bit integers
+TYPECODE = 'Q'
+
+
+def mapped(path, typecode=TYPECODE):
+    """(mmap, memoryview of typecode values) of the file at path, or
+    (None, empty array) if it's empty, as empty files can't be mapped"""
+    if not os.path.getsize(path):
+        return None, array(typecode)
+    with open(path, 'rb') as fp:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    return data, memoryview(data).cast(typecode)
+
+
+class PostingsWriter(object):
+    """The event numbers of each id, from (id, event) pairs added in
+    event order, written in CSR form as name_indptr.bin and
+    name_postings.bin in path"""
+
+    def __init__(self, path, name, buffer_size=BUFFER_SIZE):
+        self.path = path
+        self.name = name
+        self.buffer_size = buffer_size
+        self.counts = array(TYPECODE)
+        self.pairs = array(TYPECODE)
+        self.scratch = os.path.join(path, name + '_pairs.tmp')
+        self.fp = open(self.scratch, 'wb')
+
+    def add(self, i, event):
+        if i >= len(self.counts):
+            self.counts.extend([0] * max(i + 1 - len(self.counts),
+                                         len(self.counts)))
+        self.counts[i] += 1
+        self.pairs.append(i)
+        self.pairs.append(event)
+        if len(self.pairs) >= 2 * self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        self.pairs.tofile(self.fp)
+        del self.pairs[:]
+
+    def file(self, part):
+        return os.path.join(self.path, '{}_{}.bin'.format(self.name, part))
+
+    def finish(self, n_ids):
+        """Write the indptr and postings for ids 0 to n_ids - 1. Returns
+        the number of postings."""
+        self.flush()
+        self.fp.close()
+        indptr = array(TYPECODE, [0])
+        for i in range(n_ids):
+            indptr.append(indptr[-1] + (self.counts[i]
+                                        if i < len(self.counts) else 0))
+        del self.counts
+        with open(self.file('indptr'), 'wb') as fp:
+            indptr.tofile(fp)
+
+        total = indptr[-1]
+        with open(self.file('postings'), 'w+b') as fp:
+            fp.truncate(total * 8)
+        if total:
+            # Pairs were added in event order, so each id's slice fills in
+            # order
+            fill = indptr[:-1]
+            with open(self.file('postings'), 'r+b') as fp:
+                data = mmap.mmap(fp.fileno(), 0)
+            postings = memoryview(data).cast(TYPECODE)
+            with open(self.scratch, 'rb') as fp:
+                while True:
+                    pairs = array(TYPECODE)
+                    pairs.frombytes(fp.read(16 * self.buffer_size))
+                    if not pairs:
+                        break
+                    for i, event in zip(pairs[0::2], pairs[1::2]):
+                        postings[fill[i]] = event
+                        fill[i] += 1
+            postings.release()
+            data.close()
+        os.remove(self.scratch)
+        return total
+
+
+class BlockWriter(object):
+    """Event lines written to fp in blocks of about block_size bytes,
+    each compressed on its own if compress"""
+
+    def __init__(self, fp, block_size=BLOCK_SIZE, compress=True):
+        self.fp = fp
+        self.block_size = block_size
+        self.compress = compress
+        self.lines = []
+        self.size = 0
+        self.events = 0
+        self.offsets = array(TYPECODE, [0])
+        self.first_events = array(TYPECODE, [0])
+
+    def add(self, line):
+        """Add line, returning its event number"""
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        self.lines.append(line)
+        self.size += len(line)
+        self.events += 1
+        if self.size >= self.block_size:
+            self.flush()
+        return self.events - 1
+
+    def flush(self):
+        if not self.lines:
+            return
+        data = b''.join(self.lines)
+        if self.compress:
+            data = zlib.compress(data, COMPRESS_LEVEL)
+        self.fp.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+        self.first_events.append(self.events)
+        self.lines = []
+        self.size = 0
+
+
+def source_name(datafile):
+    """The name a data file is recorded under: a shard's key, otherwise
+    its file name"""
+    name = os.path.basename(datafile)
+    for suffix in ['.json.gz', '.gz', '.jsonl', '.json']:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def build_index(datafiles, path, types=None, block_size=BLOCK_SIZE,
+                compress=True, backend='auto', tables=None):
+    """Index the events of types, all of them if None, in datafiles into
+    the directory path. tables are the shared login and repo StringTables
+    to take ids from, if given. Returns the index's meta data."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    tables = tables or {LOGINS: StringTable(), REPOS: StringTable()}
+    event_filter = EventFilter(types)
+    loads = get_loads(backend)
+    postings = {kind: PostingsWriter(path, kind) for kind in [LOGINS, REPOS]}
+    sources = []
+    with open(os.path.join(path, EVENTS_NAME), 'wb') as fp:
+        store = BlockWriter(fp, block_size, compress)
+        for datafile in datafiles:
+            sources.append([source_name(datafile), store.events])
+            with open_events(datafile) as lines:
+                for line, data in event_filter.lines_and_events(lines, loads):
+                    if isinstance(line, str):
+                        line = line.encode()
+                    event = store.add(line.rstrip(b'\r\n'))
+                    for kind, name in [(LOGINS, event_login(data)),
+                                       (REPOS, event_repo(data))]:
+                        if name:
+                            postings[kind].add(tables[kind].intern(name),
+                                               event)
+        store.flush()
+
+    for name, values in [('blocks', store.offsets),
+                         ('block_events', store.first_events)]:
+        with open(os.path.join(path, name + '.bin'), 'wb') as fp:
+            values.tofile(fp)
+    meta = {'events': store.events,
+            'blocks': len(store.offsets) - 1,
+            'bytes': store.offsets[-1],
+            'compression': 'zlib' if compress else None,
+            'types': sorted(types) if types else None,
+            'byteorder': sys.byteorder,
+            'sources': sources}
+    for kind in [LOGINS, REPOS]:
+        tables[kind].save(os.path.join(path, kind + '.txt'))
+        meta[kind] = len(tables[kind])
+        meta[kind + '_postings'] = postings[kind].finish(len(tables[kind]))
+    with open(os.path.join(path, META_NAME), 'w') as fp:
+        json.dump(meta, fp, indent=1, sort_keys=True)
+    METRICS.inc('event_index_events', store.events)
+    return meta
+
+
+class EventIndex(object):
+    """An index built by build_index, memory mapped from the directory
+    path. Event lines come back as bytes, or decoded with loads."""
+
+    def __init__(self, path, backend='auto'):
+        self.path = path
+        with open(os.path.join(path, META_NAME), 'r') as fp:
+            self.meta = json.load(fp)
+        if self.meta['byteorder'] != sys.byteorder:
+            raise ValueError('Index at {} was saved with {} endian arrays'
+                             .format(path, self.meta['byteorder']))
+        self.loads = get_loads(backend)
+        self.tables = {kind: StringTable.load(os.path.join(path,
+                                                           kind + '.txt'))
+                       for kind in [LOGINS, REPOS]}
+        self.maps = []
+        self.events = self.map(EVENTS_NAME, 'B')
+        self.offsets = self.map('blocks.bin')
+        self.first_events = self.map('block_events.bin')
+        self.postings = {kind: (self.map(kind + '_indptr.bin'),
+                                self.map(kind + '_postings.bin'))
+                         for kind in [LOGINS, REPOS]}
+        self.sources = self.meta['sources']
+        self.source_starts = [x[1] for x in self.sources]
+        # Events are mostly read in order, so the last block read is kept
+        self.cached_block = None
+        self.cached_lines = None
+        self.blocks_read = 0
+
+    def map(self, name, typecode=TYPECODE):
+        data, values = mapped(os.path.join(self.path, name), typecode)
+        if data is not None:
+            self.maps.append((data, values))
+        return values
+
+    def __len__(self):
+        return self.meta['events']
+
+    def block_lines(self, block):
+        """The lines in block, without their newlines"""
+        if block != self.cached_block:
+            data = bytes(self.events[self.offsets[block]:
+                                     self.offsets[block + 1]])
+            if self.meta['compression'] == 'zlib':
+                data = zlib.decompress(data)
+            self.cached_lines = data.split(b'\n')[:-1]
+            self.cached_block = block
+            self.blocks_read += 1
+        return self.cached_lines
+
+    def line(self, event):
+        """The line of event number event"""
+        if not 0 <= event < len(self):
+            raise IndexError(event)
+        block = bisect_right(self.first_events, event) - 1
+        return self.block_lines(block)[event - self.first_events[block]]
+
+    def add_numbers(self, numbers, kind, names):
+        """Add the numbers of the events of names, logins or repos as kind
+        is LOGINS or REPOS, to the set numbers. Unknown names have none."""
+        indptr, postings = self.postings[kind]
+        for name in names:
+            i = self.tables[kind].get(name)
+            if i is not None:
+                numbers.update(postings[indptr[i]:indptr[i + 1]])
+        return numbers
+
+    def event_numbers(self, kind, names):
+        """The sorted numbers of the events of names, see add_numbers"""
+        return sorted(self.add_numbers(set(), kind, names))
+
+    def lines(self, logins=(), repos=()):
+        """Yield the line of every event by one of logins or on one of
+        repos, once each, in the order they were indexed. Each block is
+        read at most once."""
+        numbers = self.add_numbers(set(), LOGINS, logins)
+        self.add_numbers(numbers, REPOS, repos)
+        for event in sorted(numbers):
+            yield self.line(event)
+
+    def events_of(self, logins=(), repos=()):
+        """Yield the decoded events by logins or on repos"""
+        return (self.loads(x) for x in self.lines(logins, repos))
+
+    def count(self, kind, name):
+        """The number of events of a login or repo"""
+        indptr, _ = self.postings[kind]
+        i = self.tables[kind].get(name)
+        return 0 if i is None else indptr[i + 1] - indptr[i]
+
+    def source(self, event):
+        """(data file, line in it) that event number event was read from,
+        counting only the indexed events"""
+        i = bisect_right(self.source_starts, event) - 1
+        return self.sources[i][0], event - self.sources[i][1]
+
+    def summary(self):
+        return {'events': len(self),
+                'blocks': self.meta['blocks'],
+                'logins': len(self.tables[LOGINS]),
+                'repos': len(self.tables[REPOS]),
+                'blocks_read': self.blocks_read}
+
+    def close(self):
+        for data, values in self.maps:
+            values.release()
+            data.close()
+        self.maps = []
+        self.cached_lines = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def main():
+    logging.basicConfig(filename='/tmp/github.event_index.log',
+                        level=logging.INFO,
+                        format='%(levelname)s:%(asctime)s,%(message)s')
+
+    parser = argparse.ArgumentParser(description=("Index GitHub event data " +
+                                                  "by user and repo, or look " +
+                                                  "up events in an index"))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help='index the event data')
+    build.add_argument(dest='datafile',
+                       action='store',
+                       help=('file containing github event data, or a ' +
+                             'directory of shards from get_data'))
+    build.add_argument(dest='index',
+                       action='store',
+                       help='directory to write the index to')
+    build.add_argument('--types',
+                       default='',
+                       help='comma separated event types to index, all by ' +
+                            'default')
+    build.add_argument('--block-size',
+                       type=int,
+                       default=BLOCK_SIZE,
+                       help='bytes of events in each compressed block')
+    build.add_argument('--no-compress',
+                       action='store_true',
+                       help='store blocks uncompressed, larger but faster')
+    build.add_argument('--json-backend',
+                       choices=BACKENDS,
+                       default='auto',
+                       help='JSON decoder to use')
+    add_strings_argument(build)
+    add_metrics_argument(build)
+
+    lookup = subparsers.add_parser('lookup',
+                                   help='write the events of users or repos')
+    lookup.add_argument(dest='index',
+                        action='store',
+                        help='directory of the index')
+    lookup.add_argument(dest='outfile',
+                        action='store',
+                        help='file to write the events to, as JSON Lines')
+    lookup.add_argument('--users',
+                        default=None,
+                        help=('users whose events to write, e.g. from ' +
+                              'users_at_location, as a JSON array, JSON ' +
+                              'Lines or Parquet'))
+    lookup.add_argument('--repos',
+                        default=None,
+                        help='file of owner/name repos, 1 per line')
+    add_metrics_argument(lookup)
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        tables = open_tables(args.strings) if args.strings else None
+        with METRICS.timer('event_index_build'):
+            meta = build_index(datafiles_for(os.path.abspath(args.datafile)),
+                               args.index, parse_list(args.types),
+                               args.block_size, not args.no_compress,
+                               args.json_backend, tables)
+        if tables is not None:
+            close_tables(tables)
+        print(json.dumps({k: v for k, v in meta.items() if k != 'sources'}))
+    else:
+        logins = [user_login(x) for x in read_user_records(args.users)] \
+            if args.users else []
+        repos = read_names(args.repos) if args.repos else []
+        with EventIndex(args.index) as index, \
+                METRICS.timer('event_index_lookup'), \
+                open(args.outfile, 'wb') as fp:
+            for line in index.lines(logins, repos):
+                fp.write(line + b'\n')
+            METRICS.inc('event_index_blocks_read', index.blocks_read)
+            print(json.dumps(index.summary()))
+    write_report(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
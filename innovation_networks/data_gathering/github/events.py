@@ -0,0 +1,204 @@
+"""Select and project events from the GitHub event stream.
+
+Decoding JSON is by far the most expensive part of reading the archive,
+and most analyses only want a few event types. An EventFilter screens
+each raw line for the quoted name of a wanted type before decoding it,
+so lines that can't match are skipped for the price of a substring
+search. A line that passes is decoded and its type checked properly, as
+the name could appear elsewhere in the event.
+
+Matching events can be projected to just the fields wanted, as dotted
+paths like 'payload.size', or one of the DERIVED fields that read the
+same thing from both the pre and post 2015 archive schemas."""
+
+import argparse
+import json
+import logging
+import os
+
+from .archive_io import open_events
+from .json_backend import BACKENDS, get_loads
+from .json_stream import write_jsonl
+from .metrics import METRICS, add_metrics_argument, write_report
+from .shards import datafiles_for
+
+# The event types the innovation network analysis uses
+NETWORK_TYPES = ['PushEvent', 'ForkEvent', 'WatchEvent', 'PullRequestEvent']
+
+
+def event_login(data):
+    """The login of the user behind an event, in either schema"""
+    actor = data.get('actor')
+    if isinstance(actor, dict):
+        return actor.get('login')
+    if actor:
+        return actor
+    sender = data.get('sender')
+    return sender.get('login') if isinstance(sender, dict) else None
+
+
+def event_repo(data):
+    """The owner/name of an event's repo, in either schema"""
+    repo = data.get('repo')
+    if isinstance(repo, dict) and repo.get('name'):
+        return repo['name']
+    repo = data.get('repository')
+    if isinstance(repo, dict) and repo.get('name') and repo.get('owner'):
+        owner = repo['owner']
+        if isinstance(owner, dict):
+            owner = owner.get('login')
+        return '{}/{}'.format(owner, repo['name'])
+    return None
+
+
+DERIVED = {'login': event_login,
+           'repo': event_repo}
+
+
+def get_path(data, path):
+    """The value at a dotted path in data, or None if there isn't one"""
+    for key in path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+class EventFilter(object):
+    """Events of the given types, or all events if types is None, projected
+    to fields, or whole if fields is None. Keeps count of the lines seen,
+    skipped by the pre-screen, decoded and matched, which are added to the
+    shared metrics as event_lines, event_skipped and so on once decoding
+    stops."""
+
+    def __init__(self, types=None, fields=None):
+        self.types = set(types) if types else None
+        self.fields = list(fields) if fields else None
+        # Both bytes and text lines can be screened
+        self.markers = {}
+        if self.types is not None:
+            names = ['"{}"'.format(x) for x in sorted(self.types)]
+            self.markers = {str: names, bytes: [x.encode() for x in names]}
+        self.lines = 0
+        self.skipped = 0
+        self.decoded = 0
+        self.matched = 0
+        self.reported = {}
+
+    def screen(self, line):
+        """False if line certainly isn't a wanted event"""
+        if self.types is None:
+            return True
+        return any(x in line for x in self.markers[type(line)])
+
+    def match(self, data):
+        """True if decoded event data is wanted"""
+        return self.types is None or data.get('type') in self.types
+
+    def project(self, data):
+        """The wanted fields of data"""
+        if self.fields is None:
+            return data
+        return {x: DERIVED[x](data) if x in DERIVED else get_path(data, x)
+                for x in self.fields}
+
+    def decode(self, lines, loads=json.loads, progress=None):
+        """Yield the decoded events in lines that pass the filter, whole"""
+        return (data for _, data in self.lines_and_events(lines, loads,
+                                                          progress))
+
+    def lines_and_events(self, lines, loads=json.loads, progress=None):
+        """Yield (line, decoded event) for the lines that pass the filter"""
+        try:
+            for line in lines:
+                self.lines += 1
+                if progress is not None:
+                    progress.update()
+                if not self.screen(line):
+                    self.skipped += 1
+                    continue
+                # Except block, incase of non-compliant JSON
+                try:
+                    data = loads(line)
+                except ValueError as e:
+                    logging.error(e)
+                    continue
+                self.decoded += 1
+                if isinstance(data, dict) and self.match(data):
+                    self.matched += 1
+                    yield line, data
+        finally:
+            self.report()
+
+    def __call__(self, lines, loads=json.loads, progress=None):
+        """Yield the projection of each wanted event in lines"""
+        return (self.project(x) for x in self.decode(lines, loads, progress))
+
+    def summary(self):
+        return {'lines': self.lines,
+                'skipped': self.skipped,
+                'decoded': self.decoded,
+                'matched': self.matched}
+
+    def report(self):
+        """Add the counts since the last report to the shared metrics"""
+        summary = self.summary()
+        for name, value in summary.items():
+            METRICS.inc('event_' + name, value - self.reported.get(name, 0))
+        self.reported = summary
+
+
+def parse_list(value):
+    """A comma separated command line value as a list, None if empty"""
+    return [x.strip() for x in value.split(',') if x.strip()] or None
+
+
+def main():
+    logging.basicConfig(filename='/tmp/github.events.log',
+                        level=logging.ERROR,
+                        format='%(levelname)s:%(asctime)s,%(message)s')
+
+    parser = argparse.ArgumentParser(description=("Extract events from the " +
+                                                  "GitHub event stream"))
+
+    parser.add_argument(dest='datafile',
+                        action='store',
+                        help=('file containing github event data, or a ' +
+                              'directory of shards from get_data'))
+
+    parser.add_argument(dest='outfile',
+                        action='store',
+                        help='output filename, written as JSON Lines')
+
+    parser.add_argument('--types',
+                        default=','.join(NETWORK_TYPES),
+                        help=('comma separated event types to keep, or ' +
+                              'an empty string for all'))
+
+    parser.add_argument('--fields',
+                        default='type,login,repo,created_at',
+                        help=('comma separated fields to keep, dotted ' +
+                              'paths or one of ' + ', '.join(DERIVED)))
+
+    parser.add_argument('--json-backend',
+                        choices=BACKENDS,
+                        default='auto',
+                        help='JSON decoder to use')
+
+    add_metrics_argument(parser)
+
+    args = parser.parse_args()
+
+    event_filter = EventFilter(parse_list(args.types),
+                               parse_list(args.fields))
+    loads = get_loads(args.json_backend)
+    with open(args.outfile, 'w') as out_fp:
+        for datafile in datafiles_for(os.path.abspath(args.datafile)):
+            with open_events(datafile) as fp:
+                write_jsonl(event_filter(fp, loads), out_fp)
+    print(json.dumps(event_filter.summary()))
+    write_report(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,25 @@
 """Get GitHub data for the innovation networks data pilot.
 Uses https://www.githubarchive.org/ and gets the last 2 years of
-activity"""
+activity, one archive per hour. Hours already downloaded are skipped, so
+running it regularly only fetches the hours since the last run."""
 
+import argparse
+import json
 import logging
 import os
 import requests
+import shutil
 import sys
 
 from datetime import datetime, timedelta
-from time import sleep
+from time import sleep, time
+
+from .download import COMPLETE, MISSING, download
+from .metrics import add_metrics_argument, write_report
+from .shards import ShardStore, shard_key, verify_summary
+
+HOUR_FORMAT = '%Y-%m-%d-%H'
+DAY_FORMAT = '%Y-%m-%d'
 
 
 def get_file_path():
@@ -16,17 +27,20 @@ def get_file_path():
     return os.path.dirname(os.path.realpath(sys.argv[0]))
 
 
-def make_url(date_stamp=None,
-             year=datetime.now().year,
-             month=datetime.now().month,
-             day=datetime.now().day - 1,
-             hour=datetime.now().hour):
+def make_url(date_stamp=None, year=None, month=None, day=None, hour=None):
     """Return a GitHub Archive URL that will get data for
     the given year and month. Defaults to the current hour for yesterday."""
     base_url = "http://data.githubarchive.org/"
     if date_stamp:
         return base_url + date_stamp + '.json.gz'
     else:
+        # Defaults are worked out now, not when the module was imported
+        now = datetime.now()
+        yesterday = now - timedelta(1)
+        year = yesterday.year if year is None else year
+        month = yesterday.month if month is None else month
+        day = yesterday.day if day is None else day
+        hour = now.hour if hour is None else hour
         return (base_url +
                 str(year) + '-' +
                 '{:02d}'.format(month) + '-' +
@@ -40,13 +54,53 @@ def urls():
             single_date in daterange()]
 
 
-def daterange(start_date=datetime.now() - timedelta(731),
-              end_date=datetime.now()):
+def daterange(start_date=None, end_date=None):
     """yields dates for last two years, counting from yesterday"""
+    end_date = end_date or datetime.now()
+    start_date = start_date or end_date - timedelta(731)
     for n in range(int((end_date - start_date).days)):
         yield start_date + timedelta(n)
 
 
+def hours(start, end):
+    """Yields every hour from start, rounded down to the hour, up to but
+    not including end"""
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    while hour < end:
+        yield hour
+        hour += timedelta(hours=1)
+
+
+def hourly_urls(start, end):
+    """GitHub Archive URLs for every hour from start up to end"""
+    return [make_url(x.strftime(HOUR_FORMAT)) for x in hours(start, end)]
+
+
+def missing_urls(store, url_list):
+    """The URLs in url_list that don't have a shard in store"""
+    return [x for x in url_list if shard_key(x) not in store.index or
+            not os.path.exists(store.url_path(x))]
+
+
+def parse_hour(value):
+    """A datetime from a YYYY-MM-DD-HH or YYYY-MM-DD command line value"""
+    for fmt in [HOUR_FORMAT, DAY_FORMAT]:
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        "{} isn't a YYYY-MM-DD-HH or YYYY-MM-DD date".format(value))
+
+
+def sync_range(start=None, end=None, days=731):
+    """(start, end) of the hours to sync. end defaults to the start of the
+    current hour, whose archive isn't finished yet, and start to days
+    before end."""
+    end = end or datetime.now().replace(minute=0, second=0, microsecond=0)
+    return start or end - timedelta(days), end
+
+
 def out_file_name(out_path):
     """Formatted file name"""
     file_name = '{}_github_event_data.json.gz'.format(
@@ -56,9 +110,17 @@ def out_file_name(out_path):
 
 def write_data(file_obj, url_list):
     """Iterate through url_list, use requests to stream the file,
-    writing to disk in chunks"""
-    for url in url_list:
+    writing to disk in chunks. Each URL is removed from url_list once it's
+    written. Raises requests.HTTPError, before writing anything for it, if
+    a URL's response is an error, so url_list is left holding the URLs
+    still to fetch."""
+    for url in list(url_list):
         req = requests.get(url, stream=True)
+        if req.status_code != 200:
+            logging.error('%s returned status %s', url, req.status_code)
+            req.raise_for_status()
+            raise requests.HTTPError('Unexpected status {} for {}'.format(
+                req.status_code, url), response=req)
         for chunk in req.iter_content(chunk_size=1024):
             if chunk:
                 file_obj.write(chunk)
@@ -67,33 +129,126 @@ def write_data(file_obj, url_list):
         sleep(2)
 
 
+def concatenate(file_obj, entries):
+    """Append each completed download to file_obj in order"""
+    for entry in entries:
+        with open(entry['path'], 'rb') as fp:
+            shutil.copyfileobj(fp, file_obj)
+    file_obj.flush()
+
+
+def sync(store, all_urls, workers=8):
+    """Download the archives in all_urls that store doesn't have yet and
+    index them. Returns the manifest entries of the downloads."""
+    url_list = missing_urls(store, all_urls)
+    logging.info('%s of %s hours to fetch', len(url_list), len(all_urls))
+
+    manifest_path = os.path.join(store.root, 'manifest.jsonl')
+    entries = download(url_list, store.root, manifest_path=manifest_path,
+                       workers=workers, path_for=store.url_path)
+    completed = [x for x in entries if x.get('status') == COMPLETE]
+    missing = [x for x in entries if x.get('status') == MISSING]
+    if missing:
+        logging.warning('%s of %s hours are missing from the archive',
+                        len(missing), len(entries))
+    if len(completed) + len(missing) < len(entries):
+        logging.error('%s of %s downloads failed, rerun to resume',
+                      len(entries) - len(completed) - len(missing),
+                      len(entries))
+
+    # Every url here was unindexed or had lost its file, so index them all,
+    # replacing the stats of any shard that was downloaded again
+    store.add([shard_key(x['url']) for x in completed], workers=workers)
+    return entries
+
+
 def main():
     logging.basicConfig(level=logging.DEBUG, filename='/tmp/github.get_data.log')
 
+    parser = argparse.ArgumentParser(description="Download GitHub Archive data")
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help='number of concurrent downloads')
+
+    parser.add_argument('--repair',
+                        action='store_true',
+                        help='re-download shards that fail their checksum')
+
+    parser.add_argument('--verify',
+                        action='store_true',
+                        help=('read every shard in the range in full, ' +
+                              'checking its gzip stream and JSON lines, and ' +
+                              're-download damaged ones'))
+
+    parser.add_argument('--concatenate',
+                        action='store_true',
+                        help=('also write every shard into a single ' +
+                              'dated .json.gz file'))
+
+    parser.add_argument('--start',
+                        type=parse_hour,
+                        default=None,
+                        help=('first hour to sync, YYYY-MM-DD-HH or ' +
+                              'YYYY-MM-DD. Defaults to --days before --end'))
+
+    parser.add_argument('--end',
+                        type=parse_hour,
+                        default=None,
+                        help=('hour to sync up to, not included. Defaults ' +
+                              'to the current hour'))
+
+    parser.add_argument('--days',
+                        type=int,
+                        default=731,
+                        help='number of days to sync if --start isn\'t given')
+
+    add_metrics_argument(parser)
+
+    args = parser.parse_args()
+
     # Set the cwd to this file's
     os.chdir(get_file_path())
 
-    # All the urls for the json data as a deque object
-    # that supports left sided pop
-    url_list = urls()
     # Standard data folder
     out_path = "../../data/"
-
-    # make the path if it doesn't exist
-    if not os.path.exists(out_path):
-        os.mkdir(out_path)
-    out_file = out_file_name(out_path)
-
-    try:
-        fp = open(out_file, 'wb')
-        write_data(fp, url_list)
-        fp.close()
-    except Exception as e:
-        logging.error(e, exc_info=True)
-        sleep(10)
-        # Restart, the list will still hold the relevant url,
-        # as the 0 index isn't deleted until after file is flushed
-        write_data(fp, url_list)
+    # One shard per hour, partitioned by day, with an index of shard
+    # sizes, event counts and checksums
+    store = ShardStore(os.path.join(out_path, 'github_archive'))
+
+    start, end = sync_range(args.start, args.end, args.days)
+    all_urls = hourly_urls(start, end)
+    logging.info('Syncing %s to %s', start, end)
+
+    # Removing a bad shard means the downloader fetches it again
+    if args.repair:
+        for key in store.corrupted(workers=args.workers):
+            logging.info('Removing corrupt shard %s', key)
+            store.remove(key)
+
+    if args.verify:
+        keys = [shard_key(x) for x in all_urls if shard_key(x) in store.index]
+        verify_start = time()
+        healths = store.verify(keys, workers=args.workers)
+        summary = verify_summary(list(healths.values()),
+                                 time() - verify_start)
+        logging.info('Verified %s', summary)
+        print(json.dumps(summary))
+        for key, health in healths.items():
+            if not health['ok']:
+                store.remove(key)
+        store.save()
+
+    sync(store, all_urls, args.workers)
+
+    if args.concatenate:
+        # Every shard in the range, not just the ones fetched this time
+        shards = [{'path': store.url_path(x)} for x in all_urls
+                  if shard_key(x) in store.index]
+        with open(out_file_name(out_path), 'wb') as fp:
+            concatenate(fp, shards)
+    write_report(args.metrics)
 
 if __name__ == "__main__":
     main()
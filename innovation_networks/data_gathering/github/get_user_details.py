@@ -12,11 +12,21 @@ import time
 
 from datetime import datetime
 
+from . import columnar, graphql
+from .api_client import API_URL, GitHubClient
+from .crawl_state import CrawlState
+from .http_cache import HTTPCache
+from .interning import IDS_SUFFIX, LOGINS, add_strings_argument, close_tables
+from .interning import ids_path, intern_repos, open_tables, read_ids
+from .interning import write_ids
+from .json_stream import iter_records
+from .metrics import METRICS, add_metrics_argument, write_report
 
-def details_url(login, detail_type):
+
+def details_url(login, detail_type, base_url=API_URL):
     """Construct a GitHub API compliant API for a user and
     detail type"""
-    url = ('https://api.github.com/users/' +
+    url = (base_url + '/users/' +
            '{}/'.format(login) +
            '{}'.format(detail_type))
     return url
@@ -40,10 +50,10 @@ def get_file_path():
     return os.path.dirname(os.path.realpath(sys.argv[0]))
 
 
-def out_file_name(out_path, detail_type):
+def out_file_name(out_path, detail_type, extension='json'):
     """Formatted file name"""
-    file_name = '{}_github_uk_user_{}.json'.format(
-        datetime.now().strftime("%Y%m%d%H"), detail_type)
+    file_name = '{}_github_uk_user_{}.{}'.format(
+        datetime.now().strftime("%Y%m%d%H"), detail_type, extension)
     return os.path.join(out_path, file_name)
 
 
@@ -57,6 +67,22 @@ def username_passw():
         auth = None
     return auth
 
+def credentials():
+    """All GitHub credentials in the user's environment: the comma
+    separated tokens in GH_TOKENS, and the GH_USERN and GH_PASSW pair if
+    they're set"""
+    tokens = [x.strip() for x in os.environ.get('GH_TOKENS', '').split(',')
+              if x.strip()]
+    try:
+        return tokens + [username_passw()]
+    except KeyError:
+        if not tokens:
+            raise KeyError("No tokens, username or password found in the " +
+                           "environment. Please set GH_TOKENS or GH_USERN " +
+                           "and GH_PASSW and try again")
+        return tokens
+
+
 @ratelim.patient(1, 2)
 def request_rate_limit_remaining(auth_details=None):
     """Check the remaining GitHub API calls remaining, returning the
@@ -96,31 +122,179 @@ def rate_limit_ok(auth_details=None):
             {}).get('core', {}).get('reset', None)
     try:
         delta = datetime.utcfromtimestamp(time_till_renewal) - datetime.utcnow()
-        print('sleeping for {} seconds'.format(delta.total_seconds()))
+        logging.info('Rate limit reached, sleeping for %s seconds',
+                     delta.total_seconds())
+        METRICS.inc('rate_limit_sleeps')
+        METRICS.inc('rate_limit_sleep_seconds', delta.total_seconds())
         time.sleep(delta.total_seconds())
     except TypeError as e:
         t = 60
-        print('Waiting for {} seconds.'.format(t))
+        logging.info('Waiting for %s seconds', t)
+        METRICS.inc('rate_limit_sleeps')
+        METRICS.inc('rate_limit_sleep_seconds', t)
         time.sleep(t)
         rate_limit_ok(auth_details)
 
 
-def details(data, detail_type, auth_details=None):
-    """Get the detail_type details for all users in data and save them to outfile"""
-    user_dict = {}
-    if rate_limit_ok(auth_details):
-        for user in data:
-            login = user.get('user')
-            r = request_details(login, detail_type=detail_type, auth=auth_details)
-            login_names = [{key: x.get(key, {})
-                            for key in ['id', 'login', 'name', ]} for x in r.json() if type(x) is dict]
-            user_dict[login] = login_names
-            rate_remaining = returned_rate_limit_remaining(r)
-            if rate_remaining > 0:
-                continue
-            else:
-                rate_limit_ok(auth_details)
-    return user_dict
+def user_login(user):
+    """Login of a parsed user, which is either a dict or a bare login"""
+    return user.get('user') if isinstance(user, dict) else user
+
+
+def login_names(items):
+    """The id, login and name of each item of a user's details"""
+    return [{key: x.get(key, {})
+             for key in ['id', 'login', 'name', ]}
+            for x in items if type(x) is dict]
+
+
+def details(data, detail_type, auth_details=None, client=None, state=None,
+            max_age=None, backend='rest', batch_size=50, metrics=None):
+    """Get the detail_type details for all users in data. Requests are made
+    concurrently by client, which is created from auth_details if not
+    given, and are scheduled around the GitHub rate limit.
+
+    With the 'graphql' backend, which only fetches repos, batch_size
+    users are looked up in each query and the points used are counted in
+    metrics, a graphql.QueryMetrics, if given.
+
+    If state, a CrawlState, is given each user's details are recorded as
+    they arrive and users already recorded (within max_age seconds, if
+    set) aren't fetched again.
+
+    Users whose details can't be fetched, after the client's retries, are
+    logged and left out of the result. With state they go into its error
+    ledger, under failed_kind(detail_type), until a later run fetches
+    them."""
+    client = client or GitHubClient(auth_details)
+    logins = [user_login(x) for x in data]
+    failed = failed_kind(detail_type)
+    ledger = set()
+    if state is not None:
+        pending = state.pending(detail_type, logins, max_age)
+        ledger = state.fetched(failed)
+    else:
+        pending = logins
+
+    def record(login, items):
+        if state is not None:
+            state.record(detail_type, login, items)
+            if login in ledger:
+                state.delete(failed, login)
+
+    errors = {}
+    if backend == 'graphql':
+        if detail_type != 'repos':
+            raise ValueError('The GraphQL backend only fetches repos')
+
+        def record_repos(login, items):
+            record(login, login_names(items))
+
+        result = {login: login_names(items) for login, items in
+                  graphql.fetch_user_repos(client, pending, batch_size,
+                                           metrics=metrics,
+                                           callback=record_repos)}
+    else:
+        def user_details(login):
+            # Every page, 100 at a time, so prolific users aren't truncated
+            try:
+                items = login_names(client.get_pages(
+                    details_url(login, detail_type, client.base_url)))
+            except requests.exceptions.RequestException as e:
+                # One user failing shouldn't stop the rest
+                logging.error('Fetching %s of %s failed: %s', detail_type,
+                              login, e)
+                errors[login] = {'error': str(e)}
+                return login, None
+            record(login, items)
+            return login, items
+
+        result = {login: items for login, items in
+                  client.map(user_details, pending) if items is not None}
+
+    if state is None:
+        return result
+    for login in pending:
+        if login not in result:
+            state.record(failed, login,
+                         errors.get(login, {'error': 'Query failed'}))
+    done = state.fetched(detail_type)
+    return {login: state.get(detail_type, login) for login in logins
+            if login in done}
+
+
+def failed_kind(detail_type):
+    """The kind of CrawlState entry for users whose detail_type details
+    couldn't be fetched"""
+    return detail_type + '_failed'
+
+
+def add_backend_arguments(parser):
+    """Command line options for choosing the REST or GraphQL API"""
+    parser.add_argument('--backend',
+                        choices=['rest', 'graphql'],
+                        default='rest',
+                        help=('API to fetch with. GraphQL batches many ' +
+                              'users or repos into each request'))
+
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=None,
+                        help='users or repos in each GraphQL query')
+
+
+def add_state_arguments(parser):
+    """Command line options for the crawl state"""
+    parser.add_argument('--state',
+                        default=None,
+                        help=('SQLite file recording finished requests, so ' +
+                              'a restart carries on where it stopped. ' +
+                              'Defaults to crawl_state.sqlite in outpath'))
+
+    parser.add_argument('--refresh-days',
+                        type=float,
+                        default=None,
+                        help='fetch again results older than this many days')
+
+
+def open_state(args):
+    """The CrawlState for the command line and the maximum age of its
+    entries in seconds"""
+    state = CrawlState(args.state or
+                       os.path.join(args.outpath, 'crawl_state.sqlite'))
+    max_age = (args.refresh_days * 86400
+               if args.refresh_days is not None else None)
+    return state, max_age
+
+
+def add_cache_arguments(parser):
+    """Command line options for the HTTP cache"""
+    parser.add_argument('--cache',
+                        default=None,
+                        help=('SQLite file caching responses, so reruns ' +
+                              'make conditional requests'))
+
+    parser.add_argument('--cache-max-age',
+                        type=float,
+                        default=None,
+                        help='evict cached responses older than this many days')
+
+    parser.add_argument('--cache-max-mb',
+                        type=float,
+                        default=None,
+                        help='trim the cache to this many megabytes')
+
+
+def open_cache(args):
+    """The HTTPCache given on the command line, after eviction, or None"""
+    if not args.cache:
+        return None
+    cache = HTTPCache(args.cache)
+    cache.evict(max_age=(args.cache_max_age * 86400
+                         if args.cache_max_age is not None else None),
+                max_bytes=(int(args.cache_max_mb * 1024 * 1024)
+                           if args.cache_max_mb is not None else None))
+    return cache
 
 
 def main():
@@ -138,23 +312,58 @@ def main():
                         action='store',
                         help='path to out directory')
 
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=8,
+                        help='number of concurrent API requests')
+
+    add_backend_arguments(parser)
+    add_cache_arguments(parser)
+    add_state_arguments(parser)
+    columnar.add_format_argument(parser)
+    add_strings_argument(parser)
+    add_metrics_argument(parser)
+
     args = parser.parse_args()
 
-    auth_details = (username_passw())
+    client = GitHubClient(credentials=credentials(),
+                          concurrency=args.concurrency,
+                          cache=open_cache(args))
 
     # make the outpath if it doesn't exist
     if not os.path.exists(args.outpath):
         os.mkdir(args.outpath)
 
-    # open the data file contianing login names
-    with open(args.datafile, 'r') as fp:
-        data = json.load(fp)
+    state, max_age = open_state(args)
+    tables = open_tables(args.strings) if args.strings else None
+
+    # open the data file contianing login names, or their ids
+    if tables is not None and args.datafile.endswith(IDS_SUFFIX):
+        data = tables[LOGINS].lookup(read_ids(args.datafile))
+    else:
+        with open(args.datafile, 'r') as fp:
+            data = list(iter_records(fp))
 
+    metrics = graphql.QueryMetrics()
     for detail_type in ['repos']:
-        result = details(data, detail_type, auth_details)
+        result = details(data, detail_type, client=client, state=state,
+                         max_age=max_age, backend=args.backend,
+                         batch_size=args.batch_size or 50, metrics=metrics)
+    if args.backend == 'graphql':
+        logging.info('GraphQL queries: %s', metrics.summary())
 
-    with open(out_file_name(args.outpath, detail_type), 'w') as fp:
-        json.dump(result, fp)
+    outfile = out_file_name(args.outpath, detail_type, args.format)
+    if tables is not None:
+        # Write (user id, repo id) pairs alongside
+        write_ids(intern_repos(result, tables), ids_path(outfile))
+        close_tables(tables)
+
+    if args.format == 'parquet':
+        columnar.write_user_repos(result, outfile)
+    else:
+        with open(outfile, 'w') as fp:
+            json.dump(result, fp)
+    write_report(args.metrics)
 
 if __name__ == "__main__":
     main()
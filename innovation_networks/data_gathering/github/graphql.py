@@ -0,0 +1,239 @@
+"""Batched GitHub GraphQL (v4) queries for user and repo details.
+
+Over REST a crawl costs one request per user for their repos and one per
+repo for its details. GraphQL lets one query look up many users or
+repos at once under aliases, selecting only the fields wanted, so the
+same crawl takes orders of magnitude fewer requests.
+
+GraphQL has its own rate limit counted in points rather than requests.
+A query's cost is estimated the way GitHub calculates it before it's
+sent, and that many points are taken from the client's rate limit, which
+is then corrected from the X-RateLimit headers. The rateLimit field each
+query asks for records what was actually charged.
+
+Fields are aliased to their REST names where one exists, so results can
+be used in place of the REST backend's."""
+
+import logging
+import threading
+
+GRAPHQL_PATH = '/graphql'
+
+# GitHub won't return more than this many nodes from a connection
+MAX_FIRST = 100
+
+RATE_LIMIT_FIELDS = 'rateLimit { cost remaining resetAt }'
+
+# Fields of each repo listed for a user, as the REST backend keeps them
+USER_REPO_FIELDS = ['id: databaseId', 'name']
+
+REPO_FIELDS = ['id: databaseId',
+               'name',
+               'full_name: nameWithOwner',
+               'owner { login }',
+               'description',
+               'fork: isFork',
+               'created_at: createdAt',
+               'updated_at: updatedAt',
+               'pushed_at: pushedAt',
+               'homepage: homepageUrl',
+               'size: diskUsage',
+               'stargazers_count: stargazerCount',
+               'forks_count: forkCount',
+               'language: primaryLanguage { name }',
+               'license: licenseInfo { key name spdx_id: spdxId }']
+
+
+def nested_connections(fields):
+    """Number of connections, e.g. languages(first: 10) { ... }, selected
+    by fields"""
+    return sum('first:' in x for x in fields)
+
+
+def query_cost(requests):
+    """GitHub's point cost for a query needing requests requests: the
+    total divided by 100 and rounded, and at least 1"""
+    return max(1, int(round(requests / 100.0)))
+
+
+def user_repos_cost(n_logins, first=MAX_FIRST, fields=USER_REPO_FIELDS):
+    """Estimated cost of user_repos_query for n_logins logins. Each user's
+    repositories connection is one request, and each connection selected
+    on their repos is a request per repo."""
+    return query_cost(n_logins + n_logins * first * nested_connections(fields))
+
+
+def repos_cost(n_repos, fields=REPO_FIELDS):
+    """Estimated cost of repos_query for n_repos repos"""
+    return query_cost(n_repos * nested_connections(fields))
+
+
+def _query(declarations, selections):
+    """A query document declaring the variables in declarations"""
+    return 'query({}) {{ {} {} }}'.format(', '.join(declarations),
+                                         RATE_LIMIT_FIELDS,
+                                         ' '.join(selections))
+
+
+def user_repos_query(logins, first=MAX_FIRST, fields=USER_REPO_FIELDS,
+                     cursors=None):
+    """(query, variables) to list the repos each of logins owns, first at
+    a time. cursors optionally maps a login to the cursor to carry on
+    from. The user with the ith login is aliased ui."""
+    cursors = cursors or {}
+    declarations, selections, variables = [], [], {}
+    for i, login in enumerate(logins):
+        declarations += ['$l{}: String!'.format(i), '$c{}: String'.format(i)]
+        variables['l{}'.format(i)] = login
+        variables['c{}'.format(i)] = cursors.get(login)
+        selections.append(
+            'u{0}: user(login: $l{0}) {{ repositories(first: {1}, '
+            'after: $c{0}, ownerAffiliations: OWNER, '
+            'orderBy: {{field: CREATED_AT, direction: ASC}}) {{ '
+            'pageInfo {{ hasNextPage endCursor }} nodes {{ {2} }} }} }}'
+            .format(i, first, ' '.join(fields)))
+    return _query(declarations, selections), variables
+
+
+def repos_query(repos, fields=REPO_FIELDS):
+    """(query, variables) to look up repos, a list of (owner, name)
+    pairs. The ith repo is aliased ri."""
+    declarations, selections, variables = [], [], {}
+    for i, (owner, name) in enumerate(repos):
+        declarations += ['$o{}: String!'.format(i), '$n{}: String!'.format(i)]
+        variables['o{}'.format(i)] = owner
+        variables['n{}'.format(i)] = name
+        selections.append('r{0}: repository(owner: $o{0}, name: $n{0}) '
+                          '{{ {1} }}'.format(i, ' '.join(fields)))
+    return _query(declarations, selections), variables
+
+
+def batches(items, size):
+    """items in lists of at most size"""
+    items = list(items)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def rest_like(repo):
+    """repo with its language flattened to a name, as REST gives it"""
+    if isinstance(repo.get('language'), dict):
+        repo = dict(repo, language=repo['language'].get('name'))
+    return repo
+
+
+class QueryMetrics(object):
+    """Queries sent and the points they were estimated and charged"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.estimated = 0
+        self.cost = 0
+        self.remaining = None
+        self.reset_at = None
+
+    def record(self, estimated, rate_limit):
+        with self.lock:
+            self.queries += 1
+            self.estimated += estimated
+            if rate_limit:
+                self.cost += rate_limit.get('cost', 0)
+                self.remaining = rate_limit.get('remaining')
+                self.reset_at = rate_limit.get('resetAt')
+
+    def summary(self):
+        return {'queries': self.queries,
+                'points_estimated': self.estimated,
+                'points_used': self.cost,
+                'points_remaining': self.remaining,
+                'reset_at': self.reset_at}
+
+
+def run_query(client, query, variables, cost, metrics=None):
+    """POST query to the GraphQL endpoint through client, taking cost
+    points of rate limit. Returns the data, in which aliases that weren't
+    found are None, or None if the query failed."""
+    response = client.post(client.url(GRAPHQL_PATH), cost=cost,
+                           json={'query': query, 'variables': variables})
+    try:
+        body = response.json()
+    except ValueError:
+        body = {}
+    data = body.get('data')
+    if metrics is not None:
+        metrics.record(cost, (data or {}).get('rateLimit'))
+    for error in body.get('errors') or []:
+        # Missing users and repos come back as None, anything else is
+        # worth knowing about
+        if error.get('type') != 'NOT_FOUND':
+            logging.error('GraphQL error: %s', error)
+    if response.status_code != 200 or data is None:
+        logging.error('GraphQL query failed with status %s: %s',
+                      response.status_code, body)
+        return None
+    return data
+
+
+def fetch_user_repos(client, logins, batch_size=50, fields=USER_REPO_FIELDS,
+                     metrics=None, callback=None):
+    """List the repos of each of logins, batch_size users a query,
+    following each user's pages until they're all fetched. Returns
+    (login, repos) pairs for the users fetched, in order; repos is empty
+    for users that don't exist, and users in failed queries are left
+    out. callback, if given, is called with each pair as its batch
+    finishes."""
+
+    def fetch_batch(batch):
+        repos = {login: [] for login in batch}
+        cursors = {}
+        pending = list(batch)
+        while pending:
+            query, variables = user_repos_query(pending, fields=fields,
+                                                cursors=cursors)
+            data = run_query(client, query, variables,
+                             user_repos_cost(len(pending), fields=fields),
+                             metrics)
+            if data is None:
+                return []
+            next_pending = []
+            for i, login in enumerate(pending):
+                user = data.get('u{}'.format(i))
+                if user is None:
+                    continue
+                connection = user['repositories']
+                repos[login].extend(connection['nodes'])
+                if connection['pageInfo']['hasNextPage']:
+                    cursors[login] = connection['pageInfo']['endCursor']
+                    next_pending.append(login)
+            pending = next_pending
+        pairs = [(login, repos[login]) for login in batch]
+        if callback is not None:
+            for pair in pairs:
+                callback(*pair)
+        return pairs
+
+    results = client.map(fetch_batch, batches(logins, batch_size))
+    return [pair for batch in results for pair in batch]
+
+
+def fetch_repos(client, repos, batch_size=100, fields=REPO_FIELDS,
+                metrics=None, callback=None):
+    """Look up repos, a list of (owner, name) pairs, batch_size a query.
+    Returns ((owner, name), details) pairs, in order; details is None for
+    repos that weren't found or whose query failed. callback, if given,
+    is called with each pair as its batch finishes."""
+
+    def fetch_batch(batch):
+        query, variables = repos_query(batch, fields)
+        data = run_query(client, query, variables,
+                         repos_cost(len(batch), fields), metrics) or {}
+        pairs = [(repo, rest_like(data['r{}'.format(i)])
+                  if data.get('r{}'.format(i)) else None)
+                 for i, repo in enumerate(batch)]
+        if callback is not None:
+            for pair in pairs:
+                callback(*pair)
+        return pairs
+
+    results = client.map(fetch_batch, batches(repos, batch_size))
+    return [pair for batch in results for pair in batch]
@@ -0,0 +1,131 @@
+"""Persistent HTTP cache for conditional GitHub API requests.
+
+Responses are stored in SQLite with their ETag and Last-Modified headers.
+When a URL is requested again the client sends If-None-Match and
+If-Modified-Since, and a 304 Not Modified reply (which doesn't count
+against GitHub's rate limit) is answered from the cache. Entries can be
+evicted by age and the cache trimmed to a maximum size."""
+
+import json
+import sqlite3
+import threading
+import time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# Headers worth keeping with a cached body
+CACHED_HEADERS = ['Content-Type', 'ETag', 'Last-Modified', 'Link']
+
+
+class HTTPCache(object):
+    """URL keyed store of response bodies and validators"""
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                        'url TEXT PRIMARY KEY, headers TEXT, body BLOB, '
+                        'size INTEGER, stored_at REAL)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS responses_stored_at '
+                        'ON responses (stored_at)')
+        self.db.commit()
+
+    def get(self, url):
+        """(headers, body) cached for url, or None"""
+        with self.lock:
+            row = self.db.execute('SELECT headers, body FROM responses '
+                                  'WHERE url = ?', (url,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, response):
+        """Cache response if GitHub gave it a validator"""
+        headers = {key: response.headers[key] for key in CACHED_HEADERS
+                   if key in response.headers}
+        if 'ETag' not in headers and 'Last-Modified' not in headers:
+            return
+        body = response.content
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses '
+                            'VALUES (?, ?, ?, ?, ?)',
+                            (response.url, json.dumps(headers), body,
+                             len(body), self.clock()))
+            self.db.commit()
+
+    def touch(self, url):
+        """Mark url as freshly validated"""
+        with self.lock:
+            self.db.execute('UPDATE responses SET stored_at = ? WHERE url = ?',
+                            (self.clock(), url))
+            self.db.commit()
+
+    def conditional_headers(self, url):
+        """Request headers to revalidate the cached copy of url"""
+        cached = self.get(url)
+        if cached is None:
+            return {}
+        headers = {}
+        if 'ETag' in cached[0]:
+            headers['If-None-Match'] = cached[0]['ETag']
+        if 'Last-Modified' in cached[0]:
+            headers['If-Modified-Since'] = cached[0]['Last-Modified']
+        return headers
+
+    def response(self, not_modified):
+        """A 200 response built from the cache for a 304 response, or None
+        if the entry has been evicted since the request was made"""
+        cached = self.get(not_modified.url)
+        if cached is None:
+            return None
+        headers, body = cached
+        self.touch(not_modified.url)
+        response = requests.Response()
+        response.status_code = 200
+        response._content = body
+        response.url = not_modified.url
+        response.headers = CaseInsensitiveDict(not_modified.headers)
+        response.headers.update(headers)
+        response.from_cache = True
+        return response
+
+    def size(self):
+        """Total bytes of cached bodies"""
+        with self.lock:
+            return self.db.execute('SELECT COALESCE(SUM(size), 0) '
+                                   'FROM responses').fetchone()[0]
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def evict(self, max_age=None, max_bytes=None):
+        """Remove entries older than max_age seconds, then the least
+        recently validated entries until the cache is at most max_bytes.
+        Returns the number of entries removed."""
+        removed = 0
+        with self.lock:
+            if max_age is not None:
+                removed += self.db.execute(
+                    'DELETE FROM responses WHERE stored_at < ?',
+                    (self.clock() - max_age,)).rowcount
+            if max_bytes is not None:
+                total = self.db.execute('SELECT COALESCE(SUM(size), 0) '
+                                        'FROM responses').fetchone()[0]
+                rows = self.db.execute('SELECT url, size FROM responses '
+                                       'ORDER BY stored_at').fetchall()
+                for url, size in rows:
+                    if total <= max_bytes:
+                        break
+                    self.db.execute('DELETE FROM responses WHERE url = ?',
+                                    (url,))
+                    total -= size
+                    removed += 1
+            self.db.commit()
+        return removed
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,257 @@
+"""Integer ids for logins and repo names, shared between stages.
+
+The same few million logins and repos turn up again and again in every
+stage. A StringTable numbers each string the first time it's seen, and
+with a path it's kept on disk as a text file of one string per line, the
+line number being the id. New strings are appended as they're interned,
+so ids never change and every stage given the same directory of tables
+agrees on them. Stages can then write their results as ids in compact
+binary arrays and join on integers rather than strings."""
+
+import fcntl
+import os
+
+from array import array
+from contextlib import contextmanager
+
+LOGINS = 'logins'
+REPOS = 'repos'
+
+# Ids are unsigned 32 bit integers
+TYPECODE = 'I'
+IDS_SUFFIX = '.ids'
+
+
+class StringTable(object):
+    """Strings numbered 0, 1, 2... in the order they were interned. If
+    path is given the table is loaded from and appended to that file.
+
+    Several processes can share a file: new strings are appended under an
+    exclusive lock on it, after first reading whatever the others have
+    appended, so the same string never gets two ids."""
+
+    def __init__(self, strings=(), path=None):
+        self.ids = {}
+        self.strings = []
+        self.path = path
+        self.fp = None
+        # Bytes of the file read so far, and whether the lock is held
+        self.offset = 0
+        self.held = False
+        if path is not None:
+            self.fp = open(path, 'ab')
+            with self.locked():
+                pass
+        for x in strings:
+            self.intern(x)
+
+    def _add_lines(self, data):
+        """Add the complete lines of data, returning the number of bytes
+        they take. Anything after the last newline is a string whose
+        write was interrupted."""
+        end = data.rfind(b'\n') + 1
+        for x in data[:end].decode('utf-8').split('\n')[:-1]:
+            self.ids.setdefault(x, len(self.strings))
+            self.strings.append(x)
+        self.offset += end
+        return end
+
+    def _read_tail(self):
+        """Add the strings appended to the file since it was last read"""
+        size = os.fstat(self.fp.fileno()).st_size
+        if size <= self.offset:
+            return
+        with open(self.path, 'rb') as fp:
+            fp.seek(self.offset)
+            data = fp.read(size - self.offset)
+        if self._add_lines(data) < len(data):
+            # Writers hold the lock until their lines are complete, so
+            # this one was interrupted; clear it before appending
+            os.ftruncate(self.fp.fileno(), self.offset)
+
+    @contextmanager
+    def locked(self):
+        """Hold the file's lock, with the strings other processes have
+        appended read, for the block. New strings are written out before
+        it's released."""
+        if self.fp is None or self.held:
+            yield
+            return
+        fcntl.flock(self.fp.fileno(), fcntl.LOCK_EX)
+        self.held = True
+        try:
+            self._read_tail()
+            yield
+        finally:
+            self.fp.flush()
+            self.held = False
+            fcntl.flock(self.fp.fileno(), fcntl.LOCK_UN)
+
+    def _add(self, string):
+        """The id of string, appending it if it's new. Call with the lock
+        held."""
+        try:
+            return self.ids[string]
+        except KeyError:
+            if '\n' in string:
+                raise ValueError('Interned strings can\'t contain newlines')
+            self.ids[string] = len(self.strings)
+            self.strings.append(string)
+            if self.fp is not None:
+                line = (string + '\n').encode('utf-8')
+                self.fp.write(line)
+                self.offset += len(line)
+            return self.ids[string]
+
+    def intern(self, string):
+        """The id of string, adding it if it's new"""
+        try:
+            return self.ids[string]
+        except KeyError:
+            with self.locked():
+                return self._add(string)
+
+    def intern_all(self, strings):
+        """An array of the ids of strings, taking the lock once for them
+        all"""
+        with self.locked():
+            return array(TYPECODE, (self._add(x) for x in strings))
+
+    def get(self, string, default=None):
+        return self.ids.get(string, default)
+
+    def lookup(self, ids):
+        """The strings for ids"""
+        return [self.strings[i] for i in ids]
+
+    def __getitem__(self, i):
+        return self.strings[i]
+
+    def __contains__(self, string):
+        return string in self.ids
+
+    def __len__(self):
+        return len(self.strings)
+
+    def flush(self):
+        if self.fp is not None:
+            self.fp.flush()
+
+    def save(self, path):
+        """Write the table to path"""
+        with open(path, 'w', encoding='utf-8') as fp:
+            for x in self.strings:
+                fp.write(x + '\n')
+
+    @classmethod
+    def load(cls, path):
+        """A copy of the table at path in memory, not appended to. The file
+        isn't changed, and a line still being written is left out."""
+        table = cls()
+        with open(path, 'rb') as fp:
+            table._add_lines(fp.read())
+        return table
+
+    def close(self):
+        if self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_tables(path):
+    """The login and repo StringTables kept in the directory path"""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return {kind: StringTable(path=os.path.join(path, kind + '.txt'))
+            for kind in [LOGINS, REPOS]}
+
+
+def close_tables(tables):
+    for table in tables.values():
+        table.close()
+
+
+def repo_name(login, repo):
+    """The string interned for a repo, its full owner/name"""
+    return '{}/{}'.format(login, repo.get('name'))
+
+
+def with_ids(users, logins, ids=None):
+    """Yield each of users, parsed user dicts or bare logins, as a dict
+    with the 'user_id' of its login in logins, a StringTable. If ids, an
+    array, is given each id is appended to it."""
+    for user in users:
+        if not isinstance(user, dict):
+            user = {'user': user}
+        user = dict(user, user_id=logins.intern(user['user']))
+        if ids is not None:
+            ids.append(user['user_id'])
+        yield user
+
+
+def intern_repos(data, tables):
+    """Give each repo in data, a dict of login to a list of repos, the
+    'repo_id' of its full name. Returns the flattened (user_id, repo_id)
+    pairs as an array."""
+    pairs = array(TYPECODE)
+    for login, repos in data.items():
+        user_id = tables[LOGINS].intern(login)
+        for repo in repos or []:
+            repo['repo_id'] = tables[REPOS].intern(repo_name(login, repo))
+            pairs.extend((user_id, repo['repo_id']))
+    return pairs
+
+
+def repos_from_pairs(pairs, tables):
+    """The dict of login to a list of repos, in the form get_user_details
+    gives, for (user_id, repo_id) pairs"""
+    data = {}
+    for user_id, repo_id in pairs:
+        login = tables[LOGINS][user_id]
+        name = tables[REPOS][repo_id].split('/', 1)[1]
+        data.setdefault(login, []).append({'name': name})
+    return data
+
+
+def ids_path(path):
+    """The ids file that goes with the output file path"""
+    return os.path.splitext(path)[0] + IDS_SUFFIX
+
+
+def write_ids(ids, path):
+    """Write an iterable of ids to path as a binary array. Ids go in the
+    order of the rows of the output file they're written alongside, one
+    per row (or a pair per repo, see intern_repos), so the ith id is the
+    ith row's."""
+    with open(path, 'wb') as fp:
+        array(TYPECODE, ids).tofile(fp)
+
+
+def read_ids(path):
+    """The array of ids written to path by write_ids"""
+    ids = array(TYPECODE)
+    with open(path, 'rb') as fp:
+        ids.frombytes(fp.read())
+    return ids
+
+
+def read_pairs(path):
+    """The (user_id, repo_id) pairs written by write_ids"""
+    ids = read_ids(path)
+    return list(zip(ids[0::2], ids[1::2]))
+
+
+def add_strings_argument(parser):
+    """Command line option for the shared string tables"""
+    parser.add_argument('--strings',
+                        default=None,
+                        help=('directory of login and repo id tables ' +
+                              'shared between stages. Results are given ' +
+                              'ids from them, and written as arrays of ' +
+                              'ids alongside'))
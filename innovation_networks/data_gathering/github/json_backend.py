@@ -0,0 +1,28 @@
+"""Switchable JSON decoding backend.
+
+orjson decodes GitHub Archive events several times faster than the
+standard library, so it's used when installed. Both backends accept bytes
+and raise a subclass of ValueError on bad input."""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ['auto', 'json', 'orjson']
+
+
+def get_loads(backend='auto'):
+    """Return a loads function for backend. 'auto' picks orjson if it's
+    available and falls back to the standard library json module."""
+    if backend not in BACKENDS:
+        raise ValueError("Unknown JSON backend {}, choose one of {}".format(
+            backend, ', '.join(BACKENDS)))
+    if backend == 'orjson' or (backend == 'auto' and orjson is not None):
+        if orjson is None:
+            raise ImportError("orjson isn't installed. Install it with " +
+                              "`pip install orjson` or use the json backend")
+        return orjson.loads
+    return json.loads
@@ -0,0 +1,96 @@
+"""Read and write sequences of JSON records incrementally.
+
+Stages used to json.load and json.dump whole lists, so memory grew with
+the size of the data. These functions handle one record at a time, for
+both a single JSON array and JSON Lines, one record per line."""
+
+import json
+
+CHUNK_SIZE = 64 * 1024
+
+
+def _iter_array(fp, first, chunk_size):
+    """Yield the elements of the JSON array being read from fp. first is
+    the text already read, starting with the opening bracket."""
+    decoder = json.JSONDecoder()
+    buf = first[1:]
+    pos = 0
+    while True:
+        # Skip whitespace and the separating commas
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos < len(buf):
+                break
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                raise ValueError('JSON array is not terminated')
+            buf, pos = chunk, 0
+        if buf[pos] == ']':
+            return
+        try:
+            record, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            # Most likely the record carries on into the next chunk
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                raise
+            buf, pos = buf[pos:] + chunk, 0
+            continue
+        yield record
+        pos = end
+        if pos > chunk_size:
+            buf, pos = buf[pos:], 0
+
+
+def _iter_lines(fp, first):
+    """Yield a record for each non-blank line of fp. first is the text
+    already read from the first line."""
+    line = first + fp.readline()
+    while line:
+        if line.strip():
+            yield json.loads(line)
+        line = fp.readline()
+
+
+def iter_records(fp, chunk_size=CHUNK_SIZE):
+    """Yield records from fp, a text file holding either a JSON array or
+    JSON Lines"""
+    first = fp.read(1)
+    while first and first.isspace():
+        first = fp.read(1)
+    if first == '[':
+        return _iter_array(fp, first, chunk_size)
+    return _iter_lines(fp, first)
+
+
+def write_json_array(records, fp):
+    """Write records to fp as a JSON array, one at a time. Returns the
+    number of records written."""
+    n = 0
+    fp.write('[')
+    for record in records:
+        if n:
+            fp.write(', ')
+        fp.write(json.dumps(record))
+        n += 1
+    fp.write(']')
+    return n
+
+
+def write_jsonl(records, fp):
+    """Write records to fp as JSON Lines. Returns the number of records
+    written."""
+    n = 0
+    for record in records:
+        fp.write(json.dumps(record) + '\n')
+        n += 1
+    return n
+
+
+def write_records(records, fp, path):
+    """Write records to fp as JSON Lines if path ends in .jsonl, otherwise
+    as a JSON array"""
+    if path.endswith('.jsonl'):
+        return write_jsonl(records, fp)
+    return write_json_array(records, fp)
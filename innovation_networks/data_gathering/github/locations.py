@@ -0,0 +1,288 @@
+"""Resolve free text GitHub user locations to places.
+
+Locations are normalised (lower cased, accents and full stops dropped,
+split into words) and looked up in a gazetteer of places, regions and
+countries, giving each location's place, region, country and coordinates
+rather than just whether it matched.
+
+Place names in several countries, like Cambridge or London, are told
+apart by the rest of the location: a country or region anywhere in it
+("london ontario canada"), or a short region name straight after the
+place or at the end ("cambridge ma"). Otherwise the gazetteer's first
+entry for the name wins.
+
+The same few thousand location strings recur across millions of users,
+so each normalised location is only resolved once. With a LocationCache
+resolutions are also kept in SQLite between runs, and thrown away when
+the gazetteer or error names change."""
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import unicodedata
+
+from .metrics import METRICS
+from .place_matcher import PlaceMatcher, read_names, tokenize
+
+GAZETTEER = os.path.normpath(os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), '..', '..', 'data',
+    'gazetteer.tsv'))
+
+COLUMNS = ['name', 'kind', 'country', 'region', 'latitude', 'longitude']
+
+# Kinds of gazetteer entry
+COUNTRY = 'country'
+REGION = 'region'
+PLACE = 'place'
+# A short region name, like ma or nh, that only counts straight after a
+# place or at the end of a location, as elsewhere it's too easily an
+# ordinary word
+QUALIFIER = 'qualifier'
+
+# How a location resolved, besides PLACE, REGION and COUNTRY
+EXCLUDED = 'excluded'
+UNRESOLVED = 'unresolved'
+
+
+def normalise(location):
+    """Lower case words of location without accents or full stops, e.g.
+    'St. Albans, U.K.' gives 'st albans uk'"""
+    if not location:
+        return ''
+    text = unicodedata.normalize('NFKD', location)
+    text = ''.join(x for x in text if not unicodedata.combining(x))
+    return ' '.join(tokenize(text.replace('.', '')))
+
+
+def read_gazetteer(path):
+    """Entries of a tab separated gazetteer file, skipping # comments"""
+    entries = []
+    with open(path, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            if not line.strip() or line.startswith('#'):
+                continue
+            entry = dict(zip(COLUMNS, line.rstrip('\n').split('\t')))
+            for key in ['latitude', 'longitude']:
+                entry[key] = float(entry[key]) if entry.get(key) else None
+            entry['region'] = entry.get('region') or None
+            entries.append(entry)
+    return entries
+
+
+class Gazetteer(object):
+    """Gazetteer entries by normalised name. Entries are dicts of name,
+    kind, country, region, latitude and longitude; names in more than one
+    country have an entry for each, most likely first."""
+
+    def __init__(self, entries):
+        self.entries = {}
+        for entry in entries:
+            self.entries.setdefault(normalise(entry['name']), []).append(entry)
+        self.matcher = PlaceMatcher(self.entries, exclude_patterns=None)
+        self.version = hashlib.sha256(json.dumps(
+            entries, sort_keys=True).encode()).hexdigest()
+
+    @classmethod
+    def load(cls, path=GAZETTEER):
+        return cls(read_gazetteer(path))
+
+    def find(self, words):
+        """(start, end, entries) for each name in words"""
+        return [(start, end, self.entries[name])
+                for start, end, name in self.matcher.spans(words)]
+
+
+def consistent(entry, countries, regions):
+    """True if entry is in one of countries and, if any regions of its
+    country are given, one of those"""
+    if countries and entry['country'] not in countries:
+        return False
+    in_country = [x for x in regions if x[0] == entry['country']]
+    return not in_country or (entry['country'], entry['region']) in in_country
+
+
+def result(resolution, entry=None):
+    """A resolution as stored: how it resolved and what it resolved to"""
+    entry = entry or {}
+    return {'resolution': resolution,
+            'name': entry.get('name') if resolution == PLACE else None,
+            'country': entry.get('country'),
+            'region': entry.get('region'),
+            'latitude': entry.get('latitude'),
+            'longitude': entry.get('longitude')}
+
+
+def resolve_words(words, gazetteer):
+    """The resolution of a normalised location split into words"""
+    countries, regions = set(), set()
+    places, context = [], []
+    last_place_end = None
+    for start, end, entries in gazetteer.find(words):
+        for entry in entries:
+            if entry['kind'] == PLACE:
+                continue
+            if entry['kind'] == QUALIFIER and start != last_place_end and \
+                    end != len(words):
+                continue
+            countries.add(entry['country'])
+            if entry['kind'] in (REGION, QUALIFIER):
+                regions.add((entry['country'], entry['region']))
+            context.append(entry)
+        found = [x for x in entries if x['kind'] == PLACE]
+        if found:
+            places.append(found)
+            last_place_end = end
+
+    for entries in places:
+        for entry in entries:
+            if consistent(entry, countries, regions):
+                return result(PLACE, entry)
+    # Nowhere more specific than a region or country
+    for kind in [REGION, QUALIFIER, COUNTRY]:
+        for entry in context:
+            if entry['kind'] == kind:
+                return result(REGION if kind == QUALIFIER else kind, entry)
+    return result(UNRESOLVED)
+
+
+class LocationCache(object):
+    """Resolutions of normalised locations kept in SQLite, each tagged
+    with the version of the resolver that made it. Writes are committed
+    in batches."""
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS locations ('
+                        'location TEXT PRIMARY KEY, version TEXT, '
+                        'result TEXT)')
+        self.db.commit()
+
+    def load(self, version):
+        """Every stored resolution made by version, as a dict"""
+        with self.lock:
+            rows = self.db.execute('SELECT location, result FROM locations '
+                                   'WHERE version = ?', (version,)).fetchall()
+        return {location: json.loads(value) for location, value in rows}
+
+    def put(self, location, version, value):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO locations '
+                            'VALUES (?, ?, ?)',
+                            (location, version, json.dumps(value)))
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.db.commit()
+                self.pending = 0
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM locations').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+class LocationResolver(object):
+    """Resolve locations against gazetteer, remembering each normalised
+    location's resolution, and keeping them in cache, a LocationCache, if
+    given. Locations that normalise to one of error_names resolve as
+    EXCLUDED."""
+
+    def __init__(self, gazetteer=None, error_names=(), cache=None):
+        self.gazetteer = gazetteer or Gazetteer.load()
+        self.error_names = set(normalise(x) for x in error_names)
+        self.version = hashlib.sha256(json.dumps(
+            [self.gazetteer.version, sorted(self.error_names)]).encode()
+        ).hexdigest()
+        self.cache = cache
+        self.memo = cache.load(self.version) if cache is not None else {}
+        self.hits = 0
+        self.misses = 0
+        # Locations resolved since the last drain, if kept
+        self.new = None
+
+    @classmethod
+    def from_files(cls, gazetteer_path=GAZETTEER, error_names_path=None,
+                   cache_path=None):
+        error_names = read_names(error_names_path) if error_names_path else ()
+        cache = LocationCache(cache_path) if cache_path else None
+        return cls(Gazetteer.load(gazetteer_path), error_names, cache)
+
+    def resolve(self, location):
+        """A dict of the location, its normalised form, how it resolved
+        (PLACE, REGION, COUNTRY, EXCLUDED or UNRESOLVED), and the name,
+        country, region, latitude and longitude it resolved to, each None
+        if not known"""
+        key = normalise(location)
+        try:
+            value = self.memo[key]
+            self.hits += 1
+        except KeyError:
+            self.misses += 1
+            if key in self.error_names:
+                value = result(EXCLUDED)
+            else:
+                value = resolve_words(key.split(), self.gazetteer)
+            self.memo[key] = value
+            if self.cache is not None:
+                self.cache.put(key, self.version, value)
+            if self.new is not None:
+                self.new[key] = value
+        return dict(value, location=location, normalised=key)
+
+    def worker(self):
+        """A copy of the resolver to use in a forked worker process. It
+        starts from what's already known but has no cache, as the SQLite
+        connection can't be shared, and keeps what it resolves for drain"""
+        resolver = copy.copy(self)
+        resolver.cache = None
+        resolver.new = {}
+        resolver.hits = resolver.misses = 0
+        return resolver
+
+    def drain(self):
+        """(new resolutions, hits, misses) since the last drain, for the
+        parent to remember"""
+        result = (self.new or {}, self.hits, self.misses)
+        self.new = {} if self.new is not None else None
+        self.hits = self.misses = 0
+        return result
+
+    def remember(self, new, hits=0, misses=0):
+        """Add resolutions and counts drained from a worker"""
+        for key, value in new.items():
+            if key not in self.memo:
+                self.memo[key] = value
+                if self.cache is not None:
+                    self.cache.put(key, self.version, value)
+        self.hits += hits
+        self.misses += misses
+
+    def summary(self):
+        return {'locations': len(self.memo),
+                'hits': self.hits,
+                'misses': self.misses}
+
+    def close(self):
+        METRICS.inc('location_memo_hits', self.hits)
+        METRICS.inc('location_memo_misses', self.misses)
+        self.hits = self.misses = 0
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
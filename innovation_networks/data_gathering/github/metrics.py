@@ -0,0 +1,169 @@
+"""Counters and timers shared by the data gathering modules.
+
+Modules count what they do (bytes downloaded, events parsed, API calls,
+rate limit sleeps, cache hits) in the process wide METRICS, and time
+stages with METRICS.timer, which records wall and CPU time. The report
+adds the peak resident memory of the process and its children and rates
+for each counter, and can be written as JSON or, for a file ending .prom,
+in the Prometheus text format that node_exporter's textfile collector
+reads.
+
+Counters are updated under a lock, so hot loops should add up locally
+and count in batches. Counts made in worker processes aren't seen by the
+parent.
+
+profiled runs a block under cProfile when given a directory to put the
+stats in, and costs nothing otherwise."""
+
+import cProfile
+import json
+import os
+import re
+import resource
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+
+PREFIX = 'github'
+
+
+def peak_rss():
+    """Peak resident memory in bytes of this process and, separately, of
+    its largest finished child. ru_maxrss is in kB on Linux and bytes on
+    macOS."""
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return {x: resource.getrusage(who).ru_maxrss * scale
+            for x, who in [('self', resource.RUSAGE_SELF),
+                           ('children', resource.RUSAGE_CHILDREN)]}
+
+
+class Metrics(object):
+    """Named counters, and timers that add up the wall and CPU seconds of
+    each timed block"""
+
+    def __init__(self, clock=time.time, cpu_clock=time.process_time):
+        self.clock = clock
+        self.cpu_clock = cpu_clock
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+            self.started = self.clock()
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def get(self, name):
+        return self.counters.get(name, 0)
+
+    def add_time(self, name, seconds, cpu_seconds=0.0):
+        with self.lock:
+            timer = self.timers.setdefault(
+                name, {'count': 0, 'seconds': 0.0, 'cpu_seconds': 0.0})
+            timer['count'] += 1
+            timer['seconds'] += seconds
+            timer['cpu_seconds'] += cpu_seconds
+
+    @contextmanager
+    def timer(self, name):
+        """Time the block, adding to the timer called name even if it
+        raises. CPU time is this process's, across all its threads."""
+        start, cpu_start = self.clock(), self.cpu_clock()
+        try:
+            yield
+        finally:
+            self.add_time(name, self.clock() - start,
+                          self.cpu_clock() - cpu_start)
+
+    def report(self):
+        """Counters, timers, counter rates per second since the metrics
+        were started and peak memory"""
+        elapsed = max(self.clock() - self.started, 1e-9)
+        with self.lock:
+            counters = dict(self.counters)
+            timers = {k: dict(v) for k, v in self.timers.items()}
+        rss = peak_rss()
+        return {'elapsed_seconds': elapsed,
+                'counters': counters,
+                'rates': {k: v / elapsed for k, v in counters.items()},
+                'timers': timers,
+                'peak_rss_bytes': rss['self'],
+                'peak_child_rss_bytes': rss['children']}
+
+    def prometheus(self):
+        """The report in the Prometheus text exposition format"""
+        report = self.report()
+        lines = []
+
+        def metric(name, kind, samples):
+            name = '{}_{}'.format(PREFIX, re.sub('[^a-zA-Z0-9_]', '_', name))
+            lines.append('# TYPE {} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('{}{} {}'.format(name, labels, value))
+
+        for name, value in sorted(report['counters'].items()):
+            metric(name + '_total', 'counter', [('', value)])
+        for field in ['count', 'seconds', 'cpu_seconds']:
+            metric('timer_{}_total'.format(field), 'counter',
+                   [('{{name="{}"}}'.format(name), timer[field])
+                    for name, timer in sorted(report['timers'].items())])
+        for name in ['elapsed_seconds', 'peak_rss_bytes',
+                     'peak_child_rss_bytes']:
+            metric(name, 'gauge', [('', report[name])])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the report to path, in the Prometheus format if path ends
+        in .prom and as JSON otherwise. The file is replaced atomically,
+        as collectors may read it at any time."""
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            if path.endswith('.prom'):
+                fp.write(self.prometheus())
+            else:
+                json.dump(self.report(), fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, path)
+
+
+# Shared by every module in the process
+METRICS = Metrics()
+
+
+@contextmanager
+def profiled(name, directory=None):
+    """Run the block under cProfile, saving the stats to name.prof in
+    directory, if a directory is given. Read them with pstats or
+    snakeviz."""
+    if directory is None:
+        yield
+        return
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        profile.dump_stats(os.path.join(directory, name + '.prof'))
+
+
+def add_metrics_argument(parser):
+    """Command line option for the metrics report"""
+    parser.add_argument('--metrics',
+                        default=None,
+                        help=('write counters, timings and peak memory to ' +
+                              'this file, as Prometheus text if it ends in ' +
+                              '.prom and JSON otherwise'))
+
+
+def write_report(path):
+    """Write the shared metrics to path, if one is given"""
+    if path:
+        METRICS.write(path)
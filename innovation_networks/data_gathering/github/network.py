@@ -0,0 +1,372 @@
+"""Build the collaboration network from the GitHub event stream.
+
+Events are streamed into a bipartite graph of users and the repos they
+act on, weighted by the number of events, and projected onto a user-user
+graph in which two users are linked if they've both acted on a repo. The
+weight of a link is the sum over their shared repos of the smaller of
+their two event counts.
+
+Logins and repo names are interned to integer ids and edges are held in
+compact typed arrays rather than dicts of dicts. While events stream in,
+edge counts are collected in a bounded dict and flushed to sorted runs of
+64 bit (source << 32 | target) keys and 32 bit weights, which are merged
+as they accumulate. Both graphs end up in compressed sparse row (CSR)
+form: indptr[i]:indptr[i + 1] is the slice of indices and weights for
+row i. That's around 12 bytes an edge, so tens of millions of edges fit
+in memory on one machine.
+
+Repos with very many users, mostly popular repos' watchers, would add
+an edge for every pair of them to the projection, so repos with more
+than max_degree users are left out of it."""
+
+import argparse
+import heapq
+import json
+import logging
+import os
+import sys
+
+from array import array
+from operator import itemgetter
+
+from .archive_io import open_events
+from .events import NETWORK_TYPES, EventFilter, parse_list
+from .interning import LOGINS, REPOS, StringTable, add_strings_argument
+from .interning import close_tables, open_tables
+from .json_backend import BACKENDS, get_loads
+from .metrics import METRICS, add_metrics_argument, write_report
+from .shards import datafiles_for
+
+BUFFER_SIZE = 1 << 20
+MAX_RUNS = 8
+MAX_DEGREE = 1000
+
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+
+def edge_key(source, target):
+    return source << ID_BITS | target
+
+
+class EdgeCounter(object):
+    """Summed weights of (source, target) pairs of ids. Up to buffer_size
+    distinct pairs are counted in a dict, then written out as a sorted
+    run; once there are max_runs runs they're merged into one."""
+
+    def __init__(self, buffer_size=BUFFER_SIZE, max_runs=MAX_RUNS):
+        self.buffer_size = buffer_size
+        self.max_runs = max_runs
+        self.buffer = {}
+        self.runs = []
+
+    def add(self, source, target, weight=1):
+        key = edge_key(source, target)
+        self.buffer[key] = self.buffer.get(key, 0) + weight
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def update(self, pairs):
+        """Add (key, weight) pairs, keys as made by edge_key"""
+        buffer = self.buffer
+        for key, weight in pairs:
+            buffer[key] = buffer.get(key, 0) + weight
+        if len(buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """Write the buffer out as a sorted run"""
+        if not self.buffer:
+            return
+        keys = array('Q', sorted(self.buffer))
+        weights = array('I', (self.buffer[x] for x in keys))
+        self.buffer = {}
+        self.runs.append((keys, weights))
+        if len(self.runs) >= self.max_runs:
+            self.merge()
+
+    def merge(self):
+        """Merge the runs into one, summing the weights of equal keys"""
+        if len(self.runs) < 2:
+            return
+        merged = heapq.merge(*[zip(*run) for run in self.runs],
+                             key=itemgetter(0))
+        keys, weights = array('Q'), array('I')
+        last = None
+        for key, weight in merged:
+            if key == last:
+                weights[-1] += weight
+            else:
+                keys.append(key)
+                weights.append(weight)
+                last = key
+        self.runs = [(keys, weights)]
+
+    def finish(self):
+        """(keys, weights) of every pair, sorted by key"""
+        self.flush()
+        self.merge()
+        return self.runs[0] if self.runs else (array('Q'), array('I'))
+
+
+class CSR(object):
+    """A sparse matrix in compressed sparse row form"""
+
+    def __init__(self, indptr, indices, weights):
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+
+    @classmethod
+    def from_keys(cls, keys, weights, n_rows):
+        """Build from sorted edge keys and their weights"""
+        indptr = array('Q', [0]) * (n_rows + 1)
+        for key in keys:
+            indptr[(key >> ID_BITS) + 1] += 1
+        for i in range(n_rows):
+            indptr[i + 1] += indptr[i]
+        indices = array('I', (key & ID_MASK for key in keys))
+        return cls(indptr, indices, array('I', weights))
+
+    @property
+    def n_rows(self):
+        return len(self.indptr) - 1
+
+    def __len__(self):
+        """Number of stored entries"""
+        return len(self.indices)
+
+    def row(self, i):
+        """(indices, weights) of row i"""
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.weights[start:end]
+
+    @classmethod
+    def symmetric(cls, keys, weights, n_rows):
+        """Build a symmetric matrix from the sorted keys and weights of
+        its upper triangle"""
+        indptr = array('Q', [0]) * (n_rows + 1)
+        for key in keys:
+            indptr[(key >> ID_BITS) + 1] += 1
+            indptr[(key & ID_MASK) + 1] += 1
+        for i in range(n_rows):
+            indptr[i + 1] += indptr[i]
+        fill = array('Q', indptr[:-1])
+        indices = array('I', [0]) * (2 * len(keys))
+        values = array('I', [0]) * (2 * len(keys))
+        # Lower triangle entries of a row come before its upper ones, and
+        # both arrive in column order, so every row ends up sorted
+        for key, weight in zip(keys, weights):
+            j = key & ID_MASK
+            indices[fill[j]] = key >> ID_BITS
+            values[fill[j]] = weight
+            fill[j] += 1
+        for key, weight in zip(keys, weights):
+            i = key >> ID_BITS
+            indices[fill[i]] = key & ID_MASK
+            values[fill[i]] = weight
+            fill[i] += 1
+        return cls(indptr, indices, values)
+
+    def transpose(self, n_columns):
+        """This matrix's transpose, which has n_columns rows"""
+        indptr = array('Q', [0]) * (n_columns + 1)
+        for j in self.indices:
+            indptr[j + 1] += 1
+        for j in range(n_columns):
+            indptr[j + 1] += indptr[j]
+        fill = array('Q', indptr[:-1])
+        indices = array('I', [0]) * len(self.indices)
+        weights = array('I', [0]) * len(self.indices)
+        for i in range(self.n_rows):
+            for k in range(self.indptr[i], self.indptr[i + 1]):
+                j = self.indices[k]
+                indices[fill[j]] = i
+                weights[fill[j]] = self.weights[k]
+                fill[j] += 1
+        return CSR(indptr, indices, weights)
+
+    def save(self, path, name):
+        for part in ['indptr', 'indices', 'weights']:
+            with open(os.path.join(path, '{}_{}.bin'.format(name, part)),
+                      'wb') as fp:
+                getattr(self, part).tofile(fp)
+
+    @classmethod
+    def load(cls, path, name, n_rows, n_entries):
+        parts = []
+        for part, typecode, n in [('indptr', 'Q', n_rows + 1),
+                                  ('indices', 'I', n_entries),
+                                  ('weights', 'I', n_entries)]:
+            values = array(typecode)
+            with open(os.path.join(path, '{}_{}.bin'.format(name, part)),
+                      'rb') as fp:
+                values.fromfile(fp, n)
+            parts.append(values)
+        return cls(*parts)
+
+
+def project(bipartite, n_repos, max_degree=MAX_DEGREE,
+            buffer_size=BUFFER_SIZE):
+    """The symmetric user-user projection of a user-repo bipartite CSR.
+    Repos with more than max_degree users are skipped."""
+    by_repo = bipartite.transpose(n_repos)
+    counter = EdgeCounter(buffer_size)
+    for repo in range(n_repos):
+        users, counts = by_repo.row(repo)
+        if len(users) > max_degree:
+            logging.info('Leaving repo %s with %s users out of the ' +
+                         'projection', repo, len(users))
+            continue
+        # Users come in id order, so each pair is (lower, higher)
+        members = list(zip(users, counts))
+        counter.update((edge_key(u, v), min(cu, cv))
+                       for i, (u, cu) in enumerate(members)
+                       for v, cv in members[i + 1:])
+    keys, weights = counter.finish()
+    return CSR.symmetric(keys, weights, bipartite.n_rows)
+
+
+class CollaborationGraph(object):
+    """Users, repos, the bipartite user-repo graph and its user-user
+    projection"""
+
+    def __init__(self, users, repos, bipartite, projection):
+        self.users = users
+        self.repos = repos
+        self.bipartite = bipartite
+        self.projection = projection
+
+    @classmethod
+    def build(cls, events, max_degree=MAX_DEGREE, buffer_size=BUFFER_SIZE,
+              tables=None):
+        """Build from events, dicts with a 'login' and 'repo' as projected
+        by EventFilter. Events missing either are ignored. tables are the
+        shared login and repo StringTables to take ids from, if given."""
+        tables = tables or {LOGINS: StringTable(), REPOS: StringTable()}
+        users, repos = tables[LOGINS], tables[REPOS]
+        counter = EdgeCounter(buffer_size)
+        for event in events:
+            login, repo = event.get('login'), event.get('repo')
+            if login and repo:
+                counter.add(users.intern(login), repos.intern(repo))
+        keys, weights = counter.finish()
+        bipartite = CSR.from_keys(keys, weights, len(users))
+        projection = project(bipartite, len(repos), max_degree, buffer_size)
+        return cls(users, repos, bipartite, projection)
+
+    def repos_of(self, login):
+        """(repo, events) for each repo login acted on"""
+        indices, weights = self.bipartite.row(self.users.ids[login])
+        return [(self.repos[j], w) for j, w in zip(indices, weights)]
+
+    def collaborators(self, login):
+        """(login, weight) for each user linked to login"""
+        indices, weights = self.projection.row(self.users.ids[login])
+        return [(self.users[j], w) for j, w in zip(indices, weights)]
+
+    def edges(self):
+        """(login, login, weight) for each user-user link, once each"""
+        for i in range(self.projection.n_rows):
+            indices, weights = self.projection.row(i)
+            for j, w in zip(indices, weights):
+                if i < j:
+                    yield self.users[i], self.users[j], w
+
+    def summary(self):
+        return {'users': len(self.users),
+                'repos': len(self.repos),
+                'user_repo_edges': len(self.bipartite),
+                'user_user_edges': len(self.projection) // 2}
+
+    def save(self, path):
+        """Save to the directory path"""
+        if not os.path.exists(path):
+            os.mkdir(path)
+        self.users.save(os.path.join(path, 'users.txt'))
+        self.repos.save(os.path.join(path, 'repos.txt'))
+        self.bipartite.save(path, 'bipartite')
+        self.projection.save(path, 'projection')
+        meta = dict(self.summary(), byteorder=sys.byteorder,
+                    projection_entries=len(self.projection))
+        with open(os.path.join(path, 'graph.json'), 'w') as fp:
+            json.dump(meta, fp)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, 'graph.json'), 'r') as fp:
+            meta = json.load(fp)
+        if meta['byteorder'] != sys.byteorder:
+            raise ValueError('Graph at {} was saved with {} endian arrays'
+                             .format(path, meta['byteorder']))
+        users = StringTable.load(os.path.join(path, 'users.txt'))
+        repos = StringTable.load(os.path.join(path, 'repos.txt'))
+        bipartite = CSR.load(path, 'bipartite', len(users),
+                             meta['user_repo_edges'])
+        projection = CSR.load(path, 'projection', len(users),
+                              meta['projection_entries'])
+        return cls(users, repos, bipartite, projection)
+
+
+def iter_events(datafiles, types=NETWORK_TYPES, backend='auto'):
+    """Yield the login and repo of each event of types in datafiles"""
+    event_filter = EventFilter(types, ['login', 'repo'])
+    loads = get_loads(backend)
+    for datafile in datafiles:
+        with open_events(datafile) as fp:
+            yield from event_filter(fp, loads)
+
+
+def main():
+    logging.basicConfig(filename='/tmp/github.network.log',
+                        level=logging.INFO,
+                        format='%(levelname)s:%(asctime)s,%(message)s')
+
+    parser = argparse.ArgumentParser(description=("Build the collaboration " +
+                                                  "network from GitHub " +
+                                                  "event data"))
+
+    parser.add_argument(dest='datafile',
+                        action='store',
+                        help=('file containing github event data, or a ' +
+                              'directory of shards from get_data'))
+
+    parser.add_argument(dest='outpath',
+                        action='store',
+                        help='directory to save the graph in')
+
+    parser.add_argument('--types',
+                        default=','.join(NETWORK_TYPES),
+                        help='comma separated event types that link users')
+
+    parser.add_argument('--max-degree',
+                        type=int,
+                        default=MAX_DEGREE,
+                        help=('leave repos with more users than this out ' +
+                              'of the user-user projection'))
+
+    parser.add_argument('--json-backend',
+                        choices=BACKENDS,
+                        default='auto',
+                        help='JSON decoder to use')
+
+    add_strings_argument(parser)
+    add_metrics_argument(parser)
+
+    args = parser.parse_args()
+
+    events = iter_events(datafiles_for(os.path.abspath(args.datafile)),
+                         parse_list(args.types), args.json_backend)
+    tables = open_tables(args.strings) if args.strings else None
+    with METRICS.timer('network_build'):
+        graph = CollaborationGraph.build(events, args.max_degree,
+                                         tables=tables)
+    graph.save(args.outpath)
+    if tables is not None:
+        close_tables(tables)
+    print(json.dumps(graph.summary()))
+    write_report(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,53 +4,224 @@ import argparse
 import json
 import logging
 import os
+import time
 
 from datetime import datetime
+from multiprocessing import Pool
+from array import array
+
+from . import columnar
+from .archive_io import is_gzip, member_ranges, open_events, read_members
+from .events import EventFilter, parse_list
 from .get_data import get_file_path
+from .interning import LOGINS, TYPECODE, add_strings_argument, close_tables
+from .interning import ids_path, open_tables, with_ids, write_ids
+from .json_backend import BACKENDS, get_loads
+from .metrics import METRICS, add_metrics_argument, write_report
+from .shards import datafiles_for
+from .unique_users import UniqueUsers
 from sys import stdout
 
-def out_file_name(out_path):
+
+def out_file_name(out_path, extension='json'):
     """Formatted file name"""
-    file_name = '{}_github_event_data_usernames.json'.format(
-        datetime.now().strftime("%Y%m%d%H"))
+    file_name = '{}_github_event_data_usernames.{}'.format(
+        datetime.now().strftime("%Y%m%d%H"), extension)
     return os.path.join(out_path, file_name)
 
 
-def make_user_list(datafile):
-    # List of usernames that we will need to gather data on
-    users = []
-    # Parse the data file for usernames
-    with open(datafile, 'r') as fp:
-        # Used for printing number of users parsed
-        x = 1
-
-        for line in fp:
-            # Except block, incase of non-compliant JSON
-            try:
-                data = json.loads(line)
-            except json.JSONDecodeError as e:
-                data = {}
-                logging.error(e)
-            if 'actor' in data:
-                if "actor_attributes" in data:
-                    out_data = {'user': data['actor'],
-                                'attributes': data['actor_attributes']}
-                else:
-                    out_data = {'user': data['actor']['login'],
-                                'attributes': data['actor']}
-                users.append(out_data)
-            elif "login" in data.get("sender", {}):
-                users.append(data["sender"]["login"])
-            print('Parsed {} GitHub Events'.format(x), end='\r')
-            x += 1
+class Progress(object):
+    """Count the events parsed in the shared metrics, at most once every
+    interval seconds so counting isn't the bottleneck. The count is shown
+    as it goes when running in a terminal."""
+
+    def __init__(self, interval=1.0, name='events_parsed'):
+        self.interval = interval
+        self.name = name
+        self.count = 0
+        self.reported = 0
+        self.last = 0
+
+    def update(self, n=1):
+        self.count += n
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+
+    def report(self):
+        METRICS.inc(self.name, self.count - self.reported)
+        self.reported = self.count
+        if stdout.isatty():
+            print('Parsed {} GitHub Events'.format(self.count), end='\r')
             stdout.flush()
-    print("\nAll users processed")
+
+    def done(self):
+        self.report()
+        if stdout.isatty():
+            print()
+        logging.info('All users processed, %s events', self.count)
+
+
+class EventCount(object):
+    """Counts the events a worker parses, to send back with its users, as
+    its own Progress wouldn't be seen by the parent"""
+
+    def __init__(self):
+        self.count = 0
+
+    def update(self, n=1):
+        self.count += n
+
+
+def parse_event(data):
+    """The user entry for a decoded event, or None if it has no user"""
+    if 'actor' in data:
+        if "actor_attributes" in data:
+            return {'user': data['actor'],
+                    'attributes': data['actor_attributes']}
+        else:
+            return {'user': data['actor']['login'],
+                    'attributes': data['actor']}
+    elif "login" in data.get("sender", {}):
+        return data["sender"]["login"]
+    return None
+
+
+def iter_users(lines, loads=json.loads, progress=None, types=None):
+    """Decode each line of lines and yield the users found. If types is
+    given only events of those types are decoded, see EventFilter."""
+    for data in EventFilter(types).decode(lines, loads, progress):
+        user = parse_event(data)
+        if user is not None:
+            yield user
+
+
+def parse_lines(lines, loads=json.loads, progress=None, types=None):
+    """Decode each line of lines and return the users found"""
+    return list(iter_users(lines, loads, progress, types))
+
+
+def make_user_list(datafile, backend='json', types=None):
+    # Parse the data file for usernames
+    progress = Progress()
+    with open_events(datafile) as fp:
+        users = parse_lines(fp, get_loads(backend), progress, types)
+    progress.done()
+    return users
+
+
+def byte_ranges(datafile, n):
+    """Split an uncompressed datafile into n (start, end) byte ranges.
+    Ranges are only a guide: a worker reads every line that starts inside
+    its range, so lines are never split between workers."""
+    size = os.path.getsize(datafile)
+    step = max(size // n, 1)
+    starts = list(range(0, size, step))[:n]
+    return list(zip(starts, starts[1:] + [size]))
+
+
+def read_range(fp, start, end):
+    """Yield the lines of fp that start in [start, end)"""
+    if start > 0:
+        # Skip the line that started before our range, the previous
+        # worker reads it
+        fp.seek(start - 1)
+        fp.readline()
+    pos = fp.tell()
+    while pos < end:
+        line = fp.readline()
+        if not line:
+            break
+        pos += len(line)
+        yield line
+
+
+def parse_task(task):
+    """Parse one task in a worker process. A task is (datafile, start, end,
+    backend, unique, types); start and end are None to read the whole
+    file, and are gzip member boundaries for gzipped files. If unique is a
+    dict, users are deduplicated by a UniqueUsers built with it as keyword
+    arguments before being sent back. types are the event types to parse,
+    or None for all. Returns the number of events read and the users."""
+    datafile, start, end, backend, unique, types = task
+    loads = get_loads(backend)
+    events = EventCount()
+    with open_events(datafile) as fp:
+        if start is None:
+            lines = fp
+        elif is_gzip(datafile):
+            lines = read_members(datafile, start, end)
+        else:
+            lines = read_range(fp, start, end)
+        if unique is None:
+            return events.count, parse_lines(lines, loads, events, types)
+        users = UniqueUsers(**unique)
+        users.update(iter_users(lines, loads, events, types))
+        return events.count, list(users.items())
+
+
+def make_tasks(datafiles, processes, backend, unique=None, types=None):
+    """Split datafiles into tasks. With at least as many files as
+    processes, e.g. a directory of shards, each file is one task.
+    Otherwise gzipped files are divided at member boundaries and
+    uncompressed files into byte ranges."""
+    if len(datafiles) >= processes:
+        return [(datafile, None, None, backend, unique, types)
+                for datafile in datafiles]
+    tasks = []
+    for datafile in datafiles:
+        if is_gzip(datafile):
+            ranges = member_ranges(datafile, processes)
+        else:
+            ranges = byte_ranges(datafile, processes)
+        tasks.extend((datafile, start, end, backend, unique, types)
+                     for start, end in ranges)
+    return tasks
+
+
+def make_user_list_parallel(datafiles, processes=None, backend='auto',
+                            types=None):
+    """Parse datafiles across a pool of processes, returning the users in
+    the same order make_user_list would"""
+    progress = Progress()
+    users = []
+    with Pool(processes) as pool:
+        tasks = make_tasks(datafiles, processes or os.cpu_count(), backend,
+                           types=types)
+        for events, result in pool.imap(parse_task, tasks):
+            users.extend(result)
+            progress.update(events)
+    progress.done()
+    return users
+
+
+def make_unique_users(datafiles, processes=1, backend='auto', types=None,
+                      **kwargs):
+    """Stream datafiles into a UniqueUsers, which is returned. Only events
+    of types are parsed, if given. kwargs are passed to UniqueUsers, e.g.
+    memory_limit and spill_dir."""
+    users = UniqueUsers(**kwargs)
+    progress = Progress()
+    if processes > 1:
+        with Pool(processes) as pool:
+            tasks = make_tasks(datafiles, processes, backend,
+                               unique={'merge': users.merge}, types=types)
+            for events, result in pool.imap(parse_task, tasks):
+                users.update(result)
+                progress.update(events)
+    else:
+        loads = get_loads(backend)
+        for datafile in datafiles:
+            with open_events(datafile) as fp:
+                users.update(iter_users(fp, loads, progress, types))
+    progress.done()
     return users
 
 
 def main():
     logging.basicConfig(filename='/tmp/github.parse_users.log',
-                        level=logging.ERROR,
+                        level=logging.INFO,
                         format='%(levelname)s:%(asctime)s,%(message)s')
 
     # Parser for command line arguments
@@ -60,13 +231,54 @@ def main():
     # input filename
     parser.add_argument(dest='datafile',
                         action='store',
-                        help='file containing github event data')
+                        help=('file containing github event data, or a ' +
+                              'directory of shards from get_data'))
 
     # output path
     parser.add_argument(dest='outpath',
                         action='store',
                         help='path to output directory')
 
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='number of parser processes')
+
+    parser.add_argument('--json-backend',
+                        choices=BACKENDS,
+                        default='auto',
+                        help='JSON decoder to use')
+
+    parser.add_argument('--unique',
+                        action='store_true',
+                        help=('deduplicate users and write them as JSON ' +
+                              'Lines, one user per line'))
+
+    parser.add_argument('--merge-attributes',
+                        action='store_true',
+                        help=('with --unique, merge attributes from all of ' +
+                              "a user's events instead of keeping the latest"))
+
+    parser.add_argument('--memory-limit',
+                        type=int,
+                        default=None,
+                        help=('with --unique, spill users to disk once ' +
+                              'this many are held in memory'))
+
+    parser.add_argument('--spill-dir',
+                        default=None,
+                        help='directory for spilled users, defaults to /tmp')
+
+    parser.add_argument('--types',
+                        default='',
+                        help=('comma separated event types to take users ' +
+                              'from, e.g. PushEvent,ForkEvent. All types ' +
+                              'by default'))
+
+    columnar.add_format_argument(parser)
+    add_strings_argument(parser)
+    add_metrics_argument(parser)
+
     # Store it in args
     args = parser.parse_args()
 
@@ -80,15 +292,48 @@ def main():
     if not os.path.exists(out_path):
         os.mkdir(out_path)
 
-    # Make the output file
-    outfile = out_file_name(out_path)
+    datafiles = datafiles_for(args.datafile)
+    if not datafiles:
+        parser.error('No data files in {}, has get_data downloaded any?'
+                     .format(args.datafile))
+    types = parse_list(args.types)
 
+    unique = None
+    if args.unique:
+        unique = make_unique_users(datafiles, args.processes,
+                                   args.json_backend, types,
+                                   memory_limit=args.memory_limit,
+                                   spill_dir=args.spill_dir,
+                                   merge=args.merge_attributes)
+        users, extension = unique.items(), 'jsonl'
     # List of usernames andtheir attributes
-    user_list = make_user_list(args.datafile)
+    elif args.processes > 1 or len(datafiles) > 1:
+        users = make_user_list_parallel(datafiles, args.processes,
+                                        args.json_backend, types)
+        extension = 'json'
+    else:
+        users = make_user_list(datafiles[0], args.json_backend, types)
+        extension = 'json'
+
+    # Make the output file
+    if args.format == 'parquet':
+        extension = 'parquet'
+    outfile = out_file_name(out_path, extension)
 
-    # Write to file
-    with open(outfile, 'w') as fp:
-        json.dump(user_list, fp)
+    # Write to file, giving each user the id of their login if there are
+    # shared string tables
+    if args.strings:
+        tables = open_tables(args.strings)
+        ids = array(TYPECODE)
+        columnar.write_user_records(with_ids(users, tables[LOGINS], ids),
+                                    outfile)
+        write_ids(ids, ids_path(outfile))
+        close_tables(tables)
+    else:
+        columnar.write_user_records(users, outfile)
+    if unique is not None:
+        unique.close()
+    write_report(args.metrics)
 
 if __name__ == "__main__":
     main()
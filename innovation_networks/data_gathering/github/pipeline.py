@@ -0,0 +1,502 @@
+"""Run every stage, from downloading the event archive to repo details and
+the collaboration network, as one command.
+
+The stages form a DAG, each taking the outputs of the stages it depends
+on and any other input files. They run in-process, in dependency order,
+writing to fixed file names in a work directory, so no stage has to be
+told where the last one put its output. Users are streamed from one file
+into the next stage rather than loaded whole.
+
+Each stage's cache key is a hash of its parameters and the contents of
+its inputs. Keys are recorded in pipeline.json as stages finish, and a
+stage whose key hasn't changed since, and whose output is still there, is
+skipped. A stage that runs again but produces the same output leaves the
+stages after it cached.
+
+The wall and CPU time of each stage, and the peak memory of the run so far
+when it finished, are recorded alongside its key and in the shared
+metrics. Stages can be run under cProfile."""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+
+from array import array
+from datetime import datetime
+
+from .api_client import GitHubClient
+from .columnar import read_user_records, write_user_records
+from .crawl_state import CrawlState
+from .download import COMPLETE, MISSING
+from .event_index import BLOCK_SIZE, build_index
+from .events import NETWORK_TYPES, parse_list
+from .get_data import HOUR_FORMAT, hourly_urls, parse_hour, sync, sync_range
+from .get_user_details import credentials, details
+from .interning import LOGINS, TYPECODE, close_tables, ids_path, intern_repos
+from .interning import add_strings_argument, open_tables, with_ids
+from .interning import write_ids
+from .json_backend import BACKENDS
+from .metrics import METRICS, add_metrics_argument, peak_rss, profiled
+from .metrics import write_report
+from .network import MAX_DEGREE, CollaborationGraph, iter_events
+from .parse_users import make_unique_users
+from .place_matcher import PlaceMatcher
+from .repo_details import repo_crawl
+from .shards import INDEX_NAME, ShardStore, datafiles_for
+from .users_at_location import filter_parallel, filter_users
+
+STATE_NAME = 'pipeline.json'
+CHUNK_SIZE = 1024 * 1024
+
+DATA_PATH = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                         '..', '..', 'data')
+ARCHIVE_PATH = os.path.normpath(os.path.join(DATA_PATH, 'github_archive'))
+PLACE_NAMES = os.path.normpath(os.path.join(DATA_PATH,
+                                            'towns_and_cities_2015.txt'))
+ERROR_NAMES = os.path.normpath(os.path.join(DATA_PATH, 'error_names.txt'))
+
+
+class Stage(object):
+    """A step of the pipeline called name. func(inputs, output, **params)
+    writes the stage's output to the path output, given the paths of its
+    inputs, which are the names of other stages or of files. output is
+    relative to the work directory unless it's absolute. A stage that
+    isn't a default only runs when it's targeted."""
+
+    def __init__(self, name, func, inputs=(), output=None, params=None,
+                 default=True):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.output = output or name
+        self.params = params or {}
+        self.default = default
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Pipeline(object):
+    """Stages run in a work directory, which keeps their outputs and the
+    cache keys of the last successful run of each"""
+
+    def __init__(self, work_dir, stages):
+        self.work_dir = work_dir
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError('Duplicate stage {}'.format(stage.name))
+            self.stages[stage.name] = stage
+        self.state_path = os.path.join(work_dir, STATE_NAME)
+        self.state = {'stages': {}, 'files': {}}
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r') as fp:
+                self.state = json.load(fp)
+
+    def save(self):
+        """Atomically write the state to disk"""
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.state, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.state_path)
+
+    def path(self, name):
+        """The output path of the stage called name, or name itself if it
+        isn't a stage"""
+        if name in self.stages:
+            return os.path.join(self.work_dir, self.stages[name].output)
+        return name
+
+    def order(self, targets=None):
+        """Names of the stages targets need, every default stage if None,
+        with every stage after the stages it depends on"""
+        ordered = []
+        visiting = set()
+
+        def visit(name):
+            if name in ordered:
+                return
+            if name in visiting:
+                raise ValueError('Stage {} depends on itself'.format(name))
+            visiting.add(name)
+            for x in self.stages[name].inputs:
+                if x in self.stages:
+                    visit(x)
+            visiting.discard(name)
+            ordered.append(name)
+
+        if not targets:
+            targets = [x for x in self.stages if self.stages[x].default]
+        for name in targets:
+            if name not in self.stages:
+                raise ValueError('Unknown stage {}'.format(name))
+            visit(name)
+        return ordered
+
+    def fingerprint(self, path):
+        """A hash of what's at path: a file's contents, the checksums of
+        the shards in a shard store, or the files in any other directory.
+        File hashes are remembered until the file's size or modification
+        time changes."""
+        if not os.path.exists(path):
+            return None
+        if os.path.isdir(path):
+            if os.path.exists(os.path.join(path, INDEX_NAME)):
+                index = ShardStore(path).index
+                shards = [[key, index[key].get('sha256')]
+                          for key in sorted(index)]
+                return hashlib.sha256(json.dumps(shards).encode()).hexdigest()
+            digest = hashlib.sha256()
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    full_path = os.path.join(root, name)
+                    digest.update(os.path.relpath(full_path, path).encode())
+                    digest.update(self.fingerprint(full_path).encode())
+            return digest.hexdigest()
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        known = self.state['files'].get(path)
+        if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return known[2]
+        digest = file_hash(path)
+        self.state['files'][path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def key(self, stage):
+        """The cache key of stage given its current inputs"""
+        data = {'stage': stage.name,
+                'params': stage.params,
+                'inputs': [self.fingerprint(self.path(x))
+                           for x in stage.inputs]}
+        return hashlib.sha256(json.dumps(data, sort_keys=True)
+                              .encode()).hexdigest()
+
+    def cached(self, stage, key):
+        return (self.state['stages'].get(stage.name, {}).get('key') == key and
+                os.path.exists(self.path(stage.name)))
+
+    def run(self, targets=None, force=(), profile_dir=None):
+        """Run the stages targets need, skipping those whose key is
+        unchanged unless they're in force. If profile_dir is given each
+        stage's cProfile stats are saved there. Returns a dict of stage name
+        to 'ran' or 'cached'."""
+        if not os.path.exists(self.work_dir):
+            os.makedirs(self.work_dir)
+        results = {}
+        for name in self.order(targets):
+            stage = self.stages[name]
+            key = self.key(stage)
+            if name not in force and self.cached(stage, key):
+                logging.info('Stage %s is cached', name)
+                results[name] = 'cached'
+                continue
+            logging.info('Running stage %s', name)
+            start, cpu_start = time.time(), time.process_time()
+            with profiled(name, profile_dir), METRICS.timer('stage_' + name):
+                stage.func([self.path(x) for x in stage.inputs],
+                           self.path(name), **stage.params)
+            self.state['stages'][name] = {
+                'key': key,
+                'seconds': time.time() - start,
+                'cpu_seconds': time.process_time() - cpu_start,
+                'peak_rss_bytes': max(peak_rss().values()),
+                'finished_at': datetime.utcnow().isoformat()}
+            self.save()
+            results[name] = 'ran'
+        self.save()
+        return results
+
+
+def archive_stage(inputs, output, start, end, workers=8):
+    """Download the hourly archives from start to end into a shard store.
+    Hours the archive hasn't got are recorded as missing in its manifest
+    and left out; other failures fail the stage."""
+    store = ShardStore(output)
+    url_list = hourly_urls(parse_hour(start), parse_hour(end))
+    failed = [x for x in sync(store, url_list, workers)
+              if x.get('status') not in (COMPLETE, MISSING)]
+    if failed:
+        # Not recorded as finished, so the next run tries them again
+        raise RuntimeError('{} downloads failed, rerun to resume'
+                           .format(len(failed)))
+
+
+def write_users(users, output, strings=None):
+    """Write users to output. With strings, a directory of string tables,
+    each is given the id of its login and the ids are written alongside."""
+    if strings is None:
+        write_user_records(users, output)
+        return
+    tables = open_tables(strings)
+    ids = array(TYPECODE)
+    write_user_records(with_ids(users, tables[LOGINS], ids), output)
+    write_ids(ids, ids_path(output))
+    close_tables(tables)
+
+
+def users_stage(inputs, output, processes=1, backend='auto', types=None,
+                memory_limit=None, strings=None):
+    """The unique users in the event archive"""
+    unique = make_unique_users(datafiles_for(inputs[0]), processes, backend,
+                               types, memory_limit=memory_limit)
+    write_users(unique.items(), output, strings)
+    unique.close()
+
+
+def location_stage(inputs, output, processes=1, strings=None):
+    """Users at the places in the place names file, less the error names"""
+    users, place_names, error_names = inputs
+    matcher = PlaceMatcher.from_files(place_names, error_names)
+    users = read_user_records(users)
+    if processes > 1:
+        users = filter_parallel(users, matcher, processes=processes)
+    else:
+        users = filter_users(users, matcher)
+    write_users(users, output, strings)
+
+
+def crawl_state(output):
+    return CrawlState(os.path.join(os.path.dirname(output),
+                                   'crawl_state.sqlite'))
+
+
+def user_repos_stage(inputs, output, backend='rest', batch_size=50,
+                     concurrency=8, strings=None):
+    """The repos of each user. With strings, a directory of string
+    tables, (user id, repo id) pairs are written alongside."""
+    client = GitHubClient(credentials=credentials(), concurrency=concurrency)
+    with crawl_state(output) as state:
+        result = details(list(read_user_records(inputs[0])), 'repos',
+                         client=client, state=state, backend=backend,
+                         batch_size=batch_size)
+    write_pairs(result, output, strings)
+    with open(output, 'w') as fp:
+        json.dump(result, fp)
+
+
+def repos_stage(inputs, output, backend='rest', batch_size=100,
+                concurrency=16, strings=None):
+    """Details of each user's repos, with their ids alongside if strings
+    is given"""
+    with open(inputs[0], 'r') as fp:
+        data = json.load(fp)
+    client = GitHubClient(credentials=credentials(), concurrency=concurrency)
+    with crawl_state(output) as state:
+        result = repo_crawl(data, client=client, state=state,
+                            concurrency=concurrency, backend=backend,
+                            batch_size=batch_size)
+    write_pairs(result, output, strings)
+    with open(output, 'w') as fp:
+        json.dump(result, fp)
+
+
+def write_pairs(result, output, strings=None):
+    """Give the repos in result ids from the string tables in the
+    directory strings, if given, and write the (user id, repo id) pairs
+    next to output"""
+    if strings is None:
+        return
+    tables = open_tables(strings)
+    write_ids(intern_repos(result, tables), ids_path(output))
+    close_tables(tables)
+
+
+def network_stage(inputs, output, types=NETWORK_TYPES, max_degree=MAX_DEGREE,
+                  backend='auto', strings=None):
+    """The collaboration network of the events in the archive"""
+    events = iter_events(datafiles_for(inputs[0]), types, backend)
+    tables = open_tables(strings) if strings else None
+    CollaborationGraph.build(events, max_degree, tables=tables).save(output)
+    if tables is not None:
+        close_tables(tables)
+
+
+def event_index_stage(inputs, output, types=None, block_size=BLOCK_SIZE,
+                      backend='auto', strings=None):
+    """The archive's events in compressed blocks, indexed by user and repo.
+    The index isn't updated in place, so every change to the archive means
+    reading and compressing all of it again."""
+    tables = open_tables(strings) if strings else None
+    build_index(datafiles_for(inputs[0]), output, types, block_size,
+                backend=backend, tables=tables)
+    if tables is not None:
+        close_tables(tables)
+
+
+def stage_params(params, **options):
+    """params with those of options that are set. Options left unset
+    aren't added, so they don't change the stages' cache keys."""
+    return dict(params, **{k: v for k, v in options.items() if v is not None})
+
+
+def github_stages(archive=ARCHIVE_PATH, place_names=PLACE_NAMES,
+                  error_names=ERROR_NAMES, start=None, end=None, days=731,
+                  workers=8, processes=1, json_backend='auto', types=None,
+                  api_backend='rest', batch_size=None, max_degree=MAX_DEGREE,
+                  concurrency=None, strings=None):
+    """The stages of the GitHub pipeline. concurrency, the number of
+    concurrent API requests, defaults to each API stage's own. With
+    strings, a directory of string tables, stages give logins and repos
+    ids from them and write the ids alongside their output."""
+    start, end = sync_range(start, end, days)
+    return [Stage('archive', archive_stage, output=archive,
+                  params={'start': start.strftime(HOUR_FORMAT),
+                          'end': end.strftime(HOUR_FORMAT),
+                          'workers': workers}),
+            Stage('users', users_stage, ['archive'], 'users.jsonl',
+                  stage_params({'processes': processes,
+                                'backend': json_backend, 'types': types},
+                               strings=strings)),
+            Stage('users_at_location', location_stage,
+                  ['users', place_names, error_names],
+                  'users_at_location.jsonl',
+                  stage_params({'processes': processes}, strings=strings)),
+            Stage('user_repos', user_repos_stage, ['users_at_location'],
+                  'user_repos.json',
+                  stage_params({'backend': api_backend,
+                                'batch_size': batch_size or 50},
+                               concurrency=concurrency, strings=strings)),
+            Stage('repo_details', repos_stage, ['user_repos'],
+                  'repo_details.json',
+                  stage_params({'backend': api_backend,
+                                'batch_size': batch_size or 100},
+                               concurrency=concurrency, strings=strings)),
+            Stage('network', network_stage, ['archive'], 'network',
+                  stage_params({'types': NETWORK_TYPES,
+                                'max_degree': max_degree,
+                                'backend': json_backend}, strings=strings)),
+            # Rebuilt from the whole archive whenever it changes, which is
+            # too slow to do after every hour's new shard
+            Stage('event_index', event_index_stage, ['archive'],
+                  'event_index',
+                  stage_params({'backend': json_backend}, strings=strings),
+                  default=False)]
+
+
+def main():
+    logging.basicConfig(filename='/tmp/github.pipeline.log',
+                        level=logging.INFO,
+                        format='%(levelname)s:%(asctime)s,%(message)s')
+
+    parser = argparse.ArgumentParser(description=("Run the GitHub pipeline, " +
+                                                  "skipping stages whose " +
+                                                  "inputs haven't changed"))
+
+    parser.add_argument(dest='work_dir',
+                        action='store',
+                        help='directory for stage outputs and the cache')
+
+    parser.add_argument('--targets',
+                        default='',
+                        help=('comma separated stages to bring up to date, ' +
+                              'with the stages they need. All by default'))
+
+    parser.add_argument('--force',
+                        default='',
+                        help='comma separated stages to run even if cached')
+
+    parser.add_argument('--archive',
+                        default=ARCHIVE_PATH,
+                        help='shard directory to download the archive to')
+
+    parser.add_argument('--place-names',
+                        default=PLACE_NAMES,
+                        help='file of place names to match, 1 per line')
+
+    parser.add_argument('--error-names',
+                        default=ERROR_NAMES,
+                        help='file of locations to leave out, 1 per line')
+
+    parser.add_argument('--start',
+                        type=parse_hour,
+                        default=None,
+                        help='first hour of the archive, YYYY-MM-DD-HH')
+
+    parser.add_argument('--end',
+                        type=parse_hour,
+                        default=None,
+                        help='hour to download up to, not included')
+
+    parser.add_argument('--days',
+                        type=int,
+                        default=731,
+                        help='number of days to download if --start isn\'t given')
+
+    parser.add_argument('--workers',
+                        type=int,
+                        default=8,
+                        help='number of concurrent archive downloads')
+
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='number of parser processes')
+
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=None,
+                        help=('number of concurrent API requests. 8 for ' +
+                              'user repos and 16 for repo details by ' +
+                              'default'))
+
+    parser.add_argument('--json-backend',
+                        choices=BACKENDS,
+                        default='auto',
+                        help='JSON decoder to use')
+
+    parser.add_argument('--types',
+                        default='',
+                        help='comma separated event types to take users from')
+
+    parser.add_argument('--backend',
+                        choices=['rest', 'graphql'],
+                        default='rest',
+                        help='API to fetch user and repo details with')
+
+    parser.add_argument('--batch-size',
+                        type=int,
+                        default=None,
+                        help='users or repos in each GraphQL query')
+
+    parser.add_argument('--profile',
+                        default=None,
+                        help=('directory to write each stage\'s cProfile ' +
+                              'stats to, as stage.prof'))
+
+    add_strings_argument(parser)
+    add_metrics_argument(parser)
+
+    args = parser.parse_args()
+
+    stages = github_stages(os.path.abspath(args.archive),
+                           os.path.abspath(args.place_names),
+                           os.path.abspath(args.error_names),
+                           args.start, args.end, args.days,
+                           workers=args.workers,
+                           processes=args.processes,
+                           json_backend=args.json_backend,
+                           types=parse_list(args.types),
+                           api_backend=args.backend,
+                           batch_size=args.batch_size,
+                           concurrency=args.concurrency,
+                           strings=(os.path.abspath(args.strings)
+                                    if args.strings else None))
+    pipeline = Pipeline(args.work_dir, stages)
+    results = pipeline.run(parse_list(args.targets),
+                           force=parse_list(args.force) or (),
+                           profile_dir=args.profile)
+    print(json.dumps(results))
+    write_report(args.metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Match free text GitHub user locations against a list of place names.
+
+The matcher is built once from the place name file. Single word places
+are looked up in a set, and multi-word places such as "milton keynes" are
+found with a trie over words, so each location costs one pass over its
+words however many place names there are. Locations that exactly match
+an error name, or contain an excluded phrase such as "new york", never
+match."""
+
+import re
+
+# Words, keeping hyphenated names like stoke-on-trent together
+WORD = re.compile(r"[^\W_]+(?:['-][^\W_]+)*")
+
+# Mostly US places (New York matches York)
+EXCLUDE_PATTERNS = [r'new york']
+
+# Marks the end of a place name in the trie
+END = None
+
+
+def tokenize(location):
+    """Lower case words of a location string"""
+    return WORD.findall(location.lower())
+
+
+def read_names(path):
+    """Lines of a names file, skipping blanks"""
+    with open(path, 'r') as fp:
+        return [x for x in fp.read().splitlines() if x.strip()]
+
+
+class PlaceMatcher(object):
+    """Find place names in location strings.
+
+    place_names and error_names are iterables of strings. Error names are
+    matched against the whole lower cased location, exclude_patterns are
+    regular expressions searched for anywhere in it."""
+
+    def __init__(self, place_names, error_names=(),
+                 exclude_patterns=EXCLUDE_PATTERNS):
+        self.single = set()
+        self.trie = {}
+        for name in place_names:
+            words = tokenize(name)
+            if len(words) == 1:
+                self.single.add(words[0])
+            elif words:
+                node = self.trie
+                for word in words:
+                    node = node.setdefault(word, {})
+                node[END] = ' '.join(words)
+        self.error_names = set(x.lower() for x in error_names)
+        self.exclude = (re.compile('|'.join(exclude_patterns))
+                        if exclude_patterns else None)
+
+    @classmethod
+    def from_files(cls, place_names_path, error_names_path=None, **kwargs):
+        """Build a matcher from a place name file and optional error name
+        file, each with one name per line"""
+        error_names = read_names(error_names_path) if error_names_path else ()
+        return cls(read_names(place_names_path), error_names, **kwargs)
+
+    def spans(self, words):
+        """(start, end, name) for each place name in words, a tokenized
+        location, in the order they appear. The longest name starting at
+        each word wins."""
+        found = []
+        i = 0
+        while i < len(words):
+            match, length = None, 1
+            if words[i] in self.single:
+                match = words[i]
+            node = self.trie.get(words[i])
+            j = i + 1
+            while node is not None:
+                if END in node:
+                    match, length = node[END], j - i
+                if j == len(words):
+                    break
+                node = node.get(words[j])
+                j += 1
+            if match is not None:
+                found.append((i, i + length, match))
+            i += length
+        return found
+
+    def places(self, location):
+        """Place names found in location, in the order they appear"""
+        return [name for _, _, name in self.spans(tokenize(location))]
+
+    def excluded(self, location):
+        """True if location is a known error or contains an excluded
+        phrase"""
+        lower = location.lower()
+        if lower in self.error_names:
+            return True
+        return self.exclude is not None and self.exclude.search(lower) is not None
+
+    def matches(self, location):
+        """True if location names a place and isn't excluded"""
+        if not location:
+            return False
+        return not self.excluded(location) and bool(self.places(location))
@@ -0,0 +1,185 @@
+"""Asynchronous bulk crawler for GitHub repo details.
+
+Repos are fetched by a fixed number of asyncio workers, each running a
+blocking GitHubClient request on a thread so the client's rate
+limiting, credential pool and cache all still apply. Server errors are
+retried with exponential backoff, while rate and abuse limits are
+already waited out by the client; repos that still fail go into an
+error ledger in the crawl state so they can be retried later, and
+throughput is tracked as the crawl runs."""
+
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Kinds of CrawlState entry the crawler writes
+REPO = 'repo'
+FAILED = 'repo_failed'
+
+
+def retryable(status):
+    """True for responses worth trying again: server errors. Rate limited
+    403s and 429s have already been retried by the client, so any that
+    get here are final."""
+    return status >= 500
+
+
+class CrawlMetrics(object):
+    """Counts and rates for a crawl"""
+
+    def __init__(self, clock=time.time):
+        self.clock = clock
+        self.started = clock()
+        self.repos = 0
+        self.skipped = 0
+        self.requests = 0
+        self.cached = 0
+        self.retries = 0
+        self.failures = 0
+
+    def summary(self):
+        minutes = max(self.clock() - self.started, 1e-9) / 60
+        return {'repos': self.repos,
+                'skipped': self.skipped,
+                'failures': self.failures,
+                'requests': self.requests,
+                'retries': self.retries,
+                'cache_hits': self.cached,
+                # 304s from the cache don't count against the rate limit
+                'quota_used': self.requests - self.cached,
+                'minutes': round(minutes, 3),
+                'repos_per_minute': round(self.repos / minutes, 1)}
+
+
+class RepoCrawler(object):
+    """Fetch the details of many repos through client.
+
+    state is an optional CrawlState: finished repos are recorded and
+    skipped on later runs, and failures are kept in its ledger."""
+
+    def __init__(self, client, state=None, concurrency=16, retries=4,
+                 backoff=1.0, max_age=None):
+        self.client = client
+        self.state = state
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.max_age = max_age
+        self.metrics = CrawlMetrics()
+        self.ledger = set()
+
+    async def fetch(self, executor, login, name):
+        """The details of login/name, or None if it couldn't be fetched"""
+        key = '{}/{}'.format(login, name)
+        loop = asyncio.get_running_loop()
+        url = self.client.url('/repos/{}/{}'.format(login, name))
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                self.metrics.retries += 1
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = await loop.run_in_executor(executor,
+                                                      self.client.get, url)
+            except requests.exceptions.RequestException as e:
+                error = {'error': str(e)}
+                continue
+            self.metrics.requests += 1
+            if getattr(response, 'from_cache', False):
+                self.metrics.cached += 1
+            if response.status_code == 200:
+                try:
+                    result = response.json()
+                except ValueError as e:
+                    # Usually a body cut short, so worth another try
+                    error = {'error': 'invalid JSON: {}'.format(e)}
+                    continue
+                self.metrics.repos += 1
+                if self.state is not None:
+                    self.state.record(REPO, key, result)
+                    if key in self.ledger:
+                        self.state.delete(FAILED, key)
+                return result
+            error = {'status': response.status_code}
+            if not retryable(response.status_code):
+                break
+        logging.error('Fetching %s failed: %s', key, error)
+        self.metrics.failures += 1
+        if self.state is not None:
+            self.state.record(FAILED, key, dict(error, attempts=attempt + 1))
+        return None
+
+    async def worker(self, executor, queue, results):
+        """Fetch repos from queue until it's empty"""
+        while True:
+            try:
+                login, name = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            results['{}/{}'.format(login, name)] = await self.fetch(
+                executor, login, name)
+
+    async def crawl(self, data):
+        """Fetch every repo in data, a dict of login to a list of repos
+        with a 'name'. Returns a dict of login to repo details."""
+        done = set()
+        self.ledger = set()
+        if self.state is not None:
+            done = self.state.fetched(REPO, self.max_age)
+            self.ledger = self.state.fetched(FAILED)
+
+        queue = asyncio.Queue()
+        for login, repos in data.items():
+            for repo in repos:
+                if '{}/{}'.format(login, repo.get('name')) in done:
+                    self.metrics.skipped += 1
+                else:
+                    queue.put_nowait((login, repo.get('name')))
+
+        # A fixed number of workers rather than a task per repo keeps
+        # memory flat however many repos there are
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            await asyncio.gather(*[self.worker(executor, queue, results)
+                                   for _ in range(self.concurrency)])
+
+        repo_dict = {}
+        for login, repos in data.items():
+            repo_dict[login] = []
+            for repo in repos:
+                key = '{}/{}'.format(login, repo.get('name'))
+                result = (results[key] if key in results
+                          else self.state.get(REPO, key))
+                if result is not None:
+                    repo_dict[login].append(result)
+        return repo_dict
+
+    def run(self, data):
+        """Run crawl to completion"""
+        return asyncio.run(self.crawl(data))
+
+
+def recorded_repos(data, state):
+    """The details recorded in state for each repo in data, in the form
+    crawl returns. Repos that haven't been fetched are left out."""
+    repo_dict = {}
+    for login, repos in data.items():
+        repo_dict[login] = []
+        for repo in repos:
+            result = state.get(REPO, '{}/{}'.format(login, repo.get('name')))
+            if result is not None:
+                repo_dict[login].append(result)
+    return repo_dict
+
+
+def failed_repos(state):
+    """The repos in state's error ledger, in the form crawl takes"""
+    data = {}
+    for key in sorted(state.fetched(FAILED)):
+        login, name = key.split('/', 1)
+        data.setdefault(login, []).append({'name': name})
+    return data
@@ -2,10 +2,17 @@
 """Script for getting repo details from github using the dict produced
 by get_user_details.py"""
 
-from get_user_details import get_file_path
-from get_user_details import get_file_path, username_passw
-from get_user_details import request_rate_limit_remaining, returned_rate_limit_remaining
-from get_user_details import rate_limit_ok
+from . import columnar, graphql
+from .api_client import API_URL, GitHubClient
+from .get_user_details import add_backend_arguments, add_cache_arguments
+from .get_user_details import add_state_arguments, credentials, open_cache
+from .get_user_details import open_state
+from .interning import IDS_SUFFIX, add_strings_argument, close_tables
+from .interning import ids_path, intern_repos, open_tables, read_pairs
+from .interning import repos_from_pairs, write_ids
+from .metrics import add_metrics_argument, write_report
+from .repo_crawler import FAILED, REPO, RepoCrawler, failed_repos
+from .repo_crawler import recorded_repos
 from datetime import datetime
 
 import argparse
@@ -15,20 +22,19 @@ import os
 import requests
 
 
-def out_file_name(out_path):
+def out_file_name(out_path, extension='json'):
     """Formatted file name"""
-    file_name = '{}_github_uk_user_repo.json'.format(
-        datetime.now().strftime("%Y%m%d%H"))
+    file_name = '{}_github_uk_user_repo.{}'.format(
+        datetime.now().strftime("%Y%m%d%H"), extension)
     return os.path.join(out_path, file_name)
 
 
-def repos_url(login, repo_name):
+def repos_url(login, repo_name, base_url=API_URL):
     """Construct a GitHub API compliant API for a repo and
     """
-    url = ('https://api.github.com/repos/' +
+    url = (base_url + '/repos/' +
            '{}/'.format(login) +
            '{}'.format(repo_name))
-    print(url)
     return url
 
 
@@ -43,33 +49,62 @@ def request_repo_details(login, repo_name, auth=None):
     return req
 
 
-def repo_crawl(data, auth_details=None):
-    """Get more detailed data on repos"""
-    if rate_limit_ok(auth_details):
-        repo_dict = {}
-        for user in data:
-            print(user)
-            repo_dict[user] = []
-            for repo in data[user]:
-                print(repo)
-                repo_name = repo.get('name')
-                try:
-                    r = request_repo_details(user, repo_name, auth=auth_details)
-                except:
-                    continue
-                repo_dict[user].append(r.json())
-                try:
-                    rate_remaining = returned_rate_limit_remaining(r)
-                except:
-                    continue
-                if rate_remaining > 0:
-                    continue
-                else:
-                    try:
-                        rate_limit_ok(auth_details)
-                    except:
-                        continue
-        return repo_dict
+def repo_crawl_graphql(data, client, state=None, max_age=None,
+                       batch_size=100, metrics=None):
+    """repo_crawl with the GraphQL backend, looking up batch_size repos in
+    each query. Repos that aren't found go into the crawl state's error
+    ledger."""
+    done = state.fetched(REPO, max_age) if state is not None else set()
+    repos = [(login, repo.get('name')) for login, user_repos in data.items()
+             for repo in user_repos]
+    pending = [x for x in repos if '{}/{}'.format(*x) not in done]
+
+    def record(repo, result):
+        key = '{}/{}'.format(*repo)
+        if state is None:
+            return
+        if result is None:
+            state.record(FAILED, key, {'error': 'not found'})
+        else:
+            state.record(REPO, key, result)
+            state.delete(FAILED, key)
+
+    results = dict(graphql.fetch_repos(client, pending, batch_size,
+                                       metrics=metrics, callback=record))
+    repo_dict = {}
+    for login, user_repos in data.items():
+        repo_dict[login] = []
+        for repo in user_repos:
+            key = (login, repo.get('name'))
+            result = (results[key] if key in results
+                      else state.get(REPO, '{}/{}'.format(*key)))
+            if result is not None:
+                repo_dict[login].append(result)
+    return repo_dict
+
+
+def repo_crawl(data, auth_details=None, client=None, state=None,
+               max_age=None, concurrency=16, backend='rest',
+               batch_size=100, metrics=None):
+    """Get more detailed data on repos, fetching up to concurrency at once
+    with a RepoCrawler. Requests are made by client, which is created from
+    auth_details if not given.
+
+    With the 'graphql' backend batch_size repos are looked up in each
+    query instead, see repo_crawl_graphql.
+
+    If state, a CrawlState, is given each repo is recorded as it arrives
+    and repos already recorded (within max_age seconds, if set) aren't
+    fetched again."""
+    client = client or GitHubClient(auth_details)
+    if backend == 'graphql':
+        return repo_crawl_graphql(data, client, state, max_age, batch_size,
+                                  metrics)
+    crawler = RepoCrawler(client, state=state, concurrency=concurrency,
+                          max_age=max_age)
+    repo_dict = crawler.run(data)
+    logging.info('Crawl finished: %s', crawler.metrics.summary())
+    return repo_dict
 
 
 def main():
@@ -87,22 +122,70 @@ def main():
                         action='store',
                         help='path to out directory')
 
+    parser.add_argument('--concurrency',
+                        type=int,
+                        default=16,
+                        help='number of concurrent API requests')
+
+    parser.add_argument('--retry-failed',
+                        action='store_true',
+                        help=('only fetch the repos that failed on an ' +
+                              'earlier run, writing them with the repos ' +
+                              'already fetched'))
+
+    add_backend_arguments(parser)
+    add_cache_arguments(parser)
+    add_state_arguments(parser)
+    columnar.add_format_argument(parser)
+    add_strings_argument(parser)
+    add_metrics_argument(parser)
+
     args = parser.parse_args()
 
-    auth_details = (username_passw())
+    client = GitHubClient(credentials=credentials(), cache=open_cache(args),
+                          concurrency=args.concurrency)
 
     # make the outpath if it doesn't exist
     if not os.path.exists(args.outpath):
         os.mkdir(args.outpath)
 
-    # open the data file contianing login names
-    with open(args.datafile, 'r') as fp:
-        data = json.load(fp)
-
-    data = repo_crawl(data, auth_details)
+    state, max_age = open_state(args)
+    tables = open_tables(args.strings) if args.strings else None
 
-    with open(out_file_name(args.outpath), 'w') as fp:
-        json.dump(data, fp)
+    # open the data file contianing login names and their repos, or the
+    # ids of both
+    if tables is not None and args.datafile.endswith(IDS_SUFFIX):
+        data = repos_from_pairs(read_pairs(args.datafile), tables)
+    else:
+        with open(args.datafile, 'r') as fp:
+            data = json.load(fp)
+
+    metrics = graphql.QueryMetrics()
+    if args.retry_failed:
+        # The rest were recorded by earlier runs, so the output still
+        # covers every repo
+        repo_crawl(failed_repos(state), client=client, state=state,
+                   concurrency=args.concurrency, backend=args.backend,
+                   batch_size=args.batch_size or 100, metrics=metrics)
+        data = recorded_repos(data, state)
+    else:
+        data = repo_crawl(data, client=client, state=state, max_age=max_age,
+                          concurrency=args.concurrency, backend=args.backend,
+                          batch_size=args.batch_size or 100, metrics=metrics)
+    if args.backend == 'graphql':
+        logging.info('GraphQL queries: %s', metrics.summary())
+
+    outfile = out_file_name(args.outpath, args.format)
+    if tables is not None:
+        write_ids(intern_repos(data, tables), ids_path(outfile))
+        close_tables(tables)
+
+    if args.format == 'parquet':
+        columnar.write_repos(data, outfile)
+    else:
+        with open(outfile, 'w') as fp:
+            json.dump(data, fp)
+    write_report(args.metrics)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,276 @@
+"""Sharded on-disk store for GitHub Archive data.
+
+Each hourly archive is kept as its own shard, partitioned into one
+directory per day:
+
+    root/2016-06-22/2016-06-22-00.json.gz
+    root/2016-06-22/2016-06-22-01.json.gz
+    ...
+    root/index.json
+
+The index records the size, event count and checksum of every shard, and
+which processing stages have already consumed it, so later stages can work
+on shards in parallel, skip ones they've seen and only corrupt shards need
+fetching again.
+
+A checksum only shows a shard hasn't changed since it was indexed, not that
+what was downloaded was any good. verify reads every shard in full, checking
+its gzip stream ends properly and every line is JSON, and records the
+result as the shard's health in the index."""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+import zlib
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime
+
+from .download import file_name
+from .json_backend import get_loads
+
+SUFFIX = '.json.gz'
+INDEX_NAME = 'index.json'
+
+CHUNK_SIZE = 1024 * 1024
+# Decode gzip, not zlib or raw deflate, streams
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def shard_key(url):
+    """Shard key for an archive URL or file name, e.g. 2016-06-22-00"""
+    name = file_name(url)
+    if name.endswith(SUFFIX):
+        name = name[:-len(SUFFIX)]
+    return name
+
+
+def shard_stats(path):
+    """Size, event count and sha256 of the shard at path. Event count is
+    None if the shard isn't a readable gzip stream."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(1024 * 1024), b''):
+            digest.update(chunk)
+    try:
+        with gzip.open(path, 'rb') as fp:
+            events = sum(1 for line in fp if line.strip())
+    except (OSError, EOFError, zlib.error) as e:
+        logging.error('Could not read shard %s: %s', path, e)
+        events = None
+    return {'bytes': os.path.getsize(path),
+            'events': events,
+            'sha256': digest.hexdigest()}
+
+
+def gzip_blocks(fp, digest=None, chunk_size=CHUNK_SIZE):
+    """Yield the decompressed contents of the gzip file fp in blocks,
+    updating digest with the compressed bytes as they're read. Raises
+    EOFError if the last member is cut short and zlib.error if the data
+    isn't gzip, including anything left over after the last member."""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    in_member = False
+    for chunk in iter(lambda: fp.read(chunk_size), b''):
+        if digest is not None:
+            digest.update(chunk)
+        # A chunk can hold the end of one member and the start of the next
+        while chunk:
+            in_member = True
+            yield decompressor.decompress(chunk)
+            if decompressor.eof:
+                chunk = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                in_member = False
+            else:
+                chunk = b''
+    if in_member:
+        raise EOFError('Compressed file ended before the end of the stream')
+
+
+def verify_shard(path, backend='auto', max_bad_lines=0):
+    """Health of the shard at path: whether its gzip stream is complete
+    and its lines are JSON objects. ok is True if the stream is readable
+    to the end with no more than max_bad_lines bad lines."""
+    loads = get_loads(backend)
+    health = {'bytes': 0, 'uncompressed_bytes': 0, 'events': 0,
+              'bad_lines': 0, 'error': None}
+    digest = hashlib.sha256()
+    start = time.time()
+
+    def check(line):
+        if not line.strip():
+            return
+        try:
+            good = isinstance(loads(line), dict)
+        except ValueError:
+            good = False
+        health['events' if good else 'bad_lines'] += 1
+
+    try:
+        with open(path, 'rb') as fp:
+            tail = b''
+            for block in gzip_blocks(fp, digest):
+                health['uncompressed_bytes'] += len(block)
+                lines = (tail + block).split(b'\n')
+                tail = lines.pop()
+                for line in lines:
+                    check(line)
+            check(tail)
+        if health['uncompressed_bytes'] == 0:
+            health['error'] = 'Empty shard'
+    except (OSError, EOFError, zlib.error) as e:
+        health['error'] = '{}: {}'.format(type(e).__name__, e)
+    if os.path.exists(path):
+        health['bytes'] = os.path.getsize(path)
+    health['sha256'] = digest.hexdigest()
+    health['seconds'] = time.time() - start
+    health['ok'] = (health['error'] is None and
+                    health['bad_lines'] <= max_bad_lines)
+    return health
+
+
+def _verify_path(args):
+    return verify_shard(*args)
+
+
+def verify_summary(healths, seconds):
+    """Counts and throughput for a verification pass that took seconds"""
+    size = sum(x['bytes'] for x in healths)
+    uncompressed = sum(x['uncompressed_bytes'] for x in healths)
+    seconds = max(seconds, 1e-9)
+    return {'shards': len(healths),
+            'damaged': sum(1 for x in healths if not x['ok']),
+            'bad_lines': sum(x['bad_lines'] for x in healths),
+            'events': sum(x['events'] for x in healths),
+            'bytes': size,
+            'uncompressed_bytes': uncompressed,
+            'seconds': seconds,
+            'mb_per_second': size / 1e6 / seconds,
+            'uncompressed_mb_per_second': uncompressed / 1e6 / seconds}
+
+
+class ShardStore(object):
+    """A directory of hourly shards and the index describing them"""
+
+    def __init__(self, root):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_NAME)
+        if not os.path.exists(root):
+            os.makedirs(root)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, 'r') as fp:
+                self.index = json.load(fp)
+
+    def path(self, key):
+        """Path of the shard for key, in its day's partition directory"""
+        return os.path.join(self.root, key[:10], key + SUFFIX)
+
+    def url_path(self, url):
+        """Path a downloaded URL should be written to"""
+        return self.path(shard_key(url))
+
+    def keys(self):
+        """Indexed shard keys in chronological order"""
+        return sorted(self.index)
+
+    def paths(self):
+        return [self.path(key) for key in self.keys()]
+
+    def add(self, keys, workers=4):
+        """Compute stats for the shards in keys and add them to the index.
+        Stats are computed in parallel; zlib releases the GIL."""
+        keys = list(keys)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            stats = list(pool.map(shard_stats, map(self.path, keys)))
+        for key, stat in zip(keys, stats):
+            # A new checksum means earlier processing no longer applies
+            previous = self.index.get(key, {})
+            if previous.get('sha256') == stat['sha256']:
+                stat['processed'] = previous.get('processed', {})
+            else:
+                stat['processed'] = {}
+            stat['indexed_at'] = datetime.utcnow().isoformat()
+            self.index[key] = stat
+        self.save()
+
+    def save(self):
+        """Atomically write the index to disk"""
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.index, fp, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.index_path)
+
+    def check(self, key):
+        """True if the shard on disk matches its index entry"""
+        entry = self.index.get(key)
+        path = self.path(key)
+        if not entry or entry.get('events') is None or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != entry['bytes']:
+            return False
+        return shard_stats(path)['sha256'] == entry['sha256']
+
+    def corrupted(self, workers=4):
+        """Keys of indexed shards that are missing, unreadable or no longer
+        match their checksum"""
+        keys = self.keys()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            ok = list(pool.map(self.check, keys))
+        return [key for key, good in zip(keys, ok) if not good]
+
+    def verify(self, keys=None, workers=4, backend='auto', max_bad_lines=0):
+        """Check the gzip stream and JSON lines of the indexed shards in
+        keys, all of them by default, in worker processes, recording each
+        one's health in the index. JSON decoding holds the GIL, so threads
+        wouldn't help. Returns a dict of key to health."""
+        keys = self.keys() if keys is None else list(keys)
+        jobs = [(self.path(key), backend, max_bad_lines) for key in keys]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            healths = list(pool.map(_verify_path, jobs))
+        verified_at = datetime.utcnow().isoformat()
+        for key, health in zip(keys, healths):
+            health['verified_at'] = verified_at
+            if key in self.index:
+                self.index[key]['health'] = health
+            if not health['ok']:
+                logging.error('Shard %s is damaged: %s, %s bad lines', key,
+                              health['error'], health['bad_lines'])
+        self.save()
+        return dict(zip(keys, healths))
+
+    def damaged(self):
+        """Keys of shards whose last verification failed"""
+        return [key for key in self.keys()
+                if not self.index[key].get('health', {}).get('ok', True)]
+
+    def remove(self, key):
+        """Delete a shard and its index entry, so it's downloaded again"""
+        if os.path.exists(self.path(key)):
+            os.remove(self.path(key))
+        self.index.pop(key, None)
+
+    def mark_processed(self, keys, stage):
+        """Record that stage has consumed the current version of keys"""
+        for key in keys:
+            entry = self.index[key]
+            entry.setdefault('processed', {})[stage] = entry['sha256']
+        self.save()
+
+    def pending(self, stage):
+        """Keys of shards stage hasn't consumed in their current version"""
+        return [key for key in self.keys()
+                if self.index[key].get('events') is not None and
+                self.index[key].get('processed', {}).get(stage) !=
+                self.index[key]['sha256']]
+
+
+def datafiles_for(path):
+    """Files to parse for path, which is either a single data file or a
+    shard store directory"""
+    if os.path.isdir(path):
+        return ShardStore(path).paths()
+    return [path]
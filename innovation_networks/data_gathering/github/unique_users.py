@@ -0,0 +1,134 @@
+"""Deduplicate the users parsed from the GitHub event stream.
+
+The same actor appears in millions of events, so users are kept in a dict
+keyed on login holding only their JSON encoded attributes. Memory then
+scales with the number of unique users rather than events. If a memory
+limit is set, the dict is spilled to hash partitioned JSON Lines files on
+disk whenever it grows past the limit, and each partition is deduplicated
+on its own when the users are read back."""
+
+import json
+import os
+import shutil
+import tempfile
+import zlib
+
+
+class UniqueUsers(object):
+    """Unique users by login.
+
+    By default the most recent non-empty attributes seen for a login are
+    kept. With merge=True attributes from every event are merged, later
+    values winning."""
+
+    def __init__(self, memory_limit=None, spill_dir=None, partitions=64,
+                 merge=False):
+        self.memory_limit = memory_limit
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+        self.merge = merge
+        self.users = {}
+        self.spilled = False
+        self._tmp_dir = None
+
+    def add(self, user):
+        """Add a user as produced by parse_users.parse_event, either a
+        {'user': login, 'attributes': {...}} dict or a bare login"""
+        if isinstance(user, dict):
+            login, attributes = user['user'], user.get('attributes') or {}
+        else:
+            login, attributes = user, {}
+        self._add(login, attributes)
+        if self.memory_limit and len(self.users) >= self.memory_limit:
+            self.spill()
+
+    def _add(self, login, attributes):
+        previous = self.users.get(login)
+        if previous is not None and not attributes:
+            # Sender only events carry no attributes, keep what we have
+            return
+        if previous is not None and self.merge:
+            merged = json.loads(previous)
+            merged.update(attributes)
+            attributes = merged
+        self.users[login] = json.dumps(attributes)
+
+    def update(self, users):
+        for user in users:
+            self.add(user)
+
+    def partition(self, login):
+        """Partition number for login, stable across processes"""
+        return zlib.crc32(login.encode('utf-8')) % self.partitions
+
+    def _partition_path(self, n):
+        if self._tmp_dir is None:
+            self._tmp_dir = tempfile.mkdtemp(prefix='unique_users_',
+                                             dir=self.spill_dir)
+        return os.path.join(self._tmp_dir, '{:04d}.jsonl'.format(n))
+
+    def spill(self):
+        """Append the users held in memory to their partition files"""
+        files = {}
+        try:
+            for login, attributes in self.users.items():
+                n = self.partition(login)
+                if n not in files:
+                    files[n] = open(self._partition_path(n), 'a')
+                files[n].write(json.dumps([login, attributes]) + '\n')
+        finally:
+            for fp in files.values():
+                fp.close()
+        self.users = {}
+        self.spilled = True
+
+    def __iter__(self):
+        """Yield (login, attributes) for every unique user"""
+        if not self.spilled:
+            for login, attributes in self.users.items():
+                yield login, json.loads(attributes)
+            return
+        self.spill()
+        for n in range(self.partitions):
+            path = self._partition_path(n)
+            if not os.path.exists(path):
+                continue
+            # Partitions are written in order, so replaying one gives the
+            # same result as if its users had never left memory
+            with open(path, 'r') as fp:
+                for line in fp:
+                    login, attributes = json.loads(line)
+                    self._add(login, json.loads(attributes))
+            for login, attributes in self.users.items():
+                yield login, json.loads(attributes)
+            self.users = {}
+
+    def __len__(self):
+        if self.spilled:
+            return sum(1 for _ in self)
+        return len(self.users)
+
+    def items(self):
+        """Users as parse_users dicts"""
+        for login, attributes in self:
+            yield {'user': login, 'attributes': attributes}
+
+    def write_jsonl(self, fp):
+        """Write one user per line to fp, returning the number written"""
+        n = 0
+        for user in self.items():
+            fp.write(json.dumps(user) + '\n')
+            n += 1
+        return n
+
+    def close(self):
+        """Remove any spilled partitions"""
+        if self._tmp_dir is not None:
+            shutil.rmtree(self._tmp_dir, ignore_errors=True)
+            self._tmp_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
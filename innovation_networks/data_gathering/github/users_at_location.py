@@ -1,9 +1,157 @@
-"""Search the parsed users data for users at a location"""
+"""Search the parsed users data for users at a location.
+
+With several processes, users are read in chunks and filtered by a pool
+of worker processes forked once the matcher or resolver is built. The
+workers inherit it copy-on-write rather than having it pickled with
+every chunk. Only the users' locations are sent, and only the positions
+of those kept (with their resolutions) come back. Results are merged in
+input order, so they're the same as filtering serially."""
 
 import argparse
-import json
 import logging
-import re
+import multiprocessing
+
+from array import array
+from collections import deque
+
+from .columnar import read_user_records, write_user_records
+from .events import parse_list
+from .interning import LOGINS, TYPECODE, add_strings_argument, close_tables
+from .interning import ids_path, open_tables, with_ids, write_ids
+from .locations import COUNTRY, GAZETTEER, PLACE, REGION, LocationResolver
+from .metrics import add_metrics_argument, write_report
+from .place_matcher import PlaceMatcher
+
+# Users sent to a worker at a time
+CHUNK_SIZE = 10000
+
+# What workers filter with, (filter function, matcher or resolver,
+# keyword arguments), set before the pool forks
+_WORKER_FILTER = None
+
+# Fields of a resolution kept with each user
+RESOLVED_FIELDS = ['resolution', 'name', 'country', 'region', 'latitude',
+                   'longitude']
+
+
+def location(user):
+    """The location from a parsed user's attributes, or None"""
+    attributes = user.get('attributes') if isinstance(user, dict) else None
+    return (attributes or {}).get('location')
+
+
+def with_location(users):
+    """Users that have a location"""
+    return (x for x in users if location(x))
+
+
+def at_places(users, matcher):
+    """Users whose location names one of matcher's places"""
+    return (x for x in users if matcher.places(location(x)))
+
+
+def not_excluded(users, matcher):
+    """Users whose location isn't an error name or excluded phrase"""
+    return (x for x in users if not matcher.excluded(location(x)))
+
+
+def filter_users(users, matcher):
+    """Lazily filter users to those at one of matcher's places. Each user
+    is checked as it arrives, so any number can be filtered in constant
+    memory, and each match is yielded exactly once."""
+    return not_excluded(at_places(with_location(users), matcher), matcher)
+
+
+def resolved(users, resolver):
+    """Users with the resolution of their location by resolver, a
+    LocationResolver, added as 'location_resolved'"""
+    for user in users:
+        value = resolver.resolve(location(user))
+        yield dict(user, location_resolved={x: value[x]
+                                            for x in RESOLVED_FIELDS})
+
+
+def in_countries(users, countries, resolutions=(PLACE,)):
+    """Resolved users whose location resolved to one of resolutions in
+    one of countries"""
+    return (x for x in users
+            if x['location_resolved']['resolution'] in resolutions and
+            x['location_resolved']['country'] in countries)
+
+
+def resolve_users(users, resolver, countries=('GB',), resolutions=(PLACE,)):
+    """Lazily resolve the locations of users, keeping those resolved to
+    one of resolutions in one of countries. Excluded and unresolved
+    locations are never kept."""
+    return in_countries(resolved(with_location(users), resolver), countries,
+                        resolutions)
+
+
+def chunks(users, size):
+    """Lists of up to size users"""
+    chunk = []
+    for user in users:
+        chunk.append(user)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def filter_chunk(locations):
+    """Filter the locations of a chunk of users in a worker. Returns the
+    positions of the users kept, with their location_resolved if any,
+    and, with a resolver, what it has resolved since the last chunk."""
+    func, selector, kwargs = _WORKER_FILTER
+    kept = [(i, user.get('location_resolved'))
+            for i, x in enumerate(locations)
+            for user in func([{'attributes': {'location': x}}], selector,
+                             **kwargs)]
+    if isinstance(selector, LocationResolver):
+        return kept, selector.drain()
+    return kept, None
+
+
+def filter_parallel(users, matcher=None, resolver=None, processes=None,
+                    chunk_size=CHUNK_SIZE, **kwargs):
+    """Filter users across processes as filter_users does with matcher,
+    or as resolve_users does with resolver, given its countries and
+    resolutions as kwargs. Yields the users kept in input order, exactly
+    as the serial filters would, so users are only deduplicated if the
+    input was. Only a few chunks are in flight at a time, so memory use
+    doesn't grow with the input. Workers are forked, so this needs a
+    platform with fork."""
+    global _WORKER_FILTER
+    if resolver is not None:
+        _WORKER_FILTER = (resolve_users, resolver.worker(), kwargs)
+    else:
+        _WORKER_FILTER = (filter_users, matcher, {})
+    processes = processes or multiprocessing.cpu_count()
+
+    def merge(chunk, result):
+        kept, drained = result.get()
+        if drained is not None:
+            resolver.remember(*drained)
+        for i, location_resolved in kept:
+            user = chunk[i]
+            if location_resolved is not None:
+                user = dict(user, location_resolved=location_resolved)
+            yield user
+
+    try:
+        with multiprocessing.get_context('fork').Pool(processes) as pool:
+            pending = deque()
+            for chunk in chunks(users, chunk_size):
+                locations = [location(x) for x in chunk]
+                pending.append((chunk, pool.apply_async(filter_chunk,
+                                                        (locations,))))
+                if len(pending) > 2 * processes:
+                    yield from merge(*pending.popleft())
+            while pending:
+                yield from merge(*pending.popleft())
+    finally:
+        _WORKER_FILTER = None
 
 
 def main():
@@ -19,7 +167,8 @@ def main():
     # place names filename
     parser.add_argument(dest='place_names',
                         action='store',
-                        help='file containing placenames, 1 per line')
+                        help=('file containing placenames, 1 per line. ' +
+                              'Not used with --resolve'))
 
     parser.add_argument(dest='error_names',
                         action='store',
@@ -28,47 +177,105 @@ def main():
     # input filename
     parser.add_argument(dest='datafile',
                         action='store',
-                        help='file containing github user data')
+                        help=('file containing github user data, as a ' +
+                              'JSON array, JSON Lines or Parquet'))
 
     # Output filename
     parser.add_argument(dest='outfile',
                         action='store',
-                        help='output filename for storing data')
+                        help=('output filename for storing data, written ' +
+                              'as JSON Lines if it ends in .jsonl and ' +
+                              'Parquet if it ends in .parquet'))
+
+    parser.add_argument('--resolve',
+                        action='store_true',
+                        help=('resolve locations against the gazetteer ' +
+                              'instead of matching place names, adding ' +
+                              'the place, region, country and coordinates ' +
+                              'to each user'))
+
+    parser.add_argument('--gazetteer',
+                        default=GAZETTEER,
+                        help='gazetteer to resolve locations against')
+
+    parser.add_argument('--countries',
+                        default='GB',
+                        help=('comma separated country codes of users to ' +
+                              'keep with --resolve'))
+
+    parser.add_argument('--resolutions',
+                        default=PLACE,
+                        help=('comma separated resolutions of users to keep ' +
+                              'with --resolve, of {}, {} and {}'.format(
+                                  PLACE, REGION, COUNTRY)))
+
+    parser.add_argument('--location-cache',
+                        default=None,
+                        help=('SQLite file to keep resolved locations in ' +
+                              'between runs'))
+
+    parser.add_argument('--processes',
+                        type=int,
+                        default=1,
+                        help='number of processes to filter users with')
+
+    parser.add_argument('--chunk-size',
+                        type=int,
+                        default=CHUNK_SIZE,
+                        help='users sent to a process at a time')
+
+    add_strings_argument(parser)
+    add_metrics_argument(parser)
 
     args = parser.parse_args()
 
-    # This can cause memory issues on low memory systems
-    # Either up the memory or amend to use a streaming JSON library
-    with open(args.datafile, 'r') as fp:
-        data = json.load(fp)
-
-    # List of towns and cities
-    with open(args.place_names, 'r') as fp:
-        towns_and_cities = fp.read().splitlines()
-
-    # Error names to remove from the final list
-    with open(args.error_names, 'r') as fp:
-        error_names = fp.read().splitlines()
-
-    # List of entries that have a 'location' key
-    data_locations = [x for x in data if 'location' in x['attributes']]
-
-    # Check against UK towns and cities
-    data_uk_locations = []
-    for x in data_locations:
-        words = x['attributes']['location'].lower().split()
-        for word in words:
-            if word in towns_and_cities:
-                data_uk_locations.append(x)
-
-    # Remove some errors due to similar placenames
-    # Mostly US places (New York matches York, Cambridge, MA matches Cambridge)
-    new_york = re.compile(r'new york')
-    final_locations = [x for x in data_uk_locations if not new_york.findall(x['attributes']['location'].lower())]
-    final_locations = [x for x in final_locations if x['attributes']['location'].lower() not in error_names]
-
-    with open(args.outfile, 'w') as fp:
-        json.dump(final_locations, fp)
+    users = read_user_records(args.datafile)
+    resolver = None
+    if args.resolve:
+        # Place names are told apart by the rest of the location, and
+        # error names still removed
+        resolver = LocationResolver.from_files(args.gazetteer,
+                                               args.error_names,
+                                               args.location_cache)
+        options = {'countries': parse_list(args.countries),
+                   'resolutions': parse_list(args.resolutions)}
+        if not options['countries'] or not options['resolutions']:
+            parser.error('--countries and --resolutions can\'t be empty')
+        unknown = set(options['resolutions']) - {PLACE, REGION, COUNTRY}
+        if unknown:
+            parser.error('Unknown resolutions {}'.format(
+                ', '.join(sorted(unknown))))
+        if args.processes > 1:
+            users = filter_parallel(users, resolver=resolver,
+                                    processes=args.processes,
+                                    chunk_size=args.chunk_size, **options)
+        else:
+            users = resolve_users(users, resolver, **options)
+    else:
+        # Towns and cities to match, and error names to remove from the
+        # final list
+        matcher = PlaceMatcher.from_files(args.place_names, args.error_names)
+
+        # Users are read, filtered and written one at a time. Some errors
+        # due to similar placenames are removed, mostly US places (New
+        # York matches York, Cambridge, MA matches Cambridge)
+        if args.processes > 1:
+            users = filter_parallel(users, matcher, processes=args.processes,
+                                    chunk_size=args.chunk_size)
+        else:
+            users = filter_users(users, matcher)
+    if args.strings:
+        tables = open_tables(args.strings)
+        ids = array(TYPECODE)
+        write_user_records(with_ids(users, tables[LOGINS], ids), args.outfile)
+        write_ids(ids, ids_path(args.outfile))
+        close_tables(tables)
+    else:
+        write_user_records(users, args.outfile)
+    if resolver is not None:
+        logging.info('Resolved locations: %s', resolver.summary())
+        resolver.close()
+    write_report(args.metrics)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,239 @@
+import time
+
+import pytest
+import requests
+
+from benchmarks.mock_github import MockGitHub
+from innovation_networks.data_gathering.github import api_client, crawl_state, get_user_details, http_cache
+
+
+class FakeClock(object):
+    """A clock that only moves when something sleeps"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limit_waits_for_reset():
+    """An empty bucket waits until the window resets"""
+    clock = FakeClock()
+    limit = api_client.RateLimit(clock=clock, sleep=clock.sleep)
+    limit.update({'X-RateLimit-Remaining': '2', 'X-RateLimit-Reset': '1010'})
+    assert limit.acquire() == 0
+    assert limit.acquire() == 0
+    assert limit.acquire() == 11
+    assert clock.slept == [11]
+
+
+def test_rate_limit_counts_in_flight():
+    """A stale header can't give back tokens already taken"""
+    limit = api_client.RateLimit()
+    limit.update({'X-RateLimit-Remaining': '10', 'X-RateLimit-Reset': '99'})
+    for _ in range(5):
+        limit.acquire()
+    limit.update({'X-RateLimit-Remaining': '9', 'X-RateLimit-Reset': '99'})
+    assert limit.remaining == 5
+
+
+def test_details_concurrent():
+    """Every user's repos are fetched, in order, through one client"""
+    users = {'user{}'.format(i): i % 4 for i in range(20)}
+    with MockGitHub(users, latency=0.01) as api:
+        client = api_client.GitHubClient(concurrency=5, base_url=api.url)
+        result = get_user_details.details(
+            [{'user': x} for x in users], 'repos', client=client)
+
+    assert list(result) == list(users)
+    assert [len(x) for x in result.values()] == list(users.values())
+    assert result['user1'] == [{'id': 0, 'login': {}, 'name': 'repo0'}]
+    assert len(api.requests) == 20
+
+
+def test_details_respects_rate_limit():
+    """The client waits out the window instead of hitting 403s"""
+    users = {'user{}'.format(i): 1 for i in range(12)}
+    with MockGitHub(users, limit=5, window=1) as api:
+        client = api_client.GitHubClient(concurrency=1, base_url=api.url)
+        start = time.time()
+        result = get_user_details.details(list(users), 'repos', client=client)
+
+    assert len(result) == 12
+    assert api.refused == 0
+    assert time.time() - start >= 1
+
+
+def test_pool_picks_most_budget():
+    """Requests go to the credential with the most remaining"""
+    pool = api_client.CredentialPool(['a', 'b', 'c'])
+    for limit, remaining in zip(pool.limits, [3, 10, 5]):
+        limit.update({'X-RateLimit-Remaining': str(remaining),
+                      'X-RateLimit-Reset': '99999999999'})
+    assert pool.acquire()[0] == 'b'
+    assert pool.limits[1].remaining == 9
+
+
+def test_pool_sleeps_when_all_exhausted():
+    """The pool only sleeps once every credential is used up, and then
+    only until the earliest reset"""
+    clock = FakeClock()
+    pool = api_client.CredentialPool(['a', 'b'], clock=clock,
+                                     sleep=clock.sleep)
+    pool.limits[0].update({'X-RateLimit-Remaining': '1',
+                           'X-RateLimit-Reset': '1100'})
+    pool.limits[1].update({'X-RateLimit-Remaining': '1',
+                           'X-RateLimit-Reset': '1020'})
+    assert sorted([pool.acquire()[0], pool.acquire()[0]]) == ['a', 'b']
+    assert clock.slept == []
+    assert pool.acquire()[0] == 'b'
+    assert clock.slept == [21]
+
+
+def test_client_spreads_tokens():
+    """With several tokens the crawl carries on past one token's limit"""
+    users = {'user{}'.format(i): 1 for i in range(9)}
+    with MockGitHub(users, limit=3) as api:
+        client = api_client.GitHubClient(concurrency=1, base_url=api.url,
+                                         credentials=['t1', 't2', 't3'])
+        start = time.time()
+        result = get_user_details.details(list(users), 'repos', client=client)
+
+    assert len(result) == 9
+    assert api.refused == 0
+    assert sorted(set(api.credentials)) == ['token t1', 'token t2', 'token t3']
+    assert time.time() - start < 1
+
+
+def test_get_pages():
+    """Every page is fetched, 100 items at a time"""
+    with MockGitHub({'prolific': 250}) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        repos = client.get_pages(api.url + '/users/prolific/repos')
+
+    assert [x['id'] for x in repos] == list(range(250))
+    assert len(api.requests) == 3
+    assert all('per_page=100' in x for x in api.requests)
+
+
+def test_get_pages_error():
+    """A failure on a later page raises rather than returning the pages
+    before it"""
+    failures = {'/users/prolific/repos?per_page=100&page=2': 1}
+    with MockGitHub({'prolific': 250}, failures=failures) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        with pytest.raises(requests.HTTPError):
+            client.get_pages(api.url + '/users/prolific/repos')
+
+
+class HTMLSession(object):
+    """A session whose every response is a 200 HTML page, as from a proxy"""
+
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'<html>Bad gateway</html>'
+        response.url = url
+        return response
+
+
+def test_get_pages_undecodable():
+    client = api_client.GitHubClient(session=HTMLSession())
+    with pytest.raises(requests.HTTPError):
+        client.get_pages(client.url('/users/a/repos'))
+
+
+def test_details_failures():
+    """Users whose details can't be fetched are left out, and the rest
+    are still fetched"""
+    users = {'a': 1, 'b': 150, 'c': 2}
+    failures = {'/users/b/repos?per_page=100&page=2': 1}
+    with MockGitHub(users, failures=failures) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        result = get_user_details.details(list(users) + ['missing'], 'repos',
+                                          client=client)
+
+    assert sorted(result) == ['a', 'c']
+    assert len(result['c']) == 2
+
+
+def test_conditional_requests(tmpdir):
+    """A rerun with a cache gets 304s, which cost no quota"""
+    users = {'a': 120, 'b': 3}
+    cache = http_cache.HTTPCache(str(tmpdir.join('cache.sqlite')))
+    with MockGitHub(users) as api:
+        client = api_client.GitHubClient(base_url=api.url, cache=cache)
+        first = get_user_details.details(list(users), 'repos', client=client)
+        before = client.credentials.limits[0].remaining
+
+        client = api_client.GitHubClient(base_url=api.url, cache=cache)
+        second = get_user_details.details(list(users), 'repos', client=client)
+
+    assert second == first
+    assert api.not_modified == 3
+    assert client.credentials.limits[0].remaining == before
+
+
+class EvictingCache(http_cache.HTTPCache):
+    """A cache that is emptied as soon as a request is made conditional"""
+
+    def conditional_headers(self, url):
+        headers = super(EvictingCache, self).conditional_headers(url)
+        self.evict(max_bytes=0)
+        return headers
+
+
+def test_conditional_request_evicted(tmpdir):
+    """A 304 for an entry evicted in the meantime is fetched again"""
+    cache = EvictingCache(str(tmpdir.join('cache.sqlite')))
+    with MockGitHub({'a': 3}) as api:
+        client = api_client.GitHubClient(base_url=api.url, cache=cache)
+        url = client.url('/users/a/repos')
+        first = client.get(url)
+        second = client.get(url)
+
+    assert api.not_modified == 1
+    assert second.status_code == 200
+    assert second.json() == first.json()
+    assert len(cache) == 1
+
+
+def test_details_resumes_from_state(tmpdir):
+    """Users recorded in the crawl state aren't fetched again"""
+    users = {'user{}'.format(i): 1 for i in range(6)}
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    state.record('repos', 'user0', [{'id': 9, 'login': {}, 'name': 'kept'}])
+    with MockGitHub(users) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        result = get_user_details.details(list(users), 'repos',
+                                          client=client, state=state)
+
+    assert len(api.requests) == 5
+    assert list(result) == list(users)
+    assert result['user0'] == [{'id': 9, 'login': {}, 'name': 'kept'}]
+    assert state.get('repos', 'user5') == result['user5']
+
+
+def test_details_failures_ledger(tmpdir):
+    """A user who fails is kept in the ledger, not recorded as having no
+    repos, and is fetched on the next run"""
+    users = {'alice': 1, 'bob': 2}
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    with MockGitHub(users, failures={'/users/bob/repos': 1}) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        result = get_user_details.details(list(users), 'repos',
+                                          client=client, state=state)
+        assert list(result) == ['alice']
+        assert state.pending('repos', list(users)) == ['bob']
+        assert state.fetched('repos_failed') == {'bob'}
+
+        result = get_user_details.details(list(users), 'repos',
+                                          client=client, state=state)
+    assert [len(x) for x in result.values()] == [1, 2]
+    assert state.fetched('repos_failed') == set()
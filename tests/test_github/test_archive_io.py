@@ -0,0 +1,59 @@
+import gzip
+import os
+import pytest
+
+from innovation_networks.data_gathering.github import archive_io
+
+
+@pytest.fixture
+def multi_member(tmpdir):
+    """A concatenation of gzipped hourly archives, and its lines"""
+    path = str(tmpdir.join('events.json.gz'))
+    lines = []
+    with open(path, 'wb') as fp:
+        for member in range(12):
+            member_lines = [('{"member": %d, "event": %d}\n' % (member, i)).encode()
+                            for i in range(member * 37 + 1)]
+            fp.write(gzip.compress(b''.join(member_lines)))
+            lines.extend(member_lines)
+    return path, lines
+
+
+def test_open_events_gzip(multi_member):
+    """All members are read without decompressing to disk"""
+    path, lines = multi_member
+    with archive_io.open_events(path) as fp:
+        assert list(fp) == lines
+
+
+def test_open_events_plain(tmpdir):
+    """Uncompressed files are read as they are, whatever their name"""
+    path = str(tmpdir.join('events.json.gz'))
+    with open(path, 'wb') as fp:
+        fp.write(b'{"a": 1}\n')
+    assert not archive_io.is_gzip(path)
+    with archive_io.open_events(path) as fp:
+        assert list(fp) == [b'{"a": 1}\n']
+
+
+def test_member_offsets(multi_member):
+    """Every member is found, even across chunk boundaries"""
+    path, _ = multi_member
+    offsets = archive_io.member_offsets(path, chunk_size=64)
+    assert len(offsets) == 12
+    with open(path, 'rb') as fp:
+        for offset in offsets:
+            fp.seek(offset)
+            assert fp.read(3) == archive_io.GZIP_MAGIC
+
+
+def test_read_members(multi_member):
+    """Member ranges together give every line exactly once"""
+    path, lines = multi_member
+    ranges = archive_io.member_ranges(path, 4)
+    assert len(ranges) > 1
+    assert ranges[0][0] == 0 and ranges[-1][1] == os.path.getsize(path)
+    read = []
+    for start, end in ranges:
+        read.extend(archive_io.read_members(path, start, end, chunk_size=100))
+    assert read == lines
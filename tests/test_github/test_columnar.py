@@ -0,0 +1,85 @@
+import datetime
+
+import pytest
+
+from innovation_networks.data_gathering.github import columnar, users_at_location
+from innovation_networks.data_gathering.github.place_matcher import PlaceMatcher
+
+pytest.importorskip('pyarrow')
+
+USERS = [{'user': 'a', 'attributes': {'login': 'a', 'location': 'London',
+                                      'name': 'A', 'company': ''}},
+         {'user': 'b', 'attributes': {'id': 7, 'login': 'b',
+                                      'url': 'https://api.github.com/users/b'}},
+         'sender_only',
+         {'user': 'c', 'attributes': {'location': 'Paris'}}]
+
+
+def test_users_round_trip(tmpdir):
+    """Users come back as parse_users wrote them, in both schemas"""
+    path = str(tmpdir.join('users.parquet'))
+    assert columnar.write_users(USERS, path, row_group_size=2) == 4
+    assert list(columnar.iter_users(path, batch_size=3)) == USERS
+
+
+def test_typed_columns(tmpdir):
+    """Attributes become typed columns, missing values null"""
+    path = str(tmpdir.join('users.parquet'))
+    columnar.write_users(USERS, path)
+    table = columnar.read_table(path, columns=['user', 'id', 'location'])
+    assert table.column_names == ['user', 'id', 'location']
+    assert str(table.schema.field('id').type) == 'int64'
+    assert table.column('id').to_pylist() == [None, 7, None, None]
+
+
+def test_row_groups_and_filters(tmpdir):
+    """Rows are written row_group_size at a time and filters skip rows"""
+    import pyarrow.parquet
+    path = str(tmpdir.join('users.parquet'))
+    users = [{'user': 'u{}'.format(i), 'attributes': {'id': i}}
+             for i in range(10)]
+    columnar.write_users(users, path, row_group_size=4)
+    assert pyarrow.parquet.ParquetFile(path).metadata.num_row_groups == 3
+    table = columnar.read_table(path, columns=['user'],
+                                filters=[('id', '>=', 8)])
+    assert table.column('user').to_pylist() == ['u8', 'u9']
+
+
+def test_repos(tmpdir):
+    """Repo details get a row each with REST's odd values coerced"""
+    path = str(tmpdir.join('repos.parquet'))
+    data = {'a': [{'id': 1, 'name': 'x', 'full_name': 'a/x',
+                   'owner': {'login': 'a'}, 'fork': False,
+                   'license': {'spdx_id': 'MIT'}, 'homepage': {},
+                   'created_at': '2014-02-01T09:00:00Z',
+                   'stargazers_count': 3}],
+            'b': []}
+    assert columnar.write_repos(data, path) == 1
+    row = columnar.read_table(path).to_pylist()[0]
+    assert row['user'] == 'a'
+    assert row['owner'] == 'a'
+    assert row['license'] == 'MIT'
+    assert row['homepage'] is None
+    assert row['fork'] is False
+    assert row['created_at'] == datetime.datetime(
+        2014, 2, 1, 9, tzinfo=datetime.timezone.utc)
+
+
+def test_user_repos(tmpdir):
+    path = str(tmpdir.join('user_repos.parquet'))
+    data = {'a': [{'id': 1, 'login': {}, 'name': 'x'},
+                  {'id': 2, 'login': {}, 'name': 'y'}], 'b': None}
+    assert columnar.write_user_repos(data, path) == 2
+    assert columnar.read_table(path).column('name').to_pylist() == ['x', 'y']
+
+
+def test_users_at_location_parquet(tmpdir):
+    """users_at_location reads and writes Parquet by file extension"""
+    datafile = str(tmpdir.join('users.parquet'))
+    outfile = str(tmpdir.join('uk_users.parquet'))
+    columnar.write_users(USERS, datafile)
+    users = columnar.read_user_records(datafile)
+    columnar.write_user_records(
+        users_at_location.filter_users(users, PlaceMatcher(['london'])),
+        outfile)
+    assert [x['user'] for x in columnar.iter_users(outfile)] == ['a']
@@ -0,0 +1,48 @@
+import pytest
+import sqlite3
+
+from innovation_networks.data_gathering.github import crawl_state
+
+
+class Clock(object):
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_record_survives_reopen(tmpdir):
+    """Results are on disk as soon as they're recorded"""
+    path = str(tmpdir.join('state.sqlite'))
+    state = crawl_state.CrawlState(path)
+    state.record('repos', 'james', [{'name': 'project'}])
+
+    reopened = crawl_state.CrawlState(path)
+    assert reopened.get('repos', 'james') == [{'name': 'project'}]
+    assert reopened.get('repos', 'nobody') is None
+    assert reopened.items('repos') == [('james', [{'name': 'project'}])]
+
+
+def test_context_closes(tmpdir):
+    """Used as a context manager the state is closed on leaving"""
+    path = str(tmpdir.join('state.sqlite'))
+    with crawl_state.CrawlState(path) as state:
+        state.record('repos', 'james', [])
+    with pytest.raises(sqlite3.ProgrammingError):
+        state.get('repos', 'james')
+
+
+def test_pending(tmpdir):
+    """Only unfetched or stale keys are pending, kinds are separate"""
+    clock = Clock()
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')),
+                                   clock=clock)
+    state.record('repos', 'old', [])
+    clock.now = 2000.0
+    state.record('repos', 'new', [])
+    state.record('repo', 'other/thing', {})
+
+    keys = ['old', 'new', 'other/thing', 'missing']
+    assert state.pending('repos', keys) == ['other/thing', 'missing']
+    assert state.pending('repos', keys, max_age=500) == [
+        'old', 'other/thing', 'missing']
@@ -0,0 +1,136 @@
+import gzip
+import json
+import os
+import pytest
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from innovation_networks.data_gathering.github import download
+
+
+def fake_archive(hour):
+    """A gzipped hourly archive holding a couple of events"""
+    events = [{'type': 'PushEvent', 'actor': {'login': 'user{}'.format(hour)}},
+              {'type': 'WatchEvent', 'actor': {'login': 'other'}}]
+    return gzip.compress(''.join(json.dumps(x) + '\n' for x in events).encode())
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    """Serves self.server.files, honouring simple Range requests, and 500s
+    for the paths in self.server.errors"""
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get('Range')))
+        if self.path in self.server.errors:
+            self.send_response(500)
+            self.end_headers()
+            return
+        body = self.server.files.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        status = 200
+        range_header = self.headers.get('Range')
+        if range_header:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.end_headers()
+                return
+            body = body[start:]
+            status = 206
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def archive_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), ArchiveHandler)
+    server.files = {'/2016-06-22-{}.json.gz'.format(h): fake_archive(h)
+                    for h in range(6)}
+    server.requests = []
+    server.errors = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_download_all(archive_server, tmpdir):
+    """Every URL is fetched to its own file and marked complete"""
+    url_list = [archive_server.url + p for p in sorted(archive_server.files)]
+    entries = download.download(url_list, str(tmpdir), workers=3)
+
+    assert [x['status'] for x in entries] == [download.COMPLETE] * 6
+    for url, entry in zip(url_list, entries):
+        with open(entry['path'], 'rb') as fp:
+            assert fp.read() == archive_server.files[url[len(archive_server.url):]]
+
+
+def test_download_skips_completed(archive_server, tmpdir):
+    """A rerun doesn't fetch anything the manifest records as complete"""
+    url_list = [archive_server.url + p for p in sorted(archive_server.files)]
+    download.download(url_list, str(tmpdir), workers=2)
+    archive_server.requests.clear()
+
+    download.download(url_list, str(tmpdir), workers=2)
+    assert archive_server.requests == []
+
+
+def test_download_resumes_partial(archive_server, tmpdir):
+    """A partial file is completed with a range request"""
+    path = '/2016-06-22-0.json.gz'
+    body = archive_server.files[path]
+    with open(os.path.join(str(tmpdir), 'manifest.jsonl'), 'w') as fp:
+        fp.write(json.dumps({'url': archive_server.url + path,
+                             'status': download.PARTIAL}) + '\n')
+    with open(os.path.join(str(tmpdir), '2016-06-22-0.json.gz.part'), 'wb') as fp:
+        fp.write(body[:10])
+
+    entries = download.download([archive_server.url + path], str(tmpdir))
+
+    assert archive_server.requests == [(path, 'bytes=10-')]
+    with open(entries[0]['path'], 'rb') as fp:
+        assert fp.read() == body
+
+
+def test_download_failure_recorded(archive_server, tmpdir):
+    """Files the server errors on are marked failed instead of written to
+    disk"""
+    url = archive_server.url + '/2016-06-22-22.json.gz'
+    archive_server.errors.add('/2016-06-22-22.json.gz')
+    entries = download.download([url], str(tmpdir), retries=0)
+
+    assert entries[0]['status'] == download.FAILED
+    assert not os.path.exists(entries[0]['path'])
+    manifest = download.Manifest(os.path.join(str(tmpdir), 'manifest.jsonl'))
+    assert manifest.status(url) == download.FAILED
+
+
+def test_download_missing_recorded(archive_server, tmpdir):
+    """A 404 is recorded as missing without retrying"""
+    url = archive_server.url + '/2016-06-22-23.json.gz'
+    entries = download.download([url], str(tmpdir), retries=3, backoff=60)
+
+    assert entries[0]['status'] == download.MISSING
+    assert len(archive_server.requests) == 1
+    assert not os.path.exists(entries[0]['path'])
+
+
+def test_manifest_ignores_torn_line(tmpdir):
+    """A line half written during a crash doesn't break loading"""
+    path = os.path.join(str(tmpdir), 'manifest.jsonl')
+    with open(path, 'w') as fp:
+        fp.write(json.dumps({'url': 'a', 'status': download.COMPLETE}) + '\n')
+        fp.write('{"url": "b", "sta')
+    manifest = download.Manifest(path)
+    assert manifest.completed('a')
+    assert manifest.status('b') is None
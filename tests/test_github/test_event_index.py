@@ -0,0 +1,129 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+from innovation_networks.data_gathering.github import event_index, interning
+from innovation_networks.data_gathering.github.event_index import EventIndex
+
+
+def event(i, login, repo, event_type='PushEvent'):
+    return {'id': str(i), 'type': event_type, 'actor': {'login': login},
+            'repo': {'name': repo}}
+
+
+# Two hours of events, the second in the pre 2015 schema
+HOURS = [[event(0, 'a', 'x/1'), event(1, 'b', 'x/1'),
+          event(2, 'a', 'y/2', 'WatchEvent'), event(3, 'c', 'z/3')],
+         [{'id': '4', 'type': 'PushEvent', 'actor': 'b',
+           'repository': {'name': '2', 'owner': 'y'}},
+          event(5, 'a', 'x/1', 'IssuesEvent')]]
+
+
+@pytest.fixture
+def datafiles(tmpdir):
+    paths = []
+    for i, events in enumerate(HOURS):
+        path = str(tmpdir.join('2016-01-01-{}.json.gz'.format(i)))
+        with gzip.open(path, 'wt') as fp:
+            for x in events:
+                fp.write(json.dumps(x) + '\n')
+        paths.append(path)
+    return paths
+
+
+def ids(events):
+    return [x['id'] for x in events]
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_lookup(datafiles, tmpdir, compress):
+    """Events by logins or on repos come back in order, once each"""
+    path = str(tmpdir.join('index'))
+    # Tiny blocks, so events are spread over several
+    meta = event_index.build_index(datafiles, path, block_size=100,
+                                   compress=compress)
+    assert meta['events'] == 6
+    assert meta['blocks'] > 2
+    with EventIndex(path) as index:
+        assert ids(index.events_of(['a'])) == ['0', '2', '5']
+        assert ids(index.events_of(['b'], ['x/1'])) == ['0', '1', '4', '5']
+        assert ids(index.events_of(repos=['y/2'])) == ['2', '4']
+        assert ids(index.events_of(['nobody'])) == []
+        assert index.count(interning.LOGINS, 'a') == 3
+        assert index.source(4) == ('2016-01-01-1', 0)
+        assert json.loads(index.line(3)) == HOURS[0][3]
+
+
+def test_types(datafiles, tmpdir):
+    """Only events of types are indexed"""
+    path = str(tmpdir.join('index'))
+    event_index.build_index(datafiles, path, types=['PushEvent'])
+    with EventIndex(path) as index:
+        assert len(index) == 4
+        assert ids(index.events_of(['a'])) == ['0']
+        assert index.source(3) == ('2016-01-01-1', 0)
+
+
+def test_blocks_read_once(datafiles, tmpdir):
+    """Events in the same block only decompress it once"""
+    path = str(tmpdir.join('index'))
+    event_index.build_index(datafiles, path)
+    with EventIndex(path) as index:
+        assert len(list(index.lines(['a', 'b', 'c']))) == 6
+        assert index.summary() == {'events': 6, 'blocks': 1, 'logins': 3,
+                                   'repos': 3, 'blocks_read': 1}
+
+
+def test_postings_scratch(tmpdir):
+    """Postings buffered to the scratch file are put in place in order"""
+    writer = event_index.PostingsWriter(str(tmpdir), 'logins', buffer_size=2)
+    pairs = [(2, 0), (0, 1), (2, 2), (1, 3), (0, 4), (2, 5)]
+    for i, n in pairs:
+        writer.add(i, n)
+    assert writer.finish(4) == 6
+    assert not os.path.exists(writer.scratch)
+    _, indptr = event_index.mapped(writer.file('indptr'))
+    _, postings = event_index.mapped(writer.file('postings'))
+    assert list(indptr) == [0, 2, 3, 6, 6]
+    assert list(postings) == [1, 4, 3, 0, 2, 5]
+
+
+def test_shared_tables(datafiles, tmpdir):
+    tables = interning.open_tables(str(tmpdir.join('strings')))
+    tables[interning.LOGINS].intern('z')
+    path = str(tmpdir.join('index'))
+    event_index.build_index(datafiles, path, tables=tables)
+    assert tables[interning.LOGINS].get('a') == 1
+    with EventIndex(path) as index:
+        assert ids(index.events_of(['a'])) == ['0', '2', '5']
+        assert ids(index.events_of(['z'])) == []
+
+
+def test_empty(tmpdir):
+    datafile = tmpdir.join('empty.jsonl')
+    datafile.write('')
+    path = str(tmpdir.join('index'))
+    event_index.build_index([str(datafile)], path)
+    with EventIndex(path) as index:
+        assert len(index) == 0
+        assert list(index.lines(['a'])) == []
+
+
+def test_main(datafiles, tmpdir, monkeypatch, capsys):
+    """The events of users_at_location's users are looked up"""
+    path = str(tmpdir.join('index'))
+    monkeypatch.setattr(sys, 'argv', ['event_index', 'build', datafiles[0],
+                                      path, '--types', 'PushEvent'])
+    event_index.main()
+    assert json.loads(capsys.readouterr().out)['events'] == 3
+
+    users = tmpdir.join('users.jsonl')
+    users.write(json.dumps({'user': 'a'}) + '\n' + json.dumps('c') + '\n')
+    outfile = tmpdir.join('events.jsonl')
+    monkeypatch.setattr(sys, 'argv', ['event_index', 'lookup', path,
+                                      str(outfile), '--users', str(users)])
+    event_index.main()
+    assert [json.loads(x)['id'] for x in outfile.readlines()] == ['0', '3']
@@ -0,0 +1,76 @@
+import json
+import sys
+
+from innovation_networks.data_gathering.github import events
+
+OLD = {'type': 'PushEvent', 'actor': 'alice',
+       'actor_attributes': {'login': 'alice'},
+       'repository': {'name': 'site', 'owner': 'bob'},
+       'created_at': '2014-06-14T12:05:27-07:00', 'payload': {'size': 2}}
+NEW = {'type': 'WatchEvent', 'actor': {'id': 1, 'login': 'carol'},
+       'repo': {'id': 9, 'name': 'bob/site'},
+       'created_at': '2016-06-14T12:05:27Z', 'payload': {}}
+# Mentions PushEvent without being one
+DECOY = {'type': 'IssueCommentEvent', 'actor': {'login': 'dave'},
+         'payload': {'ref': 'PushEvent'}}
+
+
+def lines(*items):
+    return [(json.dumps(x) + '\n').encode() for x in items]
+
+
+def test_derived_fields():
+    """login and repo read the same from both schemas"""
+    assert events.event_login(OLD) == 'alice'
+    assert events.event_login(NEW) == 'carol'
+    assert events.event_login({'sender': {'login': 'erin'}}) == 'erin'
+    assert events.event_repo(OLD) == 'bob/site'
+    assert events.event_repo(NEW) == 'bob/site'
+    assert events.event_repo({}) is None
+
+
+def test_filter_types():
+    """Only wanted types are decoded, and decoys are caught after"""
+    event_filter = events.EventFilter(['PushEvent'])
+    result = list(event_filter(lines(OLD, NEW, DECOY, NEW)))
+    assert result == [OLD]
+    assert event_filter.summary() == {'lines': 4, 'skipped': 2,
+                                      'decoded': 2, 'matched': 1}
+
+
+def test_filter_text_lines():
+    """Text lines are screened as well as bytes"""
+    event_filter = events.EventFilter(['WatchEvent'])
+    text = [x.decode() for x in lines(OLD, NEW)]
+    assert list(event_filter(text)) == [NEW]
+
+
+def test_projection():
+    """Fields are dotted paths or derived, missing ones None"""
+    event_filter = events.EventFilter(
+        fields=['type', 'login', 'repo', 'payload.size', 'payload.x.y'])
+    assert list(event_filter(lines(OLD, NEW))) == [
+        {'type': 'PushEvent', 'login': 'alice', 'repo': 'bob/site',
+         'payload.size': 2, 'payload.x.y': None},
+        {'type': 'WatchEvent', 'login': 'carol', 'repo': 'bob/site',
+         'payload.size': None, 'payload.x.y': None}]
+
+
+def test_bad_lines_are_skipped():
+    event_filter = events.EventFilter()
+    assert list(event_filter([b'{"not": json\n'] + lines(NEW))) == [NEW]
+
+
+def test_main(tmpdir, monkeypatch, capsys):
+    datafile = tmpdir.join('events.json')
+    datafile.write_binary(b''.join(lines(OLD, NEW, DECOY)))
+    outfile = tmpdir.join('events.jsonl')
+    monkeypatch.setattr(sys, 'argv', ['events', str(datafile), str(outfile),
+                                      '--types', 'PushEvent,WatchEvent',
+                                      '--fields', 'login,repo',
+                                      '--json-backend', 'json'])
+    events.main()
+    assert [json.loads(x) for x in outfile.readlines()] == [
+        {'login': 'alice', 'repo': 'bob/site'},
+        {'login': 'carol', 'repo': 'bob/site'}]
+    assert json.loads(capsys.readouterr().out)['matched'] == 2
@@ -1,10 +1,14 @@
+import gzip
 import json
 import logging
 import os
+import pytest
+import requests
 import responses
 
 from datetime import datetime, timedelta
 from innovation_networks.data_gathering.github import get_data
+from innovation_networks.data_gathering.github.shards import ShardStore, shard_key
 
 
 def test_make_url():
@@ -60,3 +64,89 @@ def test_write_data():
         d = json.load(fp)
     assert d == json.loads('{"test": "test data"}')
     os.remove('.temp')
+
+
+@responses.activate
+def test_write_data_status(tmpdir):
+    """Error responses aren't written and are left to fetch again"""
+    responses.add(responses.GET, 'http://test.com/a', body=b'a')
+    responses.add(responses.GET, 'http://test.com/b', body='Not Found',
+                  status=404)
+    url_list = ['http://test.com/a', 'http://test.com/b']
+    path = str(tmpdir.join('out'))
+    with open(path, 'wb') as fp:
+        with pytest.raises(requests.HTTPError):
+            get_data.write_data(fp, url_list)
+    with open(path, 'rb') as fp:
+        assert fp.read() == b'a'
+    assert url_list == ['http://test.com/b']
+
+
+def test_make_url_defaults():
+    """Defaults are yesterday at the current hour when called"""
+    yesterday = datetime.now() - timedelta(1)
+    assert get_data.make_url() == ("http://data.githubarchive.org/" +
+                                   "{}-{:02d}.json.gz".format(
+                                       yesterday.strftime("%Y-%m-%d"),
+                                       datetime.now().hour))
+
+
+def test_hours():
+    """Every hour in the range, from the start of the first"""
+    x = list(get_data.hours(datetime(2016, 6, 6, 22, 30),
+                            datetime(2016, 6, 7, 1)))
+    assert x == [datetime(2016, 6, 6, 22), datetime(2016, 6, 6, 23),
+                 datetime(2016, 6, 7, 0)]
+    urls = get_data.hourly_urls(datetime(2016, 6, 6), datetime(2016, 6, 7))
+    assert len(urls) == 24
+    assert urls[-1] == "http://data.githubarchive.org/2016-06-06-23.json.gz"
+
+
+def test_parse_hour():
+    assert get_data.parse_hour('2016-06-06-08') == datetime(2016, 6, 6, 8)
+    assert get_data.parse_hour('2016-06-06') == datetime(2016, 6, 6)
+
+
+def test_sync_range():
+    end = datetime(2016, 6, 8)
+    assert get_data.sync_range(end=end, days=2) == (datetime(2016, 6, 6), end)
+    start, end = get_data.sync_range()
+    assert end.minute == 0 and end <= datetime.now()
+    assert end - start == timedelta(731)
+
+
+def test_missing_urls(tmpdir):
+    """Only hours without a shard on disk are fetched"""
+    store = ShardStore(str(tmpdir))
+    urls = get_data.hourly_urls(datetime(2016, 6, 6), datetime(2016, 6, 6, 3))
+    for url in urls[:2]:
+        path = store.url_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(b'')
+        store.index[shard_key(url)] = {}
+    # Indexed but deleted since
+    os.remove(store.url_path(urls[1]))
+    assert get_data.missing_urls(store, urls) == urls[1:]
+
+
+def test_sync_reindexes(tmpdir, monkeypatch):
+    """A shard that is downloaded again has its stats replaced"""
+    store = ShardStore(str(tmpdir))
+    url = get_data.hourly_urls(datetime(2016, 6, 6), datetime(2016, 6, 6, 1))[0]
+    key = shard_key(url)
+    # Indexed with one event, then lost
+    store.index[key] = {'bytes': 1, 'events': 1, 'sha256': 'old',
+                        'processed': {'events': True}}
+
+    def download(urls, root, manifest_path, workers, path_for):
+        for x in urls:
+            os.makedirs(os.path.dirname(path_for(x)), exist_ok=True)
+            with gzip.open(path_for(x), 'wb') as fp:
+                fp.write(b'{}\n{}\n')
+        return [{'url': x, 'status': 'complete'} for x in urls]
+
+    monkeypatch.setattr(get_data, 'download', download)
+    get_data.sync(store, [url], workers=1)
+    assert store.index[key]['events'] == 2
+    assert store.index[key]['processed'] == {}
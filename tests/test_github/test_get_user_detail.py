@@ -133,3 +133,27 @@ def test_rate_limit_ok_not_authd():
     resp = get_user_details.rate_limit_ok()
 
     assert resp == True
+
+
+def test_credentials(monkeypatch):
+    """Tokens and the username and password pair are all used"""
+    monkeypatch.setenv('GH_TOKENS', 'abc, def')
+    monkeypatch.setenv('GH_USERN', 'user')
+    monkeypatch.setenv('GH_PASSW', 'passw')
+    assert get_user_details.credentials() == ['abc', 'def', ('user', 'passw')]
+
+
+def test_credentials_tokens_only(monkeypatch):
+    """Tokens alone are enough"""
+    monkeypatch.setenv('GH_TOKENS', 'abc')
+    monkeypatch.delenv('GH_USERN', raising=False)
+    monkeypatch.delenv('GH_PASSW', raising=False)
+    assert get_user_details.credentials() == ['abc']
+
+
+def test_credentials_none(monkeypatch):
+    """No credentials at all is an error"""
+    monkeypatch.delenv('GH_TOKENS', raising=False)
+    monkeypatch.delenv('GH_USERN', raising=False)
+    with pytest.raises(KeyError):
+        get_user_details.credentials()
@@ -0,0 +1,145 @@
+import json
+import os
+import time
+
+import requests
+
+from innovation_networks.data_gathering.github import api_client, crawl_state, get_user_details, graphql, repo_details
+
+RECORDED = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                        'test_graphql_responses.json')
+
+
+def recorded(name, status=200, remaining='4990'):
+    """A response built from the recorded GraphQL response called name"""
+    with open(RECORDED, 'r') as fp:
+        body = json.load(fp)[name]
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(body).encode()
+    response.headers['X-RateLimit-Remaining'] = remaining
+    response.headers['X-RateLimit-Reset'] = str(int(time.time()) + 3600)
+    return response
+
+
+class ReplaySession(object):
+    """Answers each request with the next of responses, keeping what was
+    sent"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.sent = []
+
+    def request(self, method, url, **kwargs):
+        self.sent.append((method, url, kwargs))
+        return self.responses.pop(0)
+
+
+def test_query_cost():
+    """Costs follow GitHub's rules: requests over 100, at least 1"""
+    assert graphql.query_cost(0) == 1
+    assert graphql.query_cost(300) == 3
+    assert graphql.user_repos_cost(50) == 1
+    assert graphql.user_repos_cost(100) == 1
+    # Each nested connection is a request for every repo
+    fields = ['name', 'languages(first: 10) { nodes { name } }']
+    assert graphql.user_repos_cost(50, fields=fields) == 50
+    assert graphql.repos_cost(100) == 1
+    assert graphql.repos_cost(100, fields=fields) == 1
+
+
+def test_user_repos_query():
+    """Each login gets an alias and its own variables"""
+    query, variables = graphql.user_repos_query(['alice', 'bob'],
+                                                cursors={'bob': 'abc'})
+    assert query.startswith('query($l0: String!, $c0: String, ' +
+                            '$l1: String!, $c1: String)')
+    assert 'rateLimit { cost remaining resetAt }' in query
+    assert 'u0: user(login: $l0)' in query
+    assert 'u1: user(login: $l1)' in query
+    assert 'nodes { id: databaseId name }' in query
+    assert variables == {'l0': 'alice', 'c0': None, 'l1': 'bob', 'c1': 'abc'}
+
+
+def test_repos_query():
+    """Repos are aliased in order with the fields selected"""
+    query, variables = graphql.repos_query([('alice', 'dotfiles')],
+                                           fields=['name'])
+    assert 'r0: repository(owner: $o0, name: $n0) { name }' in query
+    assert variables == {'o0': 'alice', 'n0': 'dotfiles'}
+
+
+def test_fetch_user_repos():
+    """Users with more repos are paged through, missing users have none"""
+    session = ReplaySession(recorded('user_repos_page1'),
+                            recorded('user_repos_page2'))
+    client = api_client.GitHubClient(session=session, credentials=['t1'])
+    metrics = graphql.QueryMetrics()
+    result = graphql.fetch_user_repos(client, ['alice', 'ghost-user-0', 'bob'],
+                                      metrics=metrics)
+
+    assert result == [('alice', [{'id': 101, 'name': 'dotfiles'},
+                                 {'id': 102, 'name': 'thesis'},
+                                 {'id': 103, 'name': 'website'}]),
+                      ('ghost-user-0', []),
+                      ('bob', [])]
+    method, url, kwargs = session.sent[1]
+    assert (method, url) == ('POST', 'https://api.github.com/graphql')
+    # Only alice is asked for again, from where her first page ended
+    assert kwargs['json']['variables'] == {'l0': 'alice', 'c0': 'Y3Vyc29yOjI='}
+    assert kwargs['headers']['Authorization'] == 'token t1'
+    assert metrics.summary()['queries'] == 2
+    assert metrics.summary()['points_used'] == 2
+    assert metrics.summary()['points_remaining'] == 4998
+
+
+def test_failed_query_is_left_out():
+    """Users in a query that errored aren't reported as having no repos"""
+    session = ReplaySession(recorded('error', status=502))
+    client = api_client.GitHubClient(session=session)
+    assert graphql.fetch_user_repos(client, ['alice']) == []
+
+
+def test_query_takes_points():
+    """A query takes its estimated cost from the rate limit"""
+    session = ReplaySession(recorded('repos', remaining='6'),
+                            recorded('repos', remaining='6'))
+    client = api_client.GitHubClient(session=session)
+    graphql.run_query(client, '', {}, cost=1)
+    limit = client.credentials.limits[0]
+    assert limit.wait_time(cost=6) == 0
+    assert limit.wait_time(cost=7) > 0
+    # The header hasn't caught up with the points just taken
+    graphql.run_query(client, '', {}, cost=4)
+    assert limit.remaining == 2
+
+
+def test_details_graphql(tmpdir):
+    """The GraphQL backend gives the same shape as REST and is recorded"""
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    session = ReplaySession(recorded('user_repos_page1'),
+                            recorded('user_repos_page2'))
+    client = api_client.GitHubClient(session=session)
+    data = [{'user': 'alice'}, {'user': 'ghost-user-0'}, {'user': 'bob'}]
+    result = get_user_details.details(data, 'repos', client=client,
+                                      state=state, backend='graphql')
+
+    assert result['alice'][2] == {'id': 103, 'login': {}, 'name': 'website'}
+    assert result['ghost-user-0'] == []
+    assert state.get('repos', 'bob') == []
+
+
+def test_repo_crawl_graphql(tmpdir):
+    """Repos are looked up in one query and missing ones go in the ledger"""
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    session = ReplaySession(recorded('repos'))
+    client = api_client.GitHubClient(session=session)
+    data = {'alice': [{'name': 'dotfiles'}, {'name': 'deleted'}]}
+    result = repo_details.repo_crawl(data, client=client, state=state,
+                                     backend='graphql')
+
+    assert len(session.sent) == 1
+    assert len(result['alice']) == 1
+    assert result['alice'][0]['full_name'] == 'alice/dotfiles'
+    assert result['alice'][0]['language'] == 'Shell'
+    assert state.fetched('repo_failed') == {'alice/deleted'}
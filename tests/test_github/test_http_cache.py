@@ -0,0 +1,68 @@
+import requests
+
+from innovation_networks.data_gathering.github import http_cache
+
+
+class Clock(object):
+    now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_response(url, body, headers):
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = body
+    response.headers.update(headers)
+    return response
+
+
+def test_put_and_revalidate(tmpdir):
+    """Validators are stored and sent back as conditional headers"""
+    cache = http_cache.HTTPCache(str(tmpdir.join('cache.sqlite')))
+    cache.put(make_response('http://a', b'[1]', {'ETag': '"x"',
+                                                 'Link': '<http://a?page=2>; rel="next"'}))
+    assert cache.conditional_headers('http://a') == {'If-None-Match': '"x"'}
+
+    not_modified = make_response('http://a', b'', {'X-RateLimit-Remaining': '9'})
+    not_modified.status_code = 304
+    response = cache.response(not_modified)
+    assert response.json() == [1]
+    assert response.links['next']['url'] == 'http://a?page=2'
+    assert response.headers['X-RateLimit-Remaining'] == '9'
+
+
+def test_no_validator_not_cached(tmpdir):
+    """Responses without an ETag or Last-Modified can't be revalidated"""
+    cache = http_cache.HTTPCache(str(tmpdir.join('cache.sqlite')))
+    cache.put(make_response('http://a', b'[1]', {}))
+    assert len(cache) == 0
+    assert cache.conditional_headers('http://a') == {}
+
+
+def test_evict(tmpdir):
+    """Old entries go first, then the oldest until under the size limit"""
+    clock = Clock()
+    cache = http_cache.HTTPCache(str(tmpdir.join('cache.sqlite')), clock=clock)
+    for i in range(5):
+        clock.now = 1000.0 + i * 100
+        cache.put(make_response('http://{}'.format(i), b'x' * 10,
+                                {'Last-Modified': 'today'}))
+    assert cache.size() == 50
+
+    assert cache.evict(max_age=250) == 2
+    assert cache.evict(max_bytes=15) == 2
+    assert cache.get('http://4') is not None
+    assert len(cache) == 1
+
+
+def test_response_evicted(tmpdir):
+    """A 304 for an evicted entry can't be answered from the cache"""
+    cache = http_cache.HTTPCache(str(tmpdir.join('cache.sqlite')))
+    cache.put(make_response('http://a', b'[1]', {'ETag': '"x"'}))
+    cache.evict(max_bytes=0)
+    not_modified = make_response('http://a', b'', {})
+    not_modified.status_code = 304
+    assert cache.response(not_modified) is None
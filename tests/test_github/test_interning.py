@@ -0,0 +1,109 @@
+import json
+import sys
+
+from innovation_networks.data_gathering.github import interning, users_at_location
+
+
+def test_string_table():
+    table = interning.StringTable(['a', 'b'])
+    assert table.intern('b') == 1
+    assert table.intern('c') == 2
+    assert table[2] == 'c'
+    assert 'c' in table
+    assert list(table.intern_all(['c', 'a', 'd'])) == [2, 0, 3]
+    assert table.lookup([3, 1]) == ['d', 'b']
+
+
+def test_persistent_ids(tmpdir):
+    """Ids are kept across runs and new strings are appended"""
+    path = str(tmpdir.join('logins.txt'))
+    with interning.StringTable(['alice', 'bob'], path=path):
+        pass
+    with interning.StringTable(path=path) as table:
+        assert table.get('bob') == 1
+        assert table.intern('carol') == 2
+    assert interning.StringTable.load(path).strings == ['alice', 'bob',
+                                                        'carol']
+
+
+def test_torn_write(tmpdir):
+    """A string whose write was interrupted is dropped"""
+    path = tmpdir.join('logins.txt')
+    path.write('alice\nbob\ncar')
+    with interning.StringTable(path=str(path)) as table:
+        assert len(table) == 2
+        assert table.intern('carol') == 2
+    assert path.read() == 'alice\nbob\ncarol\n'
+    path.write('dave\n', mode='a')
+    path.write('ev', mode='a')
+    assert interning.StringTable.load(str(path)).strings[-1] == 'dave'
+    assert path.read().endswith('ev')
+
+
+def test_shared_file(tmpdir):
+    """Tables appending to the same file, as from several processes, read
+    each other's strings before adding their own"""
+    path = str(tmpdir.join('logins.txt'))
+    with interning.StringTable(path=path) as first, \
+            interning.StringTable(path=path) as second:
+        assert first.intern('alice') == 0
+        assert second.intern('bob') == 1
+        assert second.intern('alice') == 0
+        assert list(first.intern_all(['bob', 'carol'])) == [1, 2]
+        assert second.intern('carol') == 2
+    assert interning.StringTable.load(path).strings == ['alice', 'bob',
+                                                        'carol']
+
+
+def test_with_ids():
+    logins = interning.StringTable(['b'])
+    ids = []
+    users = list(interning.with_ids([{'user': 'a', 'attributes': {}}, 'b'],
+                                    logins, ids))
+    assert users == [{'user': 'a', 'attributes': {}, 'user_id': 1},
+                     {'user': 'b', 'user_id': 0}]
+    assert ids == [1, 0]
+
+
+def test_repo_pairs(tmpdir):
+    """Repos round trip through arrays of id pairs"""
+    tables = interning.open_tables(str(tmpdir.join('strings')))
+    data = {'a': [{'name': 'x'}, {'name': 'y'}], 'b': [{'name': 'x'}],
+            'c': None}
+    pairs = interning.intern_repos(data, tables)
+    assert data['b'][0]['repo_id'] == 2
+    path = str(tmpdir.join('repos.ids'))
+    interning.write_ids(pairs, path)
+    assert interning.read_pairs(path) == [(0, 0), (0, 1), (1, 2)]
+    assert interning.repos_from_pairs(interning.read_pairs(path), tables) == {
+        'a': [{'name': 'x'}, {'name': 'y'}], 'b': [{'name': 'x'}]}
+    interning.close_tables(tables)
+
+
+def test_users_at_location_ids(tmpdir, monkeypatch):
+    """Matched users are written with their ids, and the ids alongside"""
+    place_names = tmpdir.join('places.txt')
+    place_names.write('london\n')
+    error_names = tmpdir.join('errors.txt')
+    error_names.write('')
+    datafile = tmpdir.join('users.jsonl')
+    datafile.write(''.join(json.dumps(x) + '\n' for x in [
+        {'user': 'a', 'attributes': {'location': 'Paris'}},
+        {'user': 'b', 'attributes': {'location': 'London'}},
+        {'user': 'c', 'attributes': {'location': 'London'}}]))
+    strings = str(tmpdir.join('strings'))
+    interning.close_tables(interning.open_tables(strings))
+    tmpdir.join('strings', 'logins.txt').write('c\n')
+    monkeypatch.setattr(sys, 'argv', [
+        'users_at_location', str(place_names), str(error_names),
+        str(datafile), str(tmpdir.join('uk_users.jsonl')),
+        '--strings', strings])
+    users_at_location.main()
+
+    users = [json.loads(x) for x in tmpdir.join('uk_users.jsonl').readlines()]
+    assert [x['user_id'] for x in users] == [1, 0]
+    # One id per row, in the rows' order
+    ids = interning.read_ids(str(tmpdir.join('uk_users.ids')))
+    assert list(ids) == [1, 0]
+    assert interning.StringTable.load(strings + '/logins.txt').lookup(ids) == [
+        'b', 'c']
@@ -0,0 +1,40 @@
+import io
+import json
+import pytest
+
+from innovation_networks.data_gathering.github import json_stream
+
+RECORDS = [{'user': 'user{}'.format(i), 'attributes': {'n': i, 's': 'a, ] b'}}
+           for i in range(50)]
+
+
+def test_iter_array():
+    """Records are read from an array split across many small chunks"""
+    fp = io.StringIO('  \n' + json.dumps(RECORDS, indent=2))
+    assert list(json_stream.iter_records(fp, chunk_size=7)) == RECORDS
+
+
+def test_iter_empty_array():
+    assert list(json_stream.iter_records(io.StringIO('[ ]'))) == []
+
+
+def test_iter_unterminated_array():
+    with pytest.raises(ValueError):
+        list(json_stream.iter_records(io.StringIO('[{"a": 1}, '), chunk_size=4))
+
+
+def test_iter_lines():
+    """Records are read from JSON Lines, skipping blank lines"""
+    fp = io.StringIO('\n'.join(json.dumps(x) for x in RECORDS) + '\n\n')
+    assert list(json_stream.iter_records(fp)) == RECORDS
+
+
+def test_write_records():
+    """Output format follows the file extension"""
+    fp = io.StringIO()
+    assert json_stream.write_records(iter(RECORDS), fp, 'out.json') == 50
+    assert json.loads(fp.getvalue()) == RECORDS
+
+    fp = io.StringIO()
+    json_stream.write_records(iter(RECORDS), fp, 'out.jsonl')
+    assert [json.loads(x) for x in fp.getvalue().splitlines()] == RECORDS
@@ -0,0 +1,181 @@
+import json
+import sys
+
+import pytest
+
+from innovation_networks.data_gathering.github import locations, users_at_location
+from innovation_networks.data_gathering.github.locations import Gazetteer, LocationCache, LocationResolver
+from innovation_networks.data_gathering.github.place_matcher import read_names
+
+PLACE_NAMES = 'innovation_networks/data/towns_and_cities_2015.txt'
+ERROR_NAMES = 'innovation_networks/data/error_names.txt'
+
+
+@pytest.fixture(scope='module')
+def gazetteer():
+    return Gazetteer.load()
+
+
+def test_normalise():
+    assert locations.normalise('St. Albans, U.K.') == 'st albans uk'
+    assert locations.normalise('  Zürich / Genève ') == 'zurich geneve'
+    assert locations.normalise(None) == ''
+
+
+def test_every_town_resolves(gazetteer):
+    """Every town in the place names resolves to itself in Great Britain,
+    and the countries among them to the country"""
+    resolver = LocationResolver(gazetteer)
+    for name in read_names(PLACE_NAMES):
+        value = resolver.resolve(name.title())
+        assert value['country'] == 'GB', name
+        if value['resolution'] == locations.PLACE:
+            assert value['latitude'] is not None, name
+        else:
+            assert value['resolution'] == locations.COUNTRY, name
+
+
+@pytest.mark.parametrize('location,resolution,country,region,name', [
+    ('London, UK', 'place', 'GB', 'London', 'london'),
+    ('London, Ontario', 'place', 'CA', 'Ontario', 'london'),
+    ('London ON Canada', 'place', 'CA', 'Ontario', 'london'),
+    ('Cambridge, MA', 'place', 'US', 'Massachusetts', 'cambridge'),
+    ('Cambridge, England', 'place', 'GB', 'East of England', 'cambridge'),
+    ('New York, NY', 'place', 'US', 'New York', 'new york'),
+    ('Halifax, Nova Scotia', 'place', 'CA', 'Nova Scotia', 'halifax'),
+    ('Gloucester Point, VA', 'region', 'US', 'Virginia', None),
+    ('Scotland', 'country', 'GB', 'Scotland', None),
+    ('Ontario', 'region', 'CA', 'Ontario', None),
+    ('The Moon', 'unresolved', None, None, None)])
+def test_resolve(gazetteer, location, resolution, country, region, name):
+    """Place names in several countries are told apart by the rest of
+    the location"""
+    value = LocationResolver(gazetteer).resolve(location)
+    assert (value['resolution'], value['country'], value['region'],
+            value['name']) == (resolution, country, region, name)
+    assert value['location'] == location
+
+
+def test_error_names_excluded(gazetteer):
+    """Error names are excluded, and the rest not in Great Britain"""
+    resolver = LocationResolver(gazetteer, read_names(ERROR_NAMES))
+    for name in read_names(ERROR_NAMES):
+        value = resolver.resolve(name)
+        assert value['resolution'] == locations.EXCLUDED
+        assert value['country'] is None
+    assert LocationResolver(gazetteer).resolve(
+        'cambridge ma')['country'] == 'US'
+
+
+def test_memo(gazetteer):
+    """Locations that normalise the same are resolved once"""
+    resolver = LocationResolver(gazetteer)
+    for location in ['Leeds', 'leeds', 'LEEDS.', 'Leeds, UK']:
+        resolver.resolve(location)
+    assert resolver.summary() == {'locations': 2, 'hits': 2, 'misses': 2}
+
+
+def test_cache(gazetteer, tmpdir):
+    """Resolutions are kept between resolvers, until the gazetteer or
+    error names change"""
+    path = str(tmpdir.join('locations.sqlite'))
+    with LocationResolver(gazetteer, cache=LocationCache(path)) as resolver:
+        first = resolver.resolve('Bristol')
+    resolver = LocationResolver(gazetteer, cache=LocationCache(path))
+    assert resolver.resolve('Bristol') == first
+    assert resolver.summary()['hits'] == 1
+    resolver.close()
+
+    resolver = LocationResolver(gazetteer, ['bristol'], LocationCache(path))
+    assert resolver.resolve('Bristol')['resolution'] == locations.EXCLUDED
+    assert resolver.summary()['misses'] == 1
+    resolver.close()
+
+
+USERS = [{'user': 'a', 'attributes': {'location': 'London, UK'}},
+         {'user': 'b', 'attributes': {'location': 'London, Ontario'}},
+         {'user': 'c', 'attributes': {'location': 'Cambridge MA'}},
+         {'user': 'd', 'attributes': {'location': 'Wales'}},
+         {'user': 'e', 'attributes': {}},
+         'sender_only',
+         {'user': 'f', 'attributes': {'location': 'Milton Keynes'}}]
+
+
+def test_resolve_users(gazetteer):
+    """Users resolved to a place in the countries wanted are kept"""
+    resolver = LocationResolver(gazetteer)
+    users = list(users_at_location.resolve_users(iter(USERS), resolver))
+    assert [x['user'] for x in users] == ['a', 'f']
+    assert users[1]['location_resolved'] == {
+        'resolution': 'place', 'name': 'milton keynes', 'country': 'GB',
+        'region': 'South East', 'latitude': pytest.approx(52.04, abs=0.1),
+        'longitude': pytest.approx(-0.76, abs=0.1)}
+
+    users = users_at_location.resolve_users(
+        iter(USERS), resolver, ['GB', 'CA'], ['place', 'country'])
+    assert [x['user'] for x in users] == ['a', 'b', 'd', 'f']
+
+
+def test_main_resolve(tmpdir, monkeypatch):
+    datafile = tmpdir.join('users.jsonl')
+    datafile.write(''.join(json.dumps(x) + '\n' for x in USERS))
+    outfile = tmpdir.join('uk_users.json')
+    cache = tmpdir.join('locations.sqlite')
+    monkeypatch.setattr(sys, 'argv', [
+        'users_at_location', PLACE_NAMES, ERROR_NAMES, str(datafile),
+        str(outfile), '--resolve', '--location-cache', str(cache)])
+    users_at_location.main()
+    users = json.loads(outfile.read())
+    assert [x['user'] for x in users] == ['a', 'f']
+    assert users[0]['location_resolved']['region'] == 'London'
+    assert len(LocationCache(str(cache))) == 5
+
+
+def test_main_resolve_lists(tmpdir, monkeypatch):
+    """Countries and resolutions may have spaces after the commas"""
+    datafile = tmpdir.join('users.jsonl')
+    datafile.write(''.join(json.dumps(x) + '\n' for x in USERS))
+    outfile = tmpdir.join('users_out.json')
+    argv = ['users_at_location', PLACE_NAMES, ERROR_NAMES, str(datafile),
+            str(outfile), '--resolve', '--countries', 'GB, CA',
+            '--resolutions', 'place, country']
+    monkeypatch.setattr(sys, 'argv', argv)
+    users_at_location.main()
+    # London, Ontario is in the error names
+    assert [x['user'] for x in json.loads(outfile.read())] == ['a', 'd', 'f']
+
+    monkeypatch.setattr(sys, 'argv', argv[:-1] + ['town'])
+    with pytest.raises(SystemExit):
+        users_at_location.main()
+
+
+def test_resolved_columns(tmpdir):
+    """Resolved locations survive a round trip through Parquet"""
+    pytest.importorskip('pyarrow')
+    from innovation_networks.data_gathering.github import columnar
+    users = list(users_at_location.resolved(
+        [USERS[0], USERS[2]], LocationResolver()))
+    path = str(tmpdir.join('users.parquet'))
+    columnar.write_users(users, path)
+    assert list(columnar.iter_users(path)) == users
+    table = columnar.read_table(path, columns=['country', 'latitude'],
+                                filters=[('country', '=', 'GB')])
+    assert str(table.schema.field('latitude').type) == 'double'
+    assert table.num_rows == 1
+
+
+def test_resolve_parallel(gazetteer, tmpdir):
+    """Workers' resolutions are remembered and cached by the parent"""
+    path = str(tmpdir.join('locations.sqlite'))
+    resolver = LocationResolver(gazetteer, cache=LocationCache(path))
+    resolver.resolve('London, UK')
+    users = list(users_at_location.filter_parallel(
+        iter(USERS * 2), resolver=resolver, processes=2, chunk_size=3,
+        countries=['GB', 'CA']))
+    assert [x['user'] for x in users] == ['a', 'b', 'f'] * 2
+    assert users == list(users_at_location.resolve_users(
+        iter(USERS * 2), LocationResolver(gazetteer), ['GB', 'CA']))
+    assert len(resolver.memo) == 5
+    assert resolver.summary()['hits'] + resolver.summary()['misses'] == 11
+    resolver.close()
+    assert len(LocationCache(path)) == 5
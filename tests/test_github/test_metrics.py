@@ -0,0 +1,80 @@
+import json
+import os
+
+from innovation_networks.data_gathering.github import events, metrics, pipeline
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_counters_and_timers():
+    """Timers add up wall and CPU time, counters get rates"""
+    clock, cpu_clock = FakeClock(), FakeClock()
+    registry = metrics.Metrics(clock=clock, cpu_clock=cpu_clock)
+    registry.inc('download_bytes', 100)
+    registry.inc('download_bytes', 50)
+    for _ in range(2):
+        with registry.timer('stage_users'):
+            clock.now += 2
+            cpu_clock.now += 1
+    report = registry.report()
+
+    assert report['counters'] == {'download_bytes': 150}
+    assert report['rates'] == {'download_bytes': 37.5}
+    assert report['timers'] == {'stage_users': {'count': 2, 'seconds': 4.0,
+                                                'cpu_seconds': 2.0}}
+    assert report['peak_rss_bytes'] > 1024 * 1024
+
+
+def test_write(tmpdir):
+    """Reports are written as JSON or Prometheus text"""
+    registry = metrics.Metrics()
+    registry.inc('api_requests', 3)
+    registry.add_time('stage_users', 1.5, 1.0)
+
+    path = str(tmpdir.join('metrics.json'))
+    registry.write(path)
+    with open(path, 'r') as fp:
+        assert json.load(fp)['counters'] == {'api_requests': 3}
+
+    path = str(tmpdir.join('metrics.prom'))
+    registry.write(path)
+    with open(path, 'r') as fp:
+        lines = fp.read().splitlines()
+    assert '# TYPE github_api_requests_total counter' in lines
+    assert 'github_api_requests_total 3' in lines
+    assert 'github_timer_seconds_total{name="stage_users"} 1.5' in lines
+    assert any(x.startswith('github_peak_rss_bytes ') for x in lines)
+
+
+def test_event_filter_reports():
+    """Event counts reach the shared metrics once decoding stops"""
+    before = metrics.METRICS.get('event_matched')
+    event_filter = events.EventFilter(['PushEvent'])
+    lines = ['{"type": "PushEvent"}', '{"type": "WatchEvent"}']
+    assert len(list(event_filter.decode(lines))) == 1
+    assert metrics.METRICS.get('event_matched') == before + 1
+    # Counts aren't added twice
+    event_filter.report()
+    assert metrics.METRICS.get('event_matched') == before + 1
+
+
+def test_profiled_stage(tmpdir):
+    """Stages are timed and can be profiled"""
+    def write(inputs, output):
+        with open(output, 'w') as fp:
+            fp.write('x')
+    stages = pipeline.Pipeline(str(tmpdir.join('work')),
+                               [pipeline.Stage('x', write)])
+    stages.run(profile_dir=str(tmpdir.join('profiles')))
+
+    assert os.path.exists(str(tmpdir.join('profiles', 'x.prof')))
+    record = stages.state['stages']['x']
+    assert record['cpu_seconds'] >= 0
+    assert record['peak_rss_bytes'] > 0
+    assert metrics.METRICS.timers['stage_x']['count'] >= 1
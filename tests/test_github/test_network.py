@@ -0,0 +1,82 @@
+import gzip
+import json
+import sys
+
+from innovation_networks.data_gathering.github import interning, network
+
+EVENTS = [{'login': 'a', 'repo': 'x/1'},
+          {'login': 'a', 'repo': 'x/1'},
+          {'login': 'b', 'repo': 'x/1'},
+          {'login': 'b', 'repo': 'y/2'},
+          {'login': 'c', 'repo': 'y/2'},
+          {'login': 'c', 'repo': 'y/2'},
+          {'login': 'c', 'repo': 'y/2'},
+          {'login': 'd', 'repo': None},
+          {'login': 'a', 'repo': 'z/3'}]
+
+
+def test_edge_counter_merges_runs():
+    """Counts are summed across flushed runs"""
+    counter = network.EdgeCounter(buffer_size=2, max_runs=3)
+    for source, target in [(0, 1), (0, 2), (0, 1), (5, 0), (0, 1), (0, 2)]:
+        counter.add(source, target)
+    keys, weights = counter.finish()
+    assert [(k >> 32, k & network.ID_MASK) for k in keys] == [(0, 1), (0, 2),
+                                                             (5, 0)]
+    assert list(weights) == [3, 2, 1]
+
+
+def test_build():
+    """Both graphs are built from events, weighted by counts"""
+    graph = network.CollaborationGraph.build(EVENTS, buffer_size=2)
+    assert graph.repos_of('a') == [('x/1', 2), ('z/3', 1)]
+    assert graph.repos_of('c') == [('y/2', 3)]
+    # a and b share x/1, b and c share y/2, each weighted by the smaller
+    # count
+    assert graph.collaborators('b') == [('a', 1), ('c', 1)]
+    assert sorted(graph.edges()) == [('a', 'b', 1), ('b', 'c', 1)]
+    assert graph.summary() == {'users': 3, 'repos': 3, 'user_repo_edges': 5,
+                               'user_user_edges': 2}
+
+
+def test_max_degree():
+    """Repos with too many users don't link them"""
+    events = [{'login': 'u{}'.format(i), 'repo': 'big/repo'}
+              for i in range(5)]
+    graph = network.CollaborationGraph.build(events, max_degree=4)
+    assert list(graph.edges()) == []
+    assert len(graph.bipartite) == 5
+
+
+def test_shared_tables():
+    """Ids come from the tables given, so other stages agree on them"""
+    tables = {interning.LOGINS: interning.StringTable(['z', 'b']),
+              interning.REPOS: interning.StringTable()}
+    graph = network.CollaborationGraph.build(EVENTS, tables=tables)
+    assert tables[interning.LOGINS].get('a') == 2
+    assert graph.collaborators('b') == [('a', 1), ('c', 1)]
+
+
+def test_save_load(tmpdir):
+    graph = network.CollaborationGraph.build(EVENTS)
+    path = str(tmpdir.join('graph'))
+    graph.save(path)
+    loaded = network.CollaborationGraph.load(path)
+    assert loaded.summary() == graph.summary()
+    assert list(loaded.edges()) == list(graph.edges())
+    assert loaded.repos_of('a') == graph.repos_of('a')
+
+
+def test_main(tmpdir, monkeypatch, capsys):
+    """Events of the network types are read from the archive"""
+    datafile = str(tmpdir.join('events.json.gz'))
+    with gzip.open(datafile, 'wt') as fp:
+        for login, event_type in [('a', 'PushEvent'), ('b', 'ForkEvent'),
+                                  ('c', 'IssuesEvent')]:
+            fp.write(json.dumps({'type': event_type,
+                                 'actor': {'login': login},
+                                 'repo': {'name': 'x/1'}}) + '\n')
+    monkeypatch.setattr(sys, 'argv', ['network', datafile,
+                                      str(tmpdir.join('graph'))])
+    network.main()
+    assert json.loads(capsys.readouterr().out)['user_user_edges'] == 1
@@ -1,9 +1,12 @@
+import gzip
 import json
 import logging
+import pytest
 import sys
 
 from datetime import datetime
-from innovation_networks.data_gathering.github import parse_users
+from innovation_networks.data_gathering.github import json_backend, parse_users
+from innovation_networks.data_gathering.github.metrics import METRICS
 
 
 def test_filename():
@@ -19,3 +22,143 @@ def test_make_user_list():
     test_json = json.loads(json_str)
     returned_json = parse_users.make_user_list('tests/test_github/test_user_data.json')
     assert test_json == returned_json
+
+
+def write_events(path, n):
+    """Write n events alternating between the old and new schemas, with
+    the odd bad line"""
+    with open(path, 'w') as fp:
+        for i in range(n):
+            if i % 3 == 0:
+                event = {'actor': 'user{}'.format(i),
+                         'actor_attributes': {'login': 'user{}'.format(i)}}
+            elif i % 3 == 1:
+                event = {'actor': {'login': 'user{}'.format(i), 'id': i}}
+            else:
+                event = {'sender': {'login': 'user{}'.format(i)}}
+            fp.write(json.dumps(event) + '\n')
+            if i % 50 == 0:
+                fp.write('{"not": json\n')
+
+
+def test_make_user_list_parallel(tmpdir):
+    """Parallel parsing returns the same users in the same order"""
+    path = str(tmpdir.join('events.json'))
+    write_events(path, 500)
+    serial = parse_users.make_user_list(path)
+    parallel = parse_users.make_user_list_parallel([path], processes=2,
+                                                   backend='json')
+    assert len(serial) == 500
+    assert parallel == serial
+
+
+def test_make_user_list_gzip_shards(tmpdir):
+    """Each gzipped shard is parsed as its own task"""
+    path = str(tmpdir.join('events.json'))
+    write_events(path, 30)
+    with open(path, 'rb') as fp:
+        lines = fp.readlines()
+    paths = []
+    for i in range(3):
+        paths.append(str(tmpdir.join('{}.json.gz'.format(i))))
+        with gzip.open(paths[-1], 'wb') as fp:
+            fp.writelines(lines[i * 11:(i + 1) * 11])
+    tasks = parse_users.make_tasks(paths, 2, 'json')
+    assert [x[1:3] for x in tasks] == [(None, None)] * 3
+    assert (parse_users.make_user_list_parallel(paths, processes=2) ==
+            parse_users.make_user_list(path))
+
+
+def test_byte_ranges_cover_every_line(tmpdir):
+    """Every line is read by exactly one range"""
+    path = str(tmpdir.join('events.json'))
+    write_events(path, 100)
+    lines = []
+    with open(path, 'rb') as fp:
+        for start, end in parse_users.byte_ranges(path, 7):
+            lines.extend(parse_users.read_range(fp, start, end))
+    with open(path, 'rb') as fp:
+        assert lines == fp.readlines()
+
+
+def test_json_backend():
+    """Backends decode bytes and unknown backends are refused"""
+    assert json_backend.get_loads('json')(b'{"a": 1}') == {'a': 1}
+    with pytest.raises(ValueError):
+        json_backend.get_loads('simdjson')
+
+
+def test_make_unique_users(tmpdir):
+    """Serial and parallel deduplication find the same users"""
+    path = str(tmpdir.join('events.json'))
+    write_events(path, 60)
+    with open(path) as fp:
+        lines = fp.readlines()
+    with open(path, 'a') as fp:
+        fp.writelines(lines)
+
+    serial = parse_users.make_unique_users([path], backend='json')
+    parallel = parse_users.make_unique_users([path], processes=2,
+                                             memory_limit=10,
+                                             spill_dir=str(tmpdir))
+    assert len(serial) == 60
+    assert dict(parallel) == dict(serial)
+
+
+def test_progress_counts_events(tmpdir):
+    """Workers' events are counted, not the users they send back"""
+    path = str(tmpdir.join('events.json'))
+    write_events(path, 60)
+    with open(path) as fp:
+        lines = fp.readlines()
+    with open(path, 'a') as fp:
+        fp.writelines(lines)
+
+    METRICS.reset()
+    parse_users.make_unique_users([path], processes=2)
+    # Every line, the bad ones too
+    assert METRICS.get('events_parsed') == 2 * len(lines)
+
+
+def test_make_user_list_multi_member(tmpdir):
+    """A concatenated gzip file is split between workers by member"""
+    path = str(tmpdir.join('events.json'))
+    write_events(path, 90)
+    with open(path, 'rb') as fp:
+        lines = fp.readlines()
+    gz_path = str(tmpdir.join('events.json.gz'))
+    with open(gz_path, 'wb') as fp:
+        for i in range(0, len(lines), 10):
+            fp.write(gzip.compress(b''.join(lines[i:i + 10])))
+
+    assert len(parse_users.make_tasks([gz_path], 3, 'json')) > 1
+    assert (parse_users.make_user_list_parallel([gz_path], processes=3) ==
+            parse_users.make_user_list(path))
+
+
+def test_parse_types(tmpdir):
+    """Users can be taken from some event types only"""
+    path = str(tmpdir.join('events.json'))
+    with open(path, 'w') as fp:
+        for i, event_type in enumerate(['PushEvent', 'WatchEvent'] * 5):
+            fp.write(json.dumps({'type': event_type,
+                                 'actor': {'login': 'user{}'.format(i)}}) +
+                     '\n')
+    pushers = ['user{}'.format(i) for i in range(0, 10, 2)]
+    users = parse_users.make_user_list(path, types=['PushEvent'])
+    assert [x['user'] for x in users] == pushers
+    users = parse_users.make_user_list_parallel([path], processes=2,
+                                                backend='json',
+                                                types=['PushEvent'])
+    assert [x['user'] for x in users] == pushers
+
+
+def test_main_empty_shard_directory(tmpdir, monkeypatch, capsys):
+    """An empty shard directory is reported rather than an IndexError"""
+    monkeypatch.chdir(str(tmpdir))
+    monkeypatch.setattr(sys, 'argv', ['parse_users',
+                                      str(tmpdir.mkdir('shards')),
+                                      str(tmpdir.join('out'))])
+    with pytest.raises(SystemExit):
+        parse_users.main()
+    assert 'No data files' in capsys.readouterr().err
@@ -0,0 +1,162 @@
+import json
+import os
+
+import pytest
+
+from innovation_networks.data_gathering.github import interning, pipeline
+
+USERS = [{'user': 'a', 'attributes': {'location': 'London, UK'}},
+         {'user': 'b', 'attributes': {'location': 'New York'}},
+         {'user': 'c', 'attributes': {'location': 'Milton Keynes'}}]
+
+
+class Calls(object):
+    """Stage functions that count their calls"""
+
+    def __init__(self):
+        self.calls = []
+
+    def copy(self, name):
+        def func(inputs, output, suffix=''):
+            self.calls.append(name)
+            with open(output, 'w') as fp:
+                for path in inputs:
+                    with open(path, 'r') as in_fp:
+                        fp.write(in_fp.read())
+                fp.write(suffix)
+        return func
+
+
+def make_pipeline(work_dir, source, calls, suffix=''):
+    return pipeline.Pipeline(work_dir, [
+        pipeline.Stage('b', calls.copy('b'), ['a'], 'b.txt'),
+        pipeline.Stage('a', calls.copy('a'), [source], 'a.txt',
+                       {'suffix': suffix}),
+        pipeline.Stage('c', calls.copy('c'), ['a', 'b'], 'c.txt')])
+
+
+def test_order():
+    """Stages come after the stages they need"""
+    calls = Calls()
+    stages = make_pipeline('/tmp/unused', 'source', calls)
+    assert stages.order() == ['a', 'b', 'c']
+    assert stages.order(['b']) == ['a', 'b']
+    loop = pipeline.Pipeline('/tmp/unused', [
+        pipeline.Stage('x', calls.copy('x'), ['y']),
+        pipeline.Stage('y', calls.copy('y'), ['x'])])
+    with pytest.raises(ValueError):
+        loop.order()
+
+
+def test_run_caches(tmpdir):
+    """Stages only run again when their inputs or parameters change"""
+    source = tmpdir.join('source.txt')
+    source.write('one')
+    work_dir = str(tmpdir.join('work'))
+    calls = Calls()
+    assert make_pipeline(work_dir, str(source), calls).run() == {
+        'a': 'ran', 'b': 'ran', 'c': 'ran'}
+    with open(os.path.join(work_dir, 'c.txt'), 'r') as fp:
+        assert fp.read() == 'oneone'
+
+    # Nothing changed, in a new process
+    assert set(make_pipeline(work_dir, str(source), calls).run().values()) == \
+        {'cached'}
+    assert calls.calls == ['a', 'b', 'c']
+
+    # New parameters
+    results = make_pipeline(work_dir, str(source), calls, suffix='!').run()
+    assert results == {'a': 'ran', 'b': 'ran', 'c': 'ran'}
+
+    # A changed input
+    source.write('two')
+    results = make_pipeline(work_dir, str(source), calls, suffix='!').run(['b'])
+    assert results == {'a': 'ran', 'b': 'ran'}
+
+    # A missing output, and a forced stage whose output is the same
+    os.remove(os.path.join(work_dir, 'c.txt'))
+    results = make_pipeline(work_dir, str(source), calls, suffix='!').run(
+        force=['a'])
+    assert results == {'a': 'ran', 'b': 'cached', 'c': 'ran'}
+
+
+def test_failed_stage_runs_again(tmpdir):
+    """A stage isn't recorded unless it finishes"""
+    def fail(inputs, output):
+        raise RuntimeError('failed')
+    stages = pipeline.Pipeline(str(tmpdir), [pipeline.Stage('x', fail)])
+    with pytest.raises(RuntimeError):
+        stages.run()
+    assert 'x' not in stages.state['stages']
+
+
+def test_archive_stage_missing(tmpdir, monkeypatch):
+    """Hours missing from the archive don't fail the stage, other failed
+    downloads do"""
+    statuses = [pipeline.COMPLETE, pipeline.MISSING]
+    monkeypatch.setattr(pipeline, 'sync', lambda store, urls, workers: [
+        {'url': url, 'status': status} for url, status in zip(urls, statuses)])
+    pipeline.archive_stage([], str(tmpdir), '2016-01-01-0', '2016-01-01-2')
+    statuses[1] = 'failed'
+    with pytest.raises(RuntimeError):
+        pipeline.archive_stage([], str(tmpdir), '2016-01-01-0',
+                               '2016-01-01-2')
+
+
+def test_location_stage_strings(tmpdir):
+    """With string tables the users' ids are written alongside, in order"""
+    users = tmpdir.join('users.jsonl')
+    users.write(''.join(json.dumps(x) + '\n' for x in USERS))
+    places = tmpdir.join('places.txt')
+    places.write('milton keynes\nlondon\n')
+    errors = tmpdir.join('errors.txt')
+    errors.write('')
+    outfile = str(tmpdir.join('located.jsonl'))
+    strings = str(tmpdir.join('strings'))
+    pipeline.location_stage([str(users), str(places), str(errors)], outfile,
+                            strings=strings)
+    ids = interning.read_ids(str(tmpdir.join('located.ids')))
+    logins = interning.StringTable.load(strings + '/logins.txt')
+    assert logins.lookup(ids) == ['a', 'c']
+
+
+def test_location_stages(tmpdir):
+    """Users stream from one stage's file to the next"""
+    users = tmpdir.join('users.jsonl')
+    users.write(''.join(json.dumps(x) + '\n' for x in USERS))
+    places = tmpdir.join('places.txt')
+    places.write('london\nyork\nmilton keynes\n')
+    errors = tmpdir.join('errors.txt')
+    errors.write('new york\n')
+    outfile = str(tmpdir.join('located.jsonl'))
+    pipeline.location_stage([str(users), str(places), str(errors)], outfile)
+    with open(outfile, 'r') as fp:
+        assert [json.loads(x)['user'] for x in fp] == ['a', 'c']
+
+
+def test_github_stages():
+    """The archive range is fixed when the pipeline is built"""
+    stages = pipeline.Pipeline('/tmp/unused', pipeline.github_stages(
+        archive='/tmp/archive', days=2))
+    assert stages.order(['repo_details']) == ['archive', 'users',
+                                              'users_at_location',
+                                              'user_repos', 'repo_details']
+    assert stages.path('archive') == '/tmp/archive'
+    # The event index is rebuilt from scratch, so only runs when asked for
+    assert 'event_index' not in stages.order()
+    assert stages.order(['event_index']) == ['archive', 'event_index']
+    params = stages.stages['archive'].params
+    assert len(pipeline.hourly_urls(pipeline.parse_hour(params['start']),
+                                    pipeline.parse_hour(params['end']))) == 48
+
+
+def test_github_stages_options():
+    """Options only change the keys of the stages they're given to"""
+    plain = dict((x.name, x.params) for x in pipeline.github_stages(days=2))
+    stages = dict((x.name, x.params) for x in pipeline.github_stages(
+        days=2, workers=4, concurrency=32, strings='/tmp/strings'))
+    assert plain['user_repos'] == {'backend': 'rest', 'batch_size': 50}
+    assert stages['archive']['workers'] == 4
+    assert stages['user_repos']['concurrency'] == 32
+    assert stages['network']['strings'] == '/tmp/strings'
+    assert 'concurrency' not in stages['network']
@@ -0,0 +1,43 @@
+import pytest
+
+from innovation_networks.data_gathering.github import place_matcher
+
+
+@pytest.fixture
+def matcher():
+    return place_matcher.PlaceMatcher.from_files(
+        'innovation_networks/data/towns_and_cities_2015.txt',
+        'innovation_networks/data/error_names.txt')
+
+
+def test_tokenize():
+    """Punctuation is dropped but hyphenated names are kept whole"""
+    assert (place_matcher.tokenize('Stoke-on-Trent, UK') ==
+            ['stoke-on-trent', 'uk'])
+
+
+def test_single_word(matcher):
+    """Single word places match with punctuation around them"""
+    assert matcher.places('London, UK') == ['london', 'uk']
+    assert matcher.matches('Bristol')
+
+
+def test_multi_word(matcher):
+    """Multi word places match as one place"""
+    assert matcher.places('Milton Keynes') == ['milton keynes']
+    assert matcher.places('Newcastle upon Tyne, England') == [
+        'newcastle upon tyne', 'england']
+
+
+def test_no_match(matcher):
+    """Places not in the list, and missing locations, don't match"""
+    assert not matcher.matches('San Francisco, CA')
+    assert not matcher.matches('')
+    assert not matcher.matches(None)
+
+
+def test_exclusions(matcher):
+    """Error names and New York are excluded"""
+    assert not matcher.matches('New York')
+    assert not matcher.matches('Cambridge MA')
+    assert matcher.matches('Cambridge')
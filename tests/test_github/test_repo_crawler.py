@@ -0,0 +1,95 @@
+import requests
+
+from benchmarks.mock_github import MockGitHub
+from innovation_networks.data_gathering.github import api_client, crawl_state, repo_crawler
+
+
+def test_crawl_concurrent():
+    """Every repo is fetched and returned in the input's order"""
+    users = {'user{}'.format(i): 5 for i in range(6)}
+    data = {login: [{'name': 'repo{}'.format(i)} for i in range(n)]
+            for login, n in users.items()}
+    with MockGitHub(users, latency=0.01) as api:
+        client = api_client.GitHubClient(base_url=api.url, concurrency=8)
+        crawler = repo_crawler.RepoCrawler(client, concurrency=8)
+        result = crawler.run(data)
+
+    assert list(result) == list(users)
+    assert [x['full_name'] for x in result['user3']] == [
+        'user3/repo{}'.format(i) for i in range(5)]
+    summary = crawler.metrics.summary()
+    assert summary['repos'] == 30
+    assert summary['quota_used'] == 30
+    assert summary['repos_per_minute'] > 0
+
+
+def test_crawl_retries_server_errors():
+    """5xx responses are retried with backoff"""
+    data = {'a': [{'name': 'repo0'}]}
+    with MockGitHub({'a': 1}, failures={'/repos/a/repo0': 2}) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        crawler = repo_crawler.RepoCrawler(client, backoff=0.01)
+        result = crawler.run(data)
+
+    assert result['a'][0]['full_name'] == 'a/repo0'
+    assert crawler.metrics.retries == 2
+
+
+def test_crawl_error_ledger(tmpdir):
+    """Repos that keep failing go in the ledger and can be retried"""
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    data = {'a': [{'name': 'repo0'}, {'name': 'repo1'}], 'gone': [{'name': 'x'}]}
+    with MockGitHub({'a': 2}, failures={'/repos/a/repo1': 3}) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        crawler = repo_crawler.RepoCrawler(client, state=state, retries=1,
+                                           backoff=0.01)
+        result = crawler.run(data)
+        assert [x['name'] for x in result['a']] == ['repo0']
+        assert result['gone'] == []
+        assert state.get(repo_crawler.FAILED, 'gone/x') == {'status': 404,
+                                                            'attempts': 1}
+
+        failed = repo_crawler.failed_repos(state)
+        assert failed == {'a': [{'name': 'repo1'}], 'gone': [{'name': 'x'}]}
+        crawler = repo_crawler.RepoCrawler(client, state=state, retries=1,
+                                           backoff=0.01)
+        result = crawler.run(failed)
+
+    assert [x['name'] for x in result['a']] == ['repo1']
+    assert repo_crawler.failed_repos(state) == {'gone': [{'name': 'x'}]}
+    assert [x['name'] for x in
+            repo_crawler.recorded_repos(data, state)['a']] == ['repo0', 'repo1']
+
+
+class HTMLSession(object):
+    """A session whose every response is a 200 HTML page, as from a proxy"""
+
+    def request(self, method, url, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b'<html>Bad gateway</html>'
+        response.url = url
+        return response
+
+
+def test_crawl_undecodable(tmpdir):
+    """A 200 that isn't JSON is retried and then goes in the ledger"""
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    client = api_client.GitHubClient(session=HTMLSession())
+    crawler = repo_crawler.RepoCrawler(client, state=state, retries=1,
+                                       backoff=0.01)
+    result = crawler.run({'a': [{'name': 'repo0'}]})
+
+    assert result['a'] == []
+    assert crawler.metrics.retries == 1
+    assert state.get(repo_crawler.FAILED, 'a/repo0')['attempts'] == 2
+    assert repo_crawler.failed_repos(state) == {'a': [{'name': 'repo0'}]}
+
+
+def test_retryable():
+    """Only server errors are retried, the client has already waited out
+    rate limits"""
+    assert repo_crawler.retryable(502)
+    assert not repo_crawler.retryable(403)
+    assert not repo_crawler.retryable(429)
+    assert not repo_crawler.retryable(404)
@@ -0,0 +1,34 @@
+from benchmarks.mock_github import MockGitHub
+from innovation_networks.data_gathering.github import api_client, crawl_state, repo_details
+
+
+def test_repos_url():
+    """Test API query URLs are correctly formatted"""
+    url = repo_details.repos_url('james', 'project')
+    assert url == 'https://api.github.com/repos/james/project'
+
+
+def test_repo_crawl():
+    """Details are fetched for every repo of every user"""
+    data = {'a': [{'name': 'repo0'}, {'name': 'repo1'}], 'b': []}
+    with MockGitHub({'a': 2, 'b': 0}) as api:
+        client = api_client.GitHubClient(base_url=api.url,
+                                         credentials=['t1', 't2'])
+        result = repo_details.repo_crawl(data, client=client)
+
+    assert [x['full_name'] for x in result['a']] == ['a/repo0', 'a/repo1']
+    assert result['b'] == []
+
+
+def test_repo_crawl_resumes(tmpdir):
+    """Repos recorded in the crawl state aren't fetched again"""
+    state = crawl_state.CrawlState(str(tmpdir.join('state.sqlite')))
+    state.record('repo', 'a/repo0', {'full_name': 'a/repo0', 'cached': True})
+    data = {'a': [{'name': 'repo0'}, {'name': 'repo1'}]}
+    with MockGitHub({'a': 2}) as api:
+        client = api_client.GitHubClient(base_url=api.url)
+        result = repo_details.repo_crawl(data, client=client, state=state)
+
+    assert len(api.requests) == 1
+    assert result['a'][0]['cached']
+    assert state.get('repo', 'a/repo1')['full_name'] == 'a/repo1'
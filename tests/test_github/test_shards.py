@@ -0,0 +1,126 @@
+import gzip
+import os
+
+from innovation_networks.data_gathering.github import shards
+
+
+def write_shard(store, key, lines):
+    path = store.path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with gzip.open(path, 'wb') as fp:
+        fp.write(''.join(x + '\n' for x in lines).encode())
+    return path
+
+
+def test_shard_key():
+    """Keys come from the archive file name"""
+    url = 'http://data.githubarchive.org/2016-06-22-05.json.gz'
+    assert shards.shard_key(url) == '2016-06-22-05'
+
+
+def test_url_path(tmpdir):
+    """Shards are partitioned by day"""
+    store = shards.ShardStore(str(tmpdir))
+    path = store.url_path('http://data.githubarchive.org/2016-06-22-05.json.gz')
+    assert path == os.path.join(str(tmpdir), '2016-06-22', '2016-06-22-05.json.gz')
+
+
+def test_add_indexes_shards(tmpdir):
+    """Index records size, events and checksum and is persisted"""
+    store = shards.ShardStore(str(tmpdir))
+    path = write_shard(store, '2016-06-22-00', ['{"a": 1}', '{"a": 2}'])
+    store.add(['2016-06-22-00'])
+
+    index = shards.ShardStore(str(tmpdir)).index
+    assert index['2016-06-22-00']['events'] == 2
+    assert index['2016-06-22-00']['bytes'] == os.path.getsize(path)
+    assert len(index['2016-06-22-00']['sha256']) == 64
+
+
+def test_corrupted(tmpdir):
+    """Truncated and missing shards are reported as corrupt"""
+    store = shards.ShardStore(str(tmpdir))
+    for hour in range(3):
+        write_shard(store, '2016-06-22-0{}'.format(hour), ['{"a": 1}'])
+    store.add(['2016-06-22-00', '2016-06-22-01', '2016-06-22-02'])
+
+    with open(store.path('2016-06-22-01'), 'r+b') as fp:
+        fp.truncate(10)
+    os.remove(store.path('2016-06-22-02'))
+
+    assert store.corrupted() == ['2016-06-22-01', '2016-06-22-02']
+
+
+def test_pending(tmpdir):
+    """Stages only see shards they haven't processed in their current form"""
+    store = shards.ShardStore(str(tmpdir))
+    write_shard(store, '2016-06-22-00', ['{"a": 1}'])
+    write_shard(store, '2016-06-22-01', ['{"a": 1}'])
+    store.add(['2016-06-22-00', '2016-06-22-01'])
+    store.mark_processed(['2016-06-22-00'], 'parse_users')
+
+    assert store.pending('parse_users') == ['2016-06-22-01']
+
+    # A changed shard has to be processed again
+    write_shard(store, '2016-06-22-00', ['{"a": 2}', '{"a": 3}'])
+    store.add(['2016-06-22-00'])
+    assert store.pending('parse_users') == ['2016-06-22-00', '2016-06-22-01']
+
+
+def test_verify_shard(tmpdir):
+    """Complete shards of JSON lines are healthy, across gzip members"""
+    path = str(tmpdir.join('shard.json.gz'))
+    with open(path, 'wb') as fp:
+        fp.write(gzip.compress(b'{"a": 1}\n{"a": 2}\n'))
+        fp.write(gzip.compress(b'{"a": 3}'))
+    health = shards.verify_shard(path, backend='json')
+    assert health['ok']
+    assert health['events'] == 3
+    assert health['sha256'] == shards.shard_stats(path)['sha256']
+
+
+def test_verify_shard_damage(tmpdir):
+    """Truncated streams, bad lines and non-gzip bodies are all caught"""
+    lines = b''.join(b'{"a": %d}\n' % i for i in range(1000))
+    truncated = str(tmpdir.join('truncated.json.gz'))
+    with open(truncated, 'wb') as fp:
+        fp.write(gzip.compress(lines)[:-20])
+    health = shards.verify_shard(truncated)
+    assert not health['ok']
+    assert health['error'].startswith('EOFError')
+
+    bad = str(tmpdir.join('bad.json.gz'))
+    with open(bad, 'wb') as fp:
+        fp.write(gzip.compress(b'{"a": 1}\n{"a": \n'))
+    health = shards.verify_shard(bad)
+    assert (health['ok'], health['events'], health['bad_lines']) == (False, 1, 1)
+    assert shards.verify_shard(bad, max_bad_lines=1)['ok']
+
+    # An error page saved in place of the archive
+    page = str(tmpdir.join('page.json.gz'))
+    with open(page, 'wb') as fp:
+        fp.write(b'<html>Not Found</html>')
+    assert shards.verify_shard(page)['error'].startswith('error')
+    assert shards.verify_shard(str(tmpdir.join('missing')))['error']
+
+
+def test_verify(tmpdir):
+    """Health is kept in the index and damaged shards can be removed"""
+    store = shards.ShardStore(str(tmpdir))
+    write_shard(store, '2016-06-22-00', ['{"a": 1}'])
+    write_shard(store, '2016-06-22-01', ['{"a": 1}', 'not json'])
+    store.add(['2016-06-22-00', '2016-06-22-01'])
+    healths = store.verify(workers=2)
+
+    assert healths['2016-06-22-00']['ok']
+    assert not healths['2016-06-22-01']['ok']
+    index = shards.ShardStore(str(tmpdir)).index
+    assert index['2016-06-22-01']['health']['bad_lines'] == 1
+    assert store.damaged() == ['2016-06-22-01']
+
+    summary = shards.verify_summary(list(healths.values()), 1.0)
+    assert (summary['shards'], summary['damaged'], summary['events']) == (2, 1, 2)
+
+    store.remove('2016-06-22-01')
+    assert store.keys() == ['2016-06-22-00']
+    assert not os.path.exists(store.path('2016-06-22-01'))
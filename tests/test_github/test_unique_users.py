@@ -0,0 +1,64 @@
+import io
+import json
+
+from innovation_networks.data_gathering.github import unique_users
+
+
+def events(n_users, repeats):
+    """Users as parse_users produces them, each seen repeats times"""
+    for i in range(repeats):
+        for n in range(n_users):
+            yield {'user': 'user{}'.format(n),
+                   'attributes': {'login': 'user{}'.format(n), 'seen': i}}
+
+
+def test_keeps_latest():
+    """Each login appears once with its latest attributes"""
+    users = unique_users.UniqueUsers()
+    users.update(events(3, 4))
+    assert sorted(users.items(), key=lambda x: x['user']) == [
+        {'user': 'user{}'.format(n),
+         'attributes': {'login': 'user{}'.format(n), 'seen': 3}}
+        for n in range(3)]
+
+
+def test_sender_keeps_attributes():
+    """A bare login from a sender doesn't wipe known attributes"""
+    users = unique_users.UniqueUsers()
+    users.add({'user': 'james', 'attributes': {'location': 'London'}})
+    users.add('james')
+    users.add('sender')
+    assert dict(users) == {'james': {'location': 'London'}, 'sender': {}}
+
+
+def test_merge():
+    """Attributes from every event are merged when asked"""
+    users = unique_users.UniqueUsers(merge=True)
+    users.add({'user': 'james', 'attributes': {'location': 'London'}})
+    users.add({'user': 'james', 'attributes': {'company': 'Nesta'}})
+    assert dict(users) == {'james': {'location': 'London',
+                                     'company': 'Nesta'}}
+
+
+def test_spill_matches_memory(tmpdir):
+    """Spilling to disk gives the same users as holding them in memory"""
+    in_memory = unique_users.UniqueUsers()
+    in_memory.update(events(50, 3))
+    with unique_users.UniqueUsers(memory_limit=7, spill_dir=str(tmpdir),
+                                  partitions=4) as spilled:
+        spilled.update(events(50, 3))
+        assert spilled.spilled
+        assert len(spilled.users) < 7
+        assert dict(spilled) == dict(in_memory)
+        assert len(spilled) == 50
+    assert tmpdir.listdir() == []
+
+
+def test_write_jsonl():
+    """Users are written one per line"""
+    users = unique_users.UniqueUsers()
+    users.update(events(2, 2))
+    fp = io.StringIO()
+    assert users.write_jsonl(fp) == 2
+    lines = [json.loads(x) for x in fp.getvalue().splitlines()]
+    assert [x['user'] for x in lines] == ['user0', 'user1']
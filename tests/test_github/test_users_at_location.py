@@ -0,0 +1,61 @@
+import json
+import sys
+
+from innovation_networks.data_gathering.github import users_at_location
+from innovation_networks.data_gathering.github.place_matcher import PlaceMatcher
+
+USERS = [{'user': 'a', 'attributes': {'location': 'London, UK'}},
+         {'user': 'b', 'attributes': {'location': 'New York'}},
+         {'user': 'c', 'attributes': {'location': 'Cambridge MA'}},
+         {'user': 'd', 'attributes': {}},
+         {'user': 'e', 'attributes': {'location': None}},
+         'sender_only',
+         {'user': 'f', 'attributes': {'location': 'Milton Keynes'}}]
+
+
+def test_filter_users():
+    """Each matching user is yielded exactly once"""
+    matcher = PlaceMatcher(['london', 'uk', 'york', 'cambridge',
+                            'milton keynes'], ['cambridge ma'])
+    users = users_at_location.filter_users(iter(USERS), matcher)
+    assert [x['user'] for x in users] == ['a', 'f']
+
+
+def test_main(tmpdir, monkeypatch):
+    """JSON Lines input is filtered into a JSON array"""
+    datafile = tmpdir.join('users.jsonl')
+    datafile.write(''.join(json.dumps(x) + '\n' for x in USERS))
+    outfile = tmpdir.join('uk_users.json')
+    monkeypatch.setattr(sys, 'argv', [
+        'users_at_location',
+        'innovation_networks/data/towns_and_cities_2015.txt',
+        'innovation_networks/data/error_names.txt',
+        str(datafile), str(outfile)])
+    users_at_location.main()
+    assert [x['user'] for x in json.loads(outfile.read())] == ['a', 'f']
+
+
+def test_filter_parallel():
+    """Users come back in input order, exactly as serially"""
+    matcher = PlaceMatcher(['london', 'uk', 'york', 'cambridge',
+                            'milton keynes'], ['cambridge ma'])
+    users = USERS * 3 + [{'user': 'g', 'attributes': {'location': 'York'}}]
+    serial = list(users_at_location.filter_users(iter(users), matcher))
+    parallel = list(users_at_location.filter_parallel(
+        iter(users), matcher, processes=2, chunk_size=2))
+    assert [x['user'] for x in parallel] == ['a', 'f'] * 3 + ['g']
+    assert parallel == serial
+
+
+def test_main_processes(tmpdir, monkeypatch):
+    datafile = tmpdir.join('users.jsonl')
+    datafile.write(''.join(json.dumps(x) + '\n' for x in USERS))
+    outfile = tmpdir.join('uk_users.jsonl')
+    monkeypatch.setattr(sys, 'argv', [
+        'users_at_location',
+        'innovation_networks/data/towns_and_cities_2015.txt',
+        'innovation_networks/data/error_names.txt',
+        str(datafile), str(outfile), '--processes', '2',
+        '--chunk-size', '1'])
+    users_at_location.main()
+    assert [json.loads(x)['user'] for x in outfile.readlines()] == ['a', 'f']